@@ -0,0 +1 @@
+# Shared helpers used by the agents in this repo (sessions, storage, memory, tooling)
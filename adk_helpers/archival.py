@@ -0,0 +1,389 @@
+# Cold-session archival: a TTL sweeper moving idle sessions into an append-only archive
+# file, and a session service layer restoring them transparently on the next access
+#
+# Usage (one pass, the SessionSweeper runs the same pass in the background):
+#   python -m adk_helpers.archival my_agent.db chatbot.db --ttl-days 30
+
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import DatabaseSessionService
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    MetaData,
+    String,
+    Table,
+    func,
+    inspect,
+    text,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Tables whose rows belong to a session, child tables first; missing ones are skipped.
+# state_entries (DeltaStateSessionService) only holds the session's own keys under its id
+SESSION_TABLES = ("event_payloads", "events", "state_entries", "sessions")
+
+metadata = MetaData()
+
+archived_sessions = Table(
+    "archived_sessions",
+    metadata,
+    Column("app_name", String(128), primary_key=True),
+    Column("user_id", String(128), primary_key=True),
+    Column("session_id", String(128), primary_key=True),
+    Column("archive_path", String(1024), nullable=False),
+    Column("offset", BigInteger, nullable=False),
+    Column("length", BigInteger, nullable=False),
+    Column("archived_at", DateTime, default=func.now()),
+)
+
+
+class SessionArchive:
+    """Append-only archive of sessions next to a DatabaseSessionService database.
+
+    Every archived session is one gzip member (so the file reads as .jsonl.gz)
+    holding the raw rows of the session, its events and their payloads. The
+    `archived_sessions` table indexes the members by session.
+    """
+
+    def __init__(self, session_service: DatabaseSessionService, archive_path: Optional[str] = None):
+        self.db_engine = session_service.db_engine
+        if archive_path is None:
+            database = self.db_engine.url.database
+            if not database or database == ":memory:":
+                raise ValueError("archive_path is required for non file-based databases")
+            archive_path = database + ".archive.jsonl.gz"
+        self.archive_path = archive_path
+        metadata.create_all(self.db_engine)
+
+    def sweep(self, ttl: timedelta, batch_size: int = 100) -> dict[str, Any]:
+        """Archive every session idle for longer than `ttl`.
+
+        Idle means neither the session row (state changes) nor any of its events
+        changed. Returns how many sessions / rows were moved and the bytes reclaimed.
+        """
+        # update_time is stored in UTC, event timestamps in local time
+        utc_cutoff = datetime.utcnow() - ttl
+        local_cutoff = datetime.now() - ttl
+        freed_before = self._free_bytes()
+        report = {"sessions": 0, "rows": 0, "archive_bytes": 0}
+
+        # Key-by-key state changes leave the session row untouched
+        recent_state_entries = ""
+        if "state_entries" in self._session_tables():
+            recent_state_entries = (
+                " AND NOT EXISTS ("
+                "  SELECT 1 FROM state_entries se WHERE se.app_name = s.app_name"
+                "  AND se.user_id = s.user_id AND se.session_id = s.id"
+                "  AND se.update_time >= :utc_cutoff)"
+            )
+
+        while True:
+            with self.db_engine.connect() as connection:
+                idle = connection.execute(
+                    text(
+                        "SELECT app_name, user_id, id FROM sessions s"
+                        " WHERE update_time < :utc_cutoff AND NOT EXISTS ("
+                        "  SELECT 1 FROM events e WHERE e.app_name = s.app_name"
+                        "  AND e.user_id = s.user_id AND e.session_id = s.id"
+                        "  AND e.timestamp >= :local_cutoff)"
+                        + recent_state_entries
+                        + " LIMIT :limit"
+                    ),
+                    {"utc_cutoff": utc_cutoff, "local_cutoff": local_cutoff, "limit": batch_size},
+                ).fetchall()
+            if not idle:
+                break
+            for app_name, user_id, session_id in idle:
+                moved = self.archive_session(app_name, user_id, session_id, local_cutoff)
+                if moved:
+                    report["sessions"] += 1
+                    report["rows"] += moved["rows"]
+                    report["archive_bytes"] += moved["bytes"]
+            if len(idle) < batch_size:
+                break
+
+        # Freed pages are reused by later writes, the file shrinks only on VACUUM
+        report["db_bytes_reclaimed"] = max(self._free_bytes() - freed_before, 0)
+        return report
+
+    def archive_session(
+        self,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        idle_since: Optional[datetime] = None,
+    ) -> Optional[dict[str, int]]:
+        """Move one session to the archive, returns None if it is gone or became active."""
+        key = {"app_name": app_name, "user_id": user_id, "session_id": session_id}
+        tables = self._session_tables()
+
+        with self.db_engine.begin() as connection:
+            # Write first: on SQLite this takes the writer lock, so no event can be
+            # appended to the session between the read below and the delete
+            connection.execute(
+                archived_sessions.insert().values(
+                    **key, archive_path=self.archive_path, offset=-1, length=0
+                )
+            )
+            rows = {
+                table: [
+                    {name: _encode_value(value) for name, value in row._mapping.items()}
+                    for row in connection.execute(
+                        text(f"SELECT * FROM {table} WHERE {_session_filter(table)}"), key
+                    )
+                ]
+                for table in tables
+            }
+            if not rows["sessions"]:
+                connection.rollback()
+                return None
+            if idle_since is not None and connection.execute(
+                text(
+                    "SELECT 1 FROM events WHERE app_name = :app_name AND user_id = :user_id"
+                    " AND session_id = :session_id AND timestamp >= :idle_since LIMIT 1"
+                ),
+                {**key, "idle_since": idle_since},
+            ).first():
+                connection.rollback()
+                return None
+
+            record = gzip.compress(
+                json.dumps({**key, "archived_at": datetime.utcnow().isoformat(), "rows": rows}).encode("utf-8")
+            )
+            offset = self._append(record)
+
+            connection.execute(
+                archived_sessions.update()
+                .where(*_archived_key(key))
+                .values(offset=offset, length=len(record))
+            )
+            for table in tables:
+                connection.execute(
+                    text(f"DELETE FROM {table} WHERE {_session_filter(table)}"), key
+                )
+
+        return {"rows": sum(len(table_rows) for table_rows in rows.values()), "bytes": len(record)}
+
+    def restore_session(self, app_name: str, user_id: str, session_id: str) -> bool:
+        """Move an archived session back into the database, returns False if not archived."""
+        key = {"app_name": app_name, "user_id": user_id, "session_id": session_id}
+        with self.db_engine.begin() as connection:
+            entry = connection.execute(
+                archived_sessions.select().where(*_archived_key(key))
+            ).first()
+            if entry is None or entry.offset < 0:
+                return False
+
+            with open(entry.archive_path, "rb") as archive:
+                archive.seek(entry.offset)
+                record = json.loads(gzip.decompress(archive.read(entry.length)))
+
+            # Parents first when inserting
+            for table in reversed(SESSION_TABLES):
+                for row in record["rows"].get(table, []):
+                    columns = ", ".join(row)
+                    values = ", ".join(f":{name}" for name in row)
+                    connection.execute(
+                        text(f"INSERT INTO {table} ({columns}) VALUES ({values})"),
+                        {name: _decode_value(value) for name, value in row.items()},
+                    )
+            connection.execute(archived_sessions.delete().where(*_archived_key(key)))
+        return True
+
+    def is_archived(self, app_name: str, user_id: str, session_id: str) -> bool:
+        key = {"app_name": app_name, "user_id": user_id, "session_id": session_id}
+        with self.db_engine.connect() as connection:
+            return connection.execute(
+                archived_sessions.select().where(*_archived_key(key))
+            ).first() is not None
+
+    def _append(self, record: bytes) -> int:
+        with open(self.archive_path, "ab") as archive:
+            offset = archive.tell()
+            archive.write(record)
+            archive.flush()
+            # The record must be durable before its rows are deleted
+            os.fsync(archive.fileno())
+        return offset
+
+    def _session_tables(self) -> list[str]:
+        existing = set(inspect(self.db_engine).get_table_names())
+        return [table for table in SESSION_TABLES if table in existing]
+
+    def _free_bytes(self) -> int:
+        if self.db_engine.dialect.name != "sqlite":
+            return 0
+        with self.db_engine.connect() as connection:
+            page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+            free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        return page_size * free_pages
+
+
+class SessionSweeper:
+    """Background task running SessionArchive.sweep every `interval` seconds."""
+
+    def __init__(self, archive: SessionArchive, ttl: timedelta, interval: float = 3600.0):
+        self.archive = archive
+        self.ttl = ttl
+        self.interval = interval
+        self.last_report: Optional[dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # The sweep does blocking database and file I/O, keep it off the loop
+                self.last_report = await asyncio.to_thread(self.archive.sweep, self.ttl)
+            except Exception:
+                # Often transient (database locked by a writer), the next pass tries again
+                logger.exception("Session sweeper: sweep failed")
+            else:
+                logger.info(
+                    "Session sweeper: archived %d sessions, %d rows, %d bytes reclaimed",
+                    self.last_report["sessions"],
+                    self.last_report["rows"],
+                    self.last_report["db_bytes_reclaimed"],
+                )
+            await asyncio.sleep(self.interval)
+
+
+class ArchivingSessionService(BaseSessionService):
+    """Restores archived sessions transparently when they are accessed again."""
+
+    def __init__(self, base_service: BaseSessionService, archive: SessionArchive):
+        self.base_service = base_service
+        self.archive = archive
+
+    async def restore_session(self, *, app_name: str, user_id: str, session_id: str) -> bool:
+        return self.archive.restore_session(app_name, user_id, session_id)
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        # An archived id is taken, restoring it makes create_session fail as it should
+        if session_id:
+            self.archive.restore_session(app_name, user_id, session_id)
+        return await self.base_service.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        session = await self.base_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+        if session is None and self.archive.restore_session(app_name, user_id, session_id):
+            session = await self.base_service.get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+        return session
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        return await self.base_service.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        self.archive.restore_session(app_name, user_id, session_id)
+        await self.base_service.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        return await self.base_service.append_event(session=session, event=event)
+
+
+def _session_filter(table: str) -> str:
+    id_column = "id" if table == "sessions" else "session_id"
+    return f"app_name = :app_name AND user_id = :user_id AND {id_column} = :session_id"
+
+
+def _archived_key(key: dict[str, str]):
+    return (
+        archived_sessions.c.app_name == key["app_name"],
+        archived_sessions.c.user_id == key["user_id"],
+        archived_sessions.c.session_id == key["session_id"],
+    )
+
+
+def _encode_value(value):
+    # Raw column values to JSON: BLOBs (pickled actions, payloads) and datetimes are tagged
+    if isinstance(value, (bytes, memoryview)):
+        return {"$b64": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and len(value) == 1:
+        if "$b64" in value:
+            return base64.b64decode(value["$b64"])
+        if "$dt" in value:
+            return datetime.fromisoformat(value["$dt"])
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Archive the sessions of ADK session databases idle for longer than a TTL"
+    )
+    parser.add_argument("databases", nargs="+", help="SQLite session database files")
+    parser.add_argument("--ttl-days", type=float, default=30.0)
+    args = parser.parse_args()
+
+    for db_path in args.databases:
+        archive = SessionArchive(DatabaseSessionService(db_url=f"sqlite:///{db_path}"))
+        report = archive.sweep(timedelta(days=args.ttl_days))
+        print(
+            f"{db_path}: archived {report['sessions']} sessions, {report['rows']} rows"
+            f" ({report['archive_bytes']} archive bytes), {report['db_bytes_reclaimed']} bytes reclaimed"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# BM25 memory service for the load_memory tool
+#
+# InMemoryMemoryService answers a search by scanning every remembered event, and
+# returns every event sharing one word with the query, unranked. This service
+# keeps an inverted index per user (term -> postings of event id and term
+# frequency), ranks with BM25 and stops scanning postings once they can no longer
+# change the top-k (MaxScore): the long postings of common terms are only probed
+# for the candidates found through the rare ones. The length normalization is
+# applied at query time against the current average length, adding an event
+# only touches the postings of its own terms.
+#
+# Usage:
+#   memory_service = BM25MemoryService(top_k=10)
+#   Runner(app=..., session_service=..., memory_service=memory_service)
+
+import heapq
+import math
+import re
+import threading
+from typing import Optional
+
+from google.adk.events.event import Event
+from google.adk.memory import _utils
+from google.adk.memory.base_memory_service import SearchMemoryResponse
+from google.adk.memory.memory_entry import MemoryEntry
+
+from adk_helpers.memory import IncrementalMemoryService, event_text
+
+
+# Too frequent to tell events apart, dropped from documents and queries
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her him his how i if in into is it"
+    " its me my no not of on or our she so that the their them then there these they this to us was we"
+    " were what when where which who why will with you your".split()
+)
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words and numbers of a text, stopwords removed."""
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class _UserIndex:
+    """Inverted index of the events remembered for one user."""
+
+    def __init__(self, k1: float, b: float):
+        self.k1 = k1
+        self.b = b
+        # Documents, by position: the event, and its length in tokens
+        self.events: list[Event] = []
+        self.lengths: list[int] = []
+        self.total_length = 0
+        # term -> {document: term frequency}, documents in insertion order
+        self.postings: dict[str, dict[int, int]] = {}
+        # term -> highest frequency and shortest document in its postings, the
+        # weight of the term is at most the one of that frequency in that length
+        self.bounds: dict[str, tuple[int, int]] = {}
+
+    def add(self, event: Event, tokens: list[str]):
+        document = len(self.events)
+        self.events.append(event)
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        frequencies: dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for term, tf in frequencies.items():
+            self.postings.setdefault(term, {})[document] = tf
+            max_tf, min_length = self.bounds.get(term, (tf, len(tokens)))
+            self.bounds[term] = (max(max_tf, tf), min(min_length, len(tokens)))
+
+    def weigher(self):
+        """BM25 weight of a term frequency in a document of a given length, idf aside."""
+        k1 = self.k1
+        fixed = k1 * (1 - self.b)
+        per_token = k1 * self.b * len(self.events) / self.total_length
+
+        def weight(tf: int, length: int) -> float:
+            return tf * (k1 + 1) / (tf + fixed + per_token * length)
+
+        return weight
+
+
+class BM25MemoryService(IncrementalMemoryService):
+    """Memory service ranking remembered events with BM25 over an inverted index.
+
+    Events are indexed once, as they are added (see IncrementalMemoryService).
+    search_memory returns the `top_k` best events, best first.
+
+    Args:
+        top_k: Number of events returned by a search.
+        k1: BM25 term frequency saturation.
+        b: BM25 document length normalization.
+    """
+
+    def __init__(self, top_k: int = 10, k1: float = 1.2, b: float = 0.75):
+        super().__init__()
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._indexes: dict[str, _UserIndex] = {}
+
+    async def add_events_to_memory(self, *, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        documents = [(event, tokenize(event_text(event))) for event in events]
+        with self._lock:
+            index = self._indexes.setdefault(f"{app_name}/{user_id}", _UserIndex(self.k1, self.b))
+            for event, tokens in documents:
+                if tokens:
+                    index.add(event, tokens)
+
+    async def search_memory(self, *, app_name: str, user_id: str, query: str) -> SearchMemoryResponse:
+        with self._lock:
+            index = self._indexes.get(f"{app_name}/{user_id}")
+            ranked = self._search(index, query, self.top_k) if index is not None else []
+
+        response = SearchMemoryResponse()
+        for _, event in ranked:
+            response.memories.append(
+                MemoryEntry(
+                    content=event.content,
+                    author=event.author,
+                    timestamp=_utils.format_timestamp(event.timestamp),
+                )
+            )
+        return response
+
+    def search(self, app_name: str, user_id: str, query: str, top_k: Optional[int] = None) -> list[tuple[float, Event]]:
+        """The best events for the query with their BM25 scores, best first."""
+        with self._lock:
+            index = self._indexes.get(f"{app_name}/{user_id}")
+            return self._search(index, query, top_k or self.top_k) if index is not None else []
+
+    def _search(self, index: _UserIndex, query: str, top_k: int) -> list[tuple[float, Event]]:
+        documents = len(index.events)
+        if not documents:
+            return []
+
+        weight = index.weigher()
+        lengths = index.lengths
+        terms = []
+        for term in set(tokenize(query)):
+            postings = index.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            terms.append((idf * weight(*index.bounds[term]), idf, postings))
+        # Rare terms first: they have the highest bounds and the shortest postings
+        terms.sort(key=lambda term: term[0], reverse=True)
+
+        remaining = sum(term[0] for term in terms)
+        scores: dict[int, float] = {}
+        for upper_bound, idf, postings in terms:
+            if not scores:
+                scores = {document: idf * weight(tf, lengths[document]) for document, tf in postings.items()}
+            elif len(scores) >= top_k and remaining <= heapq.nlargest(top_k, scores.values())[-1]:
+                # A document outside the candidates cannot reach the top-k any more:
+                # probe this term for the candidates only, skip the rest of its postings
+                if len(postings) < len(scores):
+                    for document, tf in postings.items():
+                        if document in scores:
+                            scores[document] += idf * weight(tf, lengths[document])
+                else:
+                    for document in scores:
+                        tf = postings.get(document)
+                        if tf:
+                            scores[document] += idf * weight(tf, lengths[document])
+            else:
+                for document, tf in postings.items():
+                    scores[document] = scores.get(document, 0.0) + idf * weight(tf, lengths[document])
+            remaining -= upper_bound
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, index.events[document]) for document, score in best]
@@ -0,0 +1,495 @@
+# Event compaction triggered by the estimated prompt size instead of a number of invocations
+#
+# EventsCompactionConfig(compaction_interval, overlap_size) summarizes every N
+# invocations whatever they cost: chit-chat gets summarized for nothing while a
+# few large tool outputs can blow the context before N is reached. The plugin
+# below runs after every invocation and only summarizes when the history the
+# next prompt would be built from is over a token budget.
+#
+# With merge_fanout the summaries are hierarchical: raw events are summarized
+# once, without overlap, into level-0 summaries, and every merge_fanout summaries
+# of one level are merged into a summary of the next level, from their text only.
+# A session of n invocations keeps O(log n) summaries in the prompt and each event
+# reaches the summarization model O(log n) times, instead of once per overlap.
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.apps.base_events_summarizer import BaseEventsSummarizer
+from google.adk.apps.llm_event_summarizer import LlmEventSummarizer
+from google.adk.events.event import Event
+from google.adk.events.event_actions import EventCompaction
+from google.adk.plugins.base_plugin import BasePlugin
+from google.adk.sessions import BaseSessionService, Session
+
+
+logger = logging.getLogger(__name__)
+
+# Rough size of one token in characters for English text and JSON
+CHARS_PER_TOKEN = 4
+# Tokens charged for an inline image / file part (Gemini bills an image as 258 tokens)
+MEDIA_PART_TOKENS = 258
+# custom_metadata key holding the level of a summary, absent for level 0
+SUMMARY_LEVEL_KEY = "compaction_level"
+
+MERGE_PROMPT_TEMPLATE = (
+    "The following are consecutive summaries of one conversation between a user and"
+    " an AI agent, oldest first. Merge them into a single summary, keeping key"
+    " information and decisions made, as well as any unresolved questions or tasks."
+    " The summary should be concise.\n\n{conversation_history}"
+)
+
+
+def estimate_event_tokens(event: Event) -> int:
+    """Estimate how many prompt tokens an event adds, from the size of its parts."""
+    content = event.content
+    compaction = compaction_of(event)
+    if compaction is not None:
+        content = compaction.compacted_content
+    if not content or not content.parts:
+        return 0
+
+    chars = 0
+    media_tokens = 0
+    for part in content.parts:
+        if part.text:
+            chars += len(part.text)
+        if part.function_call:
+            chars += len(part.function_call.name or "")
+            chars += len(json.dumps(part.function_call.args or {}, default=str))
+        if part.function_response:
+            chars += len(part.function_response.name or "")
+            chars += len(json.dumps(part.function_response.response or {}, default=str))
+        if part.inline_data or part.file_data:
+            media_tokens += MEDIA_PART_TOKENS
+    return chars // CHARS_PER_TOKEN + media_tokens
+
+
+def compaction_of(event: Event) -> Optional[EventCompaction]:
+    """The compaction of a summary event, None for other events."""
+    compaction = event.actions.compaction if event.actions else None
+    if isinstance(compaction, dict):
+        # DatabaseSessionService (ADK 1.18) hands it back as a plain dict
+        compaction = EventCompaction.model_validate(compaction)
+    return compaction
+
+
+def place_summary(compaction_event: Event):
+    """Timestamp a summary right after the last event it covers.
+
+    The prompt drops every event older than a summary's range end that comes before
+    it in the session, events appended after the range (kept verbatim, or from a
+    turn that ran during the summarization) must therefore sort after the summary.
+    """
+    compaction_event.timestamp = compaction_of(compaction_event).end_timestamp + 1e-6
+
+
+def is_compaction(event: Event) -> bool:
+    return bool(event.actions and event.actions.compaction)
+
+
+def summary_level(event: Event) -> int:
+    return (event.custom_metadata or {}).get(SUMMARY_LEVEL_KEY, 0)
+
+
+def live_summaries(events: list[Event]) -> list[Event]:
+    """Summary events not merged into a higher level summary, oldest first."""
+    summaries = []
+    for event in events:
+        compaction = compaction_of(event)
+        if compaction is not None and compaction.start_timestamp is not None and compaction.end_timestamp is not None:
+            summaries.append((summary_level(event), compaction.start_timestamp, compaction.end_timestamp, event))
+    return [
+        event
+        for level, start, end, event in summaries
+        if not any(
+            other_level > level and other_start <= start and other_end >= end
+            for other_level, other_start, other_end, _ in summaries
+        )
+    ]
+
+
+def _summary_as_event(event: Event) -> Event:
+    # A summary as an input of the summarizer, timestamped where its range ends
+    compaction = compaction_of(event)
+    return Event(
+        author="summary",
+        content=compaction.compacted_content,
+        timestamp=compaction.end_timestamp,
+        invocation_id=event.invocation_id,
+    )
+
+
+def _in_timestamp_order(events: list[Event]) -> bool:
+    return all(previous.timestamp <= event.timestamp for previous, event in zip(events, events[1:]))
+
+
+def _sorted_events(events: list[Event]) -> list[Event]:
+    # In-memory sessions keep append order, summaries are appended after the events they precede
+    return events if _in_timestamp_order(events) else sorted(events, key=lambda event: event.timestamp)
+
+
+class TokenBudgetCompactionPlugin(BasePlugin):
+    """Summarizes the oldest uncompacted invocations once the history exceeds `token_budget`.
+
+    The history size is estimated the way the prompt is built: every summary plus
+    the events no summary covers. When it is over budget, the most recent
+    invocations worth `keep_recent_tokens` stay verbatim and everything before them
+    (plus `overlap_size` already summarized invocations, for continuity) is
+    summarized into one compaction event.
+
+    The summary event is timestamped where its range ends, so that the invocations
+    kept verbatim come after it; before_run_callback puts the events of the session
+    back in timestamp order for services returning them in append order.
+
+    Use it instead of EventsCompactionConfig:
+        App(name=..., root_agent=..., plugins=[TokenBudgetCompactionPlugin(token_budget=8000)])
+
+    With a `worker` the summarization runs in the background after the turn,
+    otherwise it runs at the end of run_async.
+
+    With `merge_fanout` the summaries are hierarchical: overlap_size is ignored,
+    every merge_fanout live summaries of one level are merged into one summary of
+    the next level and the merged ones are dropped from the prompt.
+
+    Args:
+        token_budget: Estimated history size above which a compaction runs.
+        keep_recent_tokens: Size of the tail of invocations that is never summarized.
+        overlap_size: Number of invocations before the window also given to the summarizer.
+        summarizer: Defaults to an LlmEventSummarizer on the root agent's model.
+        estimate_tokens: Per-event token estimator.
+        worker: CompactionWorker running the compactions off the invocation path.
+        merge_fanout: Number of summaries of one level merged together, None for flat summaries.
+        merge_summarizer: Summarizer of merges, defaults to the root agent's model with MERGE_PROMPT_TEMPLATE.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 8000,
+        keep_recent_tokens: int = 2000,
+        overlap_size: int = 1,
+        summarizer: Optional[BaseEventsSummarizer] = None,
+        estimate_tokens: Callable[[Event], int] = estimate_event_tokens,
+        worker: Optional["CompactionWorker"] = None,
+        merge_fanout: Optional[int] = None,
+        merge_summarizer: Optional[BaseEventsSummarizer] = None,
+        name: str = "token_budget_compaction",
+    ):
+        super().__init__(name=name)
+        if keep_recent_tokens >= token_budget:
+            raise ValueError("keep_recent_tokens must be smaller than token_budget")
+        if merge_fanout is not None and merge_fanout < 2:
+            raise ValueError("merge_fanout must be at least 2")
+        self.token_budget = token_budget
+        self.keep_recent_tokens = keep_recent_tokens
+        self.overlap_size = overlap_size
+        self.summarizer = summarizer
+        self.estimate_tokens = estimate_tokens
+        self.worker = worker
+        self.merge_fanout = merge_fanout
+        self.merge_summarizer = merge_summarizer
+        # Events never change once appended, their estimate is computed once
+        self._token_cache: OrderedDict[str, int] = OrderedDict()
+        self.compactions = 0
+
+    async def before_run_callback(self, *, invocation_context: InvocationContext) -> None:
+        # The prompt is built from these events, ADK expects EventCompaction objects
+        events = invocation_context.session.events
+        for event in events:
+            if event.actions and isinstance(event.actions.compaction, dict):
+                event.actions.compaction = compaction_of(event)
+        if not _in_timestamp_order(events):
+            events.sort(key=lambda event: event.timestamp)
+        if self.merge_fanout:
+            # Merged summaries are superseded by the summary merging them, left out of
+            # the events of this invocation they never reach the prompt contents
+            live = {id(event) for event in live_summaries(events)}
+            events[:] = [event for event in events if not is_compaction(event) or id(event) in live]
+        return None
+
+    async def after_run_callback(self, *, invocation_context: InvocationContext) -> None:
+        if self.summarizer is None:
+            self.summarizer = LlmEventSummarizer(llm=invocation_context.agent.canonical_model)
+        if self.merge_fanout and self.merge_summarizer is None:
+            self.merge_summarizer = LlmEventSummarizer(
+                llm=invocation_context.agent.canonical_model, prompt_template=MERGE_PROMPT_TEMPLATE
+            )
+        session = invocation_context.session
+        if self.worker is not None:
+            # Cheap check first, only sessions over budget are queued
+            if self.select_events_to_compact(session.events):
+                self.worker.submit(
+                    self, invocation_context.session_service, session.app_name, session.user_id, session.id
+                )
+            return
+        await self.maybe_compact(session, invocation_context.session_service)
+
+    async def maybe_compact(
+        self, session: Session, session_service: BaseSessionService
+    ) -> list[Event]:
+        """Append compaction events to the session if its history is over budget."""
+        compaction_events = await self.summarize(session.events)
+        for compaction_event in compaction_events:
+            await session_service.append_event(session=session, event=compaction_event)
+            self.compactions += 1
+        return compaction_events
+
+    async def summarize(self, events: list[Event]) -> list[Event]:
+        """The compaction events to append to a session with these events, oldest first.
+
+        The summary of the selected window, followed by the merges it completes.
+        """
+        events = _sorted_events(events)
+        window = self.select_events_to_compact(events)
+        if not window:
+            return []
+        compaction_event = await self.summarizer.maybe_summarize_events(events=window)
+        if compaction_event is None:
+            return []
+        place_summary(compaction_event)
+        if not self.merge_fanout:
+            return [compaction_event]
+
+        compaction_events = [compaction_event]
+        live = live_summaries(events) + [compaction_event]
+        while True:
+            group = self._merge_group(live)
+            if not group:
+                break
+            merged_event = await self.merge_summarizer.maybe_summarize_events(
+                events=[_summary_as_event(event) for event in group]
+            )
+            if merged_event is None:
+                break
+            compaction = compaction_of(merged_event)
+            compaction.start_timestamp = compaction_of(group[0]).start_timestamp
+            compaction.end_timestamp = compaction_of(group[-1]).end_timestamp
+            merged_event.custom_metadata = {SUMMARY_LEVEL_KEY: summary_level(group[0]) + 1}
+            place_summary(merged_event)
+            compaction_events.append(merged_event)
+            live = [event for event in live if all(event is not member for member in group)] + [merged_event]
+            live.sort(key=lambda event: compaction_of(event).start_timestamp)
+        return compaction_events
+
+    def prompt_tokens(self, events: list[Event]) -> int:
+        """Estimated size of the history the next prompt is built from.
+
+        Same selection as contents._process_compaction_events: every summary, and
+        the events before the start of the earliest summarized range after them.
+        Merged summaries are left out, before_run_callback drops them.
+        """
+        events = _sorted_events(events)
+        live = {id(event) for event in live_summaries(events)} if self.merge_fanout else None
+        tokens = 0
+        boundary = float("inf")
+        for event in reversed(events):
+            compaction = compaction_of(event)
+            if compaction is not None:
+                if compaction.start_timestamp is not None and compaction.end_timestamp is not None:
+                    if live is None or id(event) in live:
+                        tokens += self.estimate_tokens(event)
+                    boundary = min(boundary, compaction.start_timestamp)
+            elif event.timestamp < boundary:
+                tokens += self._tokens(event)
+        return tokens
+
+    def select_events_to_compact(self, events: list[Event]) -> list[Event]:
+        """Events to summarize, empty while the history fits the budget."""
+        events = _sorted_events(events)
+        if self.prompt_tokens(events) <= self.token_budget:
+            return []
+
+        last_compacted_end = 0.0
+        for event in events:
+            compaction = compaction_of(event)
+            if compaction is not None and compaction.end_timestamp:
+                last_compacted_end = max(last_compacted_end, compaction.end_timestamp)
+
+        # Invocations in order, with their events
+        invocations: OrderedDict[str, list[Event]] = OrderedDict()
+        for event in events:
+            if not is_compaction(event):
+                invocations.setdefault(event.invocation_id, []).append(event)
+        invocation_ids = list(invocations)
+        new_ids = [
+            invocation_id
+            for invocation_id in invocation_ids
+            if invocations[invocation_id][-1].timestamp > last_compacted_end
+        ]
+
+        # Keep the most recent invocations verbatim, up to keep_recent_tokens
+        kept = 0
+        recent_tokens = 0
+        for invocation_id in reversed(new_ids):
+            tokens = sum(self._tokens(event) for event in invocations[invocation_id])
+            if recent_tokens + tokens > self.keep_recent_tokens:
+                break
+            recent_tokens += tokens
+            kept += 1
+        to_compact = new_ids[: len(new_ids) - kept]
+        if not to_compact:
+            return []
+
+        # Hierarchical summaries carry the context on, nothing is summarized twice
+        overlap_size = 0 if self.merge_fanout else self.overlap_size
+        first = invocation_ids.index(to_compact[0])
+        window = invocation_ids[max(0, first - overlap_size): first] + to_compact
+        return [event for invocation_id in window for event in invocations[invocation_id]]
+
+    def _merge_group(self, live: list[Event]) -> list[Event]:
+        # The oldest merge_fanout live summaries of the lowest level having that many
+        by_level: dict[int, list[Event]] = {}
+        for event in live:
+            by_level.setdefault(summary_level(event), []).append(event)
+        for level in sorted(by_level):
+            if len(by_level[level]) >= self.merge_fanout:
+                return by_level[level][: self.merge_fanout]
+        return []
+
+    def _tokens(self, event: Event) -> int:
+        tokens = self._token_cache.get(event.id)
+        if tokens is None:
+            tokens = self.estimate_tokens(event)
+            self._token_cache[event.id] = tokens
+            if len(self._token_cache) > 100_000:
+                self._token_cache.popitem(last=False)
+        return tokens
+
+
+class _CompactionJob:
+    def __init__(self, policy, session_service, key):
+        self.policy = policy
+        self.session_service = session_service
+        self.key = key
+        self.submitted = time.monotonic()
+
+
+class CompactionWorker:
+    """Runs compactions in background tasks, after the turn that made them necessary.
+
+    A job re-reads the session, summarizes the window its policy selects and appends
+    each compaction event to a freshly loaded handle in one append_event, so the next
+    prompt either sees a whole summary or none of it. run_async never waits for
+    the summarization call. A session already queued is not queued twice, the job
+    picks up its latest events when it runs.
+
+    stats() reports the queue depth and the lag (submission to summary appended)
+    to see when compaction falls behind.
+    """
+
+    def __init__(self, concurrency: int = 1):
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue[_CompactionJob] = asyncio.Queue()
+        self._queued: dict[tuple[str, str, str], _CompactionJob] = {}
+        self._tasks: list[asyncio.Task] = []
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._total_lag = 0.0
+
+    def submit(self, policy, session_service: BaseSessionService, app_name: str, user_id: str, session_id: str) -> bool:
+        """Queue a compaction of the session, returns False if one is already queued."""
+        key = (app_name, user_id, session_id)
+        if key in self._queued:
+            self.coalesced += 1
+            return False
+        self._start()
+        job = _CompactionJob(policy, session_service, key)
+        self._queued[key] = job
+        self._queue.put_nowait(job)
+        self.submitted += 1
+        return True
+
+    async def drain(self):
+        """Wait until every queued compaction is done."""
+        await self._queue.join()
+
+    async def close(self):
+        """Finish the queued compactions and stop the worker tasks."""
+        if self._tasks:
+            await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        finished = self.completed + self.skipped
+        return {
+            "queue_depth": self._queue.qsize(),
+            "oldest_queued_age": max((now - job.submitted for job in self._queued.values()), default=0.0),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "mean_lag": self._total_lag / finished if finished else 0.0,
+        }
+
+    def _start(self):
+        if not self._tasks:
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            # Submissions from now on need a new job, this one may miss their events
+            self._queued.pop(job.key, None)
+            try:
+                appended = await self._compact(job)
+                if appended:
+                    self.completed += 1
+                else:
+                    self.skipped += 1
+                lag = time.monotonic() - job.submitted
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                self._total_lag += lag
+            except Exception:
+                self.failed += 1
+                logger.exception("Compaction of session %s failed", job.key)
+            finally:
+                self._queue.task_done()
+
+    async def _compact(self, job: _CompactionJob) -> bool:
+        app_name, user_id, session_id = job.key
+        session = await job.session_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            return False
+        compaction_events = await job.policy.summarize(session.events)
+        if not compaction_events:
+            return False
+
+        # The session moved on during the summarization, append to a fresh handle
+        session = await job.session_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            return False
+        end_timestamp = compaction_of(compaction_events[0]).end_timestamp
+        for event in session.events:
+            compaction = compaction_of(event)
+            if compaction is not None and compaction.end_timestamp >= end_timestamp:
+                # Someone else summarized this window meanwhile
+                return False
+        # Each append leaves a consistent history: a summary, then the merges it completes
+        for compaction_event in compaction_events:
+            await job.session_service.append_event(session=session, event=compaction_event)
+            job.policy.compactions += 1
+        return True
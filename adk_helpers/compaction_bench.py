@@ -0,0 +1,323 @@
+# Offline benchmark of event compaction settings on recorded sessions
+#
+# Usage:
+#   python -m adk_helpers.compaction_bench my_agent_with_event_compaction.db chatbot.db
+#   python -m adk_helpers.compaction_bench agent_with_memory/chatbot.db --interval 2,3,5 \
+#       --overlap 0,1,2 --token-budget 2000,8000 --repeat 20 --json report.json --per-turn turns.csv
+#
+# The sessions recorded in the `events` tables are replayed invocation by
+# invocation through the compaction pipeline, once per setting of the grid:
+# ADK's sliding window (EventsCompactionConfig) for every compaction_interval /
+# overlap_size pair, and TokenBudgetCompactionPlugin for every --token-budget.
+# Summaries come from a deterministic local stand-in model, nothing is sent to
+# Gemini and the databases are opened read-only.
+#
+# Reported per setting: prompt tokens per turn (the history the model gets with
+# the user message), the number of compaction calls, the tokens sent to the
+# summarizer and the latency compaction adds to a turn: the stand-in model's
+# modelled latency plus the measured time of the pipeline itself.
+
+import argparse
+import asyncio
+import csv
+import json
+import statistics
+import sys
+import time
+from typing import Any, AsyncGenerator, Optional
+
+from google.adk.agents import Agent
+from google.adk.apps.app import App, EventsCompactionConfig
+from google.adk.apps.compaction import _run_compaction_for_sliding_window
+from google.adk.apps.llm_event_summarizer import LlmEventSummarizer
+from google.adk.events.event import Event
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+from pydantic import PrivateAttr
+
+from adk_helpers.compaction import CHARS_PER_TOKEN, TokenBudgetCompactionPlugin
+from adk_helpers.event_export import stream_events
+
+
+class StandInModel(BaseLlm):
+    """Deterministic summarizer: keeps the head of every line, models the latency of a real call.
+
+    The summary is `summary_ratio` of the input, capped at `max_summary_tokens`.
+    Nothing sleeps, the latency of each call is computed from its token counts and
+    added up in `modelled_seconds`.
+    """
+
+    model: str = "stand-in"
+    summary_ratio: float = 0.15
+    max_summary_tokens: int = 512
+    # Roughly gemini-2.5-flash-lite through the API
+    first_token_seconds: float = 0.35
+    input_tokens_per_second: float = 20_000.0
+    output_tokens_per_second: float = 250.0
+
+    _calls: int = PrivateAttr(default=0)
+    _input_tokens: int = PrivateAttr(default=0)
+    _output_tokens: int = PrivateAttr(default=0)
+    _modelled_seconds: float = PrivateAttr(default=0.0)
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        prompt = "".join(
+            part.text for content in llm_request.contents for part in (content.parts or []) if part.text
+        )
+        input_tokens = len(prompt) // CHARS_PER_TOKEN
+        budget = min(self.max_summary_tokens, int(input_tokens * self.summary_ratio)) * CHARS_PER_TOKEN
+        lines = [line for line in prompt.split("\n") if line.strip()]
+        per_line = max(1, budget // max(1, len(lines)))
+        summary = " ".join(line[:per_line] for line in lines)[:budget] or "-"
+        output_tokens = len(summary) // CHARS_PER_TOKEN
+
+        self._calls += 1
+        self._input_tokens += input_tokens
+        self._output_tokens += output_tokens
+        self._modelled_seconds += (
+            self.first_token_seconds
+            + input_tokens / self.input_tokens_per_second
+            + output_tokens / self.output_tokens_per_second
+        )
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=summary)]))
+
+    def counters(self) -> dict[str, Any]:
+        return {
+            "calls": self._calls,
+            "input_tokens": self._input_tokens,
+            "output_tokens": self._output_tokens,
+            "modelled_seconds": self._modelled_seconds,
+        }
+
+
+def load_recorded_sessions(db_url: str, min_invocations: int = 1) -> dict[tuple[str, str, str], list[Event]]:
+    """The recorded events of every session of a database, grouped by session, in order.
+
+    Events without content (state updates, summaries of the recording run) are
+    left out: the grid decides the summaries.
+    """
+    sessions: dict[tuple[str, str, str], list[Event]] = {}
+    for batch in stream_events(db_url):
+        for record in batch:
+            if not record["content"]:
+                continue
+            key = (record["app_name"], record["user_id"], record["session_id"])
+            sessions.setdefault(key, []).append(
+                Event(
+                    id=record["id"],
+                    invocation_id=record["invocation_id"],
+                    author=record["author"],
+                    branch=record["branch"],
+                    timestamp=record["timestamp"].timestamp(),
+                    content=types.Content.model_validate(json.loads(record["content"])),
+                )
+            )
+    return {
+        key: events
+        for key, events in sessions.items()
+        if len({event.invocation_id for event in events}) >= min_invocations
+    }
+
+
+def repeat_session(events: list[Event], times: int) -> list[Event]:
+    """The session played `times` times in a row, with new ids and later timestamps."""
+    if times <= 1 or not events:
+        return events
+    span = events[-1].timestamp - events[0].timestamp + 1.0
+    repeated = []
+    for round_index in range(times):
+        for event in events:
+            repeated.append(
+                event.model_copy(
+                    update={
+                        "id": f"{event.id}-{round_index}",
+                        "invocation_id": f"{event.invocation_id}-{round_index}",
+                        "timestamp": event.timestamp + round_index * span,
+                    }
+                )
+            )
+    return repeated
+
+
+def _invocations(events: list[Event]) -> list[list[Event]]:
+    invocations: dict[str, list[Event]] = {}
+    for event in events:
+        invocations.setdefault(event.invocation_id, []).append(event)
+    return list(invocations.values())
+
+
+async def replay(setting: dict[str, Any], sessions: dict[tuple[str, str, str], list[Event]]) -> dict[str, Any]:
+    """Replay every session with one compaction setting and report its numbers."""
+    model = StandInModel()
+    summarizer = LlmEventSummarizer(llm=model)
+    agent = Agent(name="bench_agent", model=model)
+    if "token_budget" in setting:
+        app = None
+        plugin = TokenBudgetCompactionPlugin(
+            token_budget=setting["token_budget"],
+            keep_recent_tokens=setting["keep_recent_tokens"],
+            overlap_size=setting["overlap_size"],
+            summarizer=summarizer,
+        )
+        meter = plugin
+    else:
+        app = App(
+            name="compaction_bench",
+            root_agent=agent,
+            events_compaction_config=EventsCompactionConfig(
+                compaction_interval=setting["compaction_interval"],
+                overlap_size=setting["overlap_size"],
+                summarizer=summarizer,
+            ),
+        )
+        plugin = None
+        # Only used to measure prompts, its budget never triggers anything
+        meter = TokenBudgetCompactionPlugin(token_budget=sys.maxsize, keep_recent_tokens=0)
+
+    session_service = InMemorySessionService()
+    prompt_tokens: list[int] = []
+    turns: list[dict[str, Any]] = []
+    pipeline_seconds = 0.0
+    for (app_name, user_id, session_id), events in sessions.items():
+        session = await session_service.create_session(app_name="compaction_bench", user_id=user_id)
+        for turn, invocation in enumerate(_invocations(events)):
+            for event in invocation:
+                await session_service.append_event(session=session, event=event.model_copy())
+                if event is invocation[0]:
+                    # The first request of the turn: the history and the user message
+                    tokens = meter.prompt_tokens(session.events)
+                    prompt_tokens.append(tokens)
+                    turns.append({"session": f"{app_name}/{session_id}", "turn": turn, "prompt_tokens": tokens})
+
+            model_seconds = model.counters()["modelled_seconds"]
+            started = time.perf_counter()
+            if plugin is not None:
+                await plugin.maybe_compact(session, session_service)
+            else:
+                await _run_compaction_for_sliding_window(app, session, session_service)
+            # The stand-in's modelled latency is not wall time, keep the two apart
+            pipeline_seconds += time.perf_counter() - started
+            turns[-1]["compaction_seconds"] = model.counters()["modelled_seconds"] - model_seconds
+
+    counters = model.counters()
+    added = [turn["compaction_seconds"] for turn in turns]
+    return {
+        "setting": setting,
+        "turns": len(prompt_tokens),
+        "prompt_tokens_total": sum(prompt_tokens),
+        "prompt_tokens_mean": statistics.fmean(prompt_tokens) if prompt_tokens else 0.0,
+        "prompt_tokens_p95": _percentile(prompt_tokens, 0.95),
+        "prompt_tokens_max": max(prompt_tokens, default=0),
+        "compaction_calls": counters["calls"],
+        "summarizer_input_tokens": counters["input_tokens"],
+        "summarizer_output_tokens": counters["output_tokens"],
+        "added_latency_seconds": counters["modelled_seconds"] + pipeline_seconds,
+        "added_latency_per_turn_max": max(added, default=0.0),
+        "pipeline_seconds": pipeline_seconds,
+        "per_turn": turns,
+    }
+
+
+def grid(
+    intervals: list[int],
+    overlaps: list[int],
+    token_budgets: Optional[list[int]] = None,
+    keep_recent_tokens: int = 2000,
+) -> list[dict[str, Any]]:
+    settings = [
+        {"compaction_interval": interval, "overlap_size": overlap}
+        for interval in intervals
+        for overlap in overlaps
+    ]
+    for token_budget in token_budgets or []:
+        for overlap in overlaps:
+            settings.append(
+                {
+                    "token_budget": token_budget,
+                    "keep_recent_tokens": min(keep_recent_tokens, token_budget // 2),
+                    "overlap_size": overlap,
+                }
+            )
+    return settings
+
+
+async def run_benchmark(
+    db_urls: list[str],
+    settings: list[dict[str, Any]],
+    repeat: int = 1,
+    min_invocations: int = 1,
+) -> list[dict[str, Any]]:
+    sessions = {}
+    for db_url in db_urls:
+        for (app_name, user_id, session_id), events in load_recorded_sessions(db_url, min_invocations).items():
+            # Same session ids may exist in several databases
+            sessions[(app_name, user_id, f"{db_url}:{session_id}")] = repeat_session(events, repeat)
+    return [await replay(setting, sessions) for setting in settings]
+
+
+def _percentile(values: list[int], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _setting_label(setting: dict[str, Any]) -> str:
+    if "token_budget" in setting:
+        return f"budget={setting['token_budget']} keep={setting['keep_recent_tokens']} overlap={setting['overlap_size']}"
+    return f"interval={setting['compaction_interval']} overlap={setting['overlap_size']}"
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded ADK sessions through a grid of compaction settings")
+    parser.add_argument("databases", nargs="+", help="SQLite session database files")
+    parser.add_argument("--interval", type=_int_list, default=[2, 3, 5, 10], help="compaction_interval values")
+    parser.add_argument("--overlap", type=_int_list, default=[0, 1, 2], help="overlap_size values")
+    parser.add_argument("--token-budget", type=_int_list, default=[], help="TokenBudgetCompactionPlugin budgets")
+    parser.add_argument("--keep-recent-tokens", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=1, help="Play every session this many times in a row")
+    parser.add_argument("--min-invocations", type=int, default=1)
+    parser.add_argument("--json", help="Write the full report, per-turn numbers included")
+    parser.add_argument("--per-turn", help="Write the prompt tokens of every turn as CSV")
+    args = parser.parse_args()
+
+    settings = grid(args.interval, args.overlap, args.token_budget, args.keep_recent_tokens)
+    db_urls = [f"sqlite:///{database}" for database in args.databases]
+    results = asyncio.run(run_benchmark(db_urls, settings, args.repeat, args.min_invocations))
+
+    print(
+        f"{'setting':<42} {'turns':>6} {'prompt mean':>12} {'p95':>8} {'max':>8}"
+        f" {'calls':>6} {'summ. in':>9} {'added s':>8} {'max/turn':>9}"
+    )
+    for result in results:
+        print(
+            f"{_setting_label(result['setting']):<42} {result['turns']:>6}"
+            f" {result['prompt_tokens_mean']:>12.0f} {result['prompt_tokens_p95']:>8.0f}"
+            f" {result['prompt_tokens_max']:>8} {result['compaction_calls']:>6}"
+            f" {result['summarizer_input_tokens']:>9} {result['added_latency_seconds']:>8.2f}"
+            f" {result['added_latency_per_turn_max']:>9.2f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2)
+    if args.per_turn:
+        with open(args.per_turn, "w", newline="", encoding="utf-8") as output:
+            writer = csv.writer(output)
+            writer.writerow(["setting", "session", "turn", "prompt_tokens", "compaction_seconds"])
+            for result in results:
+                label = _setting_label(result["setting"])
+                for turn in result["per_turn"]:
+                    writer.writerow(
+                        [label, turn["session"], turn["turn"], turn["prompt_tokens"], f"{turn['compaction_seconds']:.4f}"]
+                    )
+
+
+if __name__ == "__main__":
+    main()
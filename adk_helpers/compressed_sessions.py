@@ -0,0 +1,221 @@
+# Session service storing the large event payloads compressed (see event_codec.py)
+
+import json
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+    StorageEvent,
+    StorageSession,
+    StorageUserState,
+    _merge_state,
+)
+from google.genai import types
+from sqlalchemy import and_, select
+
+from adk_helpers.event_codec import (
+    PAYLOAD_FIELDS,
+    EventPayload,
+    PayloadCodec,
+    event_payloads,
+    load_codec,
+    metadata,
+)
+from adk_helpers.sessions import apply_state_delta
+
+
+# Model of each compressed event field
+_FIELD_TYPES = {
+    "content": types.Content,
+    "grounding_metadata": types.GroundingMetadata,
+    "usage_metadata": types.GenerateContentResponseUsageMetadata,
+    "citation_metadata": types.CitationMetadata,
+}
+
+
+class CompressedSessionService(DatabaseSessionService):
+    """DatabaseSessionService that keeps content and the metadata columns compressed.
+
+    New events are written with their payload fields in `event_payloads` (using the
+    latest dictionary of the database, see `python -m adk_helpers.event_codec`).
+    get_session only decodes `eager_fields`, by default just the content the prompt
+    is built from; the grounding / usage / citation metadata stay compressed until
+    load_event_fields asks for them.
+
+    Once a database is compressed every service reading it must be a
+    CompressedSessionService: the other services of adk_helpers refuse to open it
+    (event_codec.check_uncompressed), a plain DatabaseSessionService would see empty events.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        codec: Optional[PayloadCodec] = None,
+        eager_fields: Iterable[str] = ("content",),
+        **kwargs: Any,
+    ):
+        super().__init__(db_url=db_url, **kwargs)
+        metadata.create_all(self.db_engine)
+        if codec is None:
+            with self.db_engine.connect() as connection:
+                codec = load_codec(connection)
+        self.codec = codec
+        self.eager_fields = tuple(eager_fields)
+        self._codecs = {(codec.name, codec.dictionary_id): codec}
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        with self.database_session_factory() as sql_session:
+            storage_session = sql_session.get(
+                StorageSession, (app_name, user_id, session_id)
+            )
+            if storage_session is None:
+                return None
+
+            stmt = (
+                select(
+                    StorageEvent,
+                    event_payloads.c.codec,
+                    event_payloads.c.dictionary_id,
+                    event_payloads.c.data,
+                )
+                .outerjoin(event_payloads, _payload_of_event())
+                .filter(StorageEvent.app_name == app_name)
+                .filter(StorageEvent.user_id == user_id)
+                .filter(StorageEvent.session_id == session_id)
+            )
+            if config and config.after_timestamp:
+                after_dt = datetime.fromtimestamp(config.after_timestamp)
+                stmt = stmt.filter(StorageEvent.timestamp >= after_dt)
+            stmt = stmt.order_by(StorageEvent.timestamp.desc())
+            if config and config.num_recent_events:
+                stmt = stmt.limit(config.num_recent_events)
+            rows = sql_session.execute(stmt).all()
+
+            storage_app_state = sql_session.get(StorageAppState, (app_name))
+            storage_user_state = sql_session.get(StorageUserState, (app_name, user_id))
+            merged_state = _merge_state(
+                storage_app_state.state if storage_app_state else {},
+                storage_user_state.state if storage_user_state else {},
+                storage_session.state,
+            )
+
+            events = []
+            for storage_event, codec_name, dictionary_id, data in reversed(rows):
+                event = storage_event.to_event()
+                if data is not None:
+                    codec = self._codec(sql_session, codec_name, dictionary_id)
+                    _decode_fields(event, EventPayload(codec, data), self.eager_fields)
+                events.append(event)
+
+            return storage_session.to_session(state=merged_state, events=events)
+
+    async def load_event_fields(
+        self, session: Session, fields: Iterable[str] = PAYLOAD_FIELDS
+    ) -> None:
+        """Decode compressed fields into the events already loaded in the session."""
+        fields = tuple(fields)
+        events_by_id = {event.id: event for event in session.events}
+        event_ids = list(events_by_id)
+
+        with self.database_session_factory() as sql_session:
+            # Keep the IN lists well below SQLite's bound parameter limit
+            for start in range(0, len(event_ids), 500):
+                rows = sql_session.execute(
+                    select(event_payloads).where(
+                        event_payloads.c.app_name == session.app_name,
+                        event_payloads.c.user_id == session.user_id,
+                        event_payloads.c.session_id == session.id,
+                        event_payloads.c.id.in_(event_ids[start:start + 500]),
+                    )
+                ).all()
+                for row in rows:
+                    codec = self._codec(sql_session, row.codec, row.dictionary_id)
+                    _decode_fields(events_by_id[row.id], EventPayload(codec, row.data), fields)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        event = self._trim_temp_delta_state(event)
+
+        with self.database_session_factory() as sql_session:
+            storage_session = sql_session.get(
+                StorageSession, (session.app_name, session.user_id, session.id)
+            )
+            if storage_session.update_timestamp_tz > session.last_update_time:
+                raise ValueError(
+                    "The last_update_time provided in the session object is earlier than"
+                    " the update_time in the storage_session. Please check if it is a"
+                    " stale session."
+                )
+
+            apply_state_delta(sql_session, storage_session, event)
+
+            # Move the payload fields out of the row into the compressed blob
+            storage_event = StorageEvent.from_event(session, event)
+            fields = {}
+            for field in PAYLOAD_FIELDS:
+                value = getattr(storage_event, field)
+                if value is not None:
+                    fields[field] = json.dumps(value)
+                    setattr(storage_event, field, None)
+            sql_session.add(storage_event)
+
+            if fields:
+                # The payload row references the event row, insert that one first
+                sql_session.flush()
+                sql_session.execute(
+                    event_payloads.insert().values(
+                        id=event.id,
+                        app_name=session.app_name,
+                        user_id=session.user_id,
+                        session_id=session.id,
+                        codec=self.codec.name,
+                        dictionary_id=self.codec.dictionary_id,
+                        data=self.codec.encode(fields),
+                    )
+                )
+
+            sql_session.commit()
+            sql_session.refresh(storage_session)
+            session.last_update_time = storage_session.update_timestamp_tz
+
+        # Skip DatabaseSessionService.append_event, only update the in-memory session
+        await BaseSessionService.append_event(self, session=session, event=event)
+        return event
+
+    def _codec(self, sql_session, codec_name: str, dictionary_id: Optional[int]) -> PayloadCodec:
+        key = (codec_name, dictionary_id)
+        if key not in self._codecs:
+            if dictionary_id is None:
+                self._codecs[key] = PayloadCodec(codec_name)
+            else:
+                self._codecs[key] = load_codec(sql_session, dictionary_id)
+        return self._codecs[key]
+
+
+def _payload_of_event():
+    return and_(
+        event_payloads.c.id == StorageEvent.id,
+        event_payloads.c.app_name == StorageEvent.app_name,
+        event_payloads.c.user_id == StorageEvent.user_id,
+        event_payloads.c.session_id == StorageEvent.session_id,
+    )
+
+
+def _decode_fields(event: Event, payload: EventPayload, fields: Iterable[str]):
+    for field in fields:
+        if field in payload.fields:
+            setattr(event, field, _session_util.decode_model(payload.get(field), _FIELD_TYPES[field]))
@@ -0,0 +1,145 @@
+# Async console front-end for the agent scripts
+#
+# input("You: ") blocks the event loop until a line is typed: background tasks
+# (compaction worker, session sweeper, write-behind flushes) stall meanwhile.
+# ConsoleInput reads stdin in a daemon thread and hands the lines to the loop,
+# so the loop keeps running while waiting for the user. The thread reads ahead:
+# a script piped in (python agent.py < turns.txt) queues every line at once and
+# each turn starts as soon as the previous one ends.
+#
+# ResponsePrinter prints the model output as it streams, run the turns with
+# run_config=STREAMING_RUN_CONFIG to get partial events.
+#
+# Usage:
+#   printer = ResponsePrinter(MODEL_NAME)
+#   async for event in runner.run_async(..., run_config=STREAMING_RUN_CONFIG):
+#       printer(event)
+#
+#   await run_console(lambda text: run_session(runner, text, "session"))
+
+import asyncio
+import sys
+import threading
+from typing import Awaitable, Callable, Optional, TextIO
+
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.events.event import Event
+
+
+# Partial events carry the text chunks as the model produces them
+STREAMING_RUN_CONFIG = RunConfig(streaming_mode=StreamingMode.SSE)
+
+
+class ConsoleInput:
+    """Lines of a text stream read without blocking the event loop.
+
+    A daemon thread reads the stream and queues the lines on the loop, so
+    readline() only waits on an asyncio queue. The thread is never joined: it may
+    stay blocked on a read the user never completes, it ends with the process.
+
+    Args:
+        stream: Stream to read, sys.stdin by default.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream or sys.stdin
+        self._queue: Optional[asyncio.Queue[Optional[str]]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def interactive(self) -> bool:
+        return self.stream.isatty()
+
+    async def readline(self) -> Optional[str]:
+        """The next line without its newline, None at the end of the stream."""
+        if self._thread is None:
+            self._queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._read, args=(loop,), name="console-input", daemon=True)
+            self._thread.start()
+        line = await self._queue.get()
+        if line is None:
+            # Every later call sees the end of the stream too
+            self._queue.put_nowait(None)
+        return line
+
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            line = self.stream.readline()
+            try:
+                loop.call_soon_threadsafe(self._queue.put_nowait, line.rstrip("\r\n") if line else None)
+            except RuntimeError:  # The loop is closed, nobody reads anymore
+                return
+            if not line:
+                return
+
+
+class ResponsePrinter:
+    """Prints the text of the events of a turn, chunk by chunk when they stream.
+
+    Partial events are printed as they come, on one line. The final event of a
+    streamed response repeats the whole text and is not printed again; events of
+    a non-streamed run are printed whole, as the scripts always did.
+
+    Args:
+        label: Printed before each response.
+        output: Stream printed to, sys.stdout by default.
+    """
+
+    def __init__(self, label: str, output: Optional[TextIO] = None):
+        self.label = label
+        self.output = output or sys.stdout
+        self._streaming = False
+
+    def __call__(self, event: Event):
+        text = _event_text(event)
+        if event.partial:
+            if not text:
+                return
+            if not self._streaming:
+                self.output.write(f"{self.label}: ")
+                self._streaming = True
+            self.output.write(text)
+            self.output.flush()
+            return
+
+        if self._streaming:
+            # The aggregated response of the chunks already printed
+            self.output.write("\n")
+            self.output.flush()
+            self._streaming = False
+        elif text and text != "None":
+            print(f"{self.label}: ", text, file=self.output, flush=True)
+
+
+def _event_text(event: Event) -> str:
+    if not event.content or not event.content.parts:
+        return ""
+    return "".join(part.text for part in event.content.parts if part.text and not part.thought)
+
+
+async def run_console(
+    handle_turn: Callable[[str], Awaitable[object]],
+    prompt: str = "You: ",
+    exit_words: tuple[str, ...] = ("exit",),
+    console: Optional[ConsoleInput] = None,
+):
+    """Read lines from the console and await handle_turn(line) for each, in order.
+
+    Stops at one of `exit_words` or at the end of the input. Blank lines are
+    skipped. When the input is not a terminal the lines are echoed after the
+    prompt, so the transcript of a piped session reads like a typed one.
+    """
+    console = console or ConsoleInput()
+    while True:
+        if console.interactive:
+            print(prompt, end="", flush=True)
+        line = await console.readline()
+        if line is None or line.strip().lower() in exit_words:
+            print("Ending conversation")
+            return
+        if not line.strip():
+            continue
+        if not console.interactive:
+            print(f"{prompt}{line}", flush=True)
+        await handle_turn(line)
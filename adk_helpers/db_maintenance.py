@@ -0,0 +1,192 @@
+# Maintenance command for the ADK SQLite session stores (my_agent.db, chatbot.db, ...)
+#
+# Usage:
+#   python -m adk_helpers.db_maintenance my_agent.db chatbot.db my_agent_with_event_compaction.db
+#
+# Adds the indexes the session services need, switches the database to WAL
+# journaling, refreshes the planner statistics of large stores and prints the
+# query plans of the hot queries before and after.
+
+import argparse
+import sqlite3
+
+from sqlalchemy import event
+
+
+# Indexes added to the ADK schema, all idempotent
+INDEXES = {
+    # get_session / tail loading / cache version: filter by session, order by timestamp
+    "ix_events_session_timestamp": (
+        "CREATE INDEX IF NOT EXISTS ix_events_session_timestamp"
+        " ON events (app_name, user_id, session_id, timestamp)"
+    ),
+    # Compaction summaries are user-authored events without content, a tiny
+    # partial index lets them be found without scanning the session. Queries only
+    # match it with the predicate as literals: author = 'user', not author = ?
+    "ix_events_session_compactions": (
+        "CREATE INDEX IF NOT EXISTS ix_events_session_compactions"
+        " ON events (app_name, user_id, session_id, timestamp)"
+        " WHERE author = 'user' AND content IS NULL"
+    ),
+    # The archival sweeper looks for sessions idle since a cutoff
+    "ix_sessions_update_time": (
+        "CREATE INDEX IF NOT EXISTS ix_sessions_update_time ON sessions (update_time)"
+    ),
+}
+
+# Hot queries issued by the session services, used for the plan report
+HOT_QUERIES = {
+    "load session events": (
+        "SELECT * FROM events WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id"
+        " ORDER BY timestamp DESC"
+    ),
+    "load tail window": (
+        "SELECT * FROM events WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id"
+        " ORDER BY timestamp DESC LIMIT 30"
+    ),
+    "latest compaction": (
+        "SELECT * FROM events WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id"
+        " AND author = 'user' AND content IS NULL ORDER BY timestamp DESC LIMIT 50"
+    ),
+    "session version, latest event": (
+        "SELECT max(timestamp) FROM events"
+        " WHERE app_name = :app_name AND user_id = :user_id AND session_id = :session_id"
+    ),
+    "session version, summaries": (
+        "SELECT count(*) FROM events WHERE app_name = :app_name AND user_id = :user_id"
+        " AND session_id = :session_id AND author = 'user' AND content IS NULL"
+    ),
+    "list sessions": "SELECT * FROM sessions WHERE app_name = :app_name AND user_id = :user_id",
+}
+
+# Below this many events ANALYZE is skipped: the statistics of a small store make
+# the planner prefer scans (list sessions scans `sessions`, the compaction lookup
+# takes the wider index) and they are not refreshed as the store grows
+ANALYZE_MIN_EVENTS = 10_000
+
+# Per-connection settings, they are not stored in the database file
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    # Safe with WAL: a power loss can only lose the last transactions, never corrupt
+    "PRAGMA synchronous=NORMAL",
+    # Wait for the writer lock instead of failing with "database is locked"
+    "PRAGMA busy_timeout=5000",
+    # 64 MiB page cache (negative values are KiB)
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def set_sqlite_connection_pragmas(dbapi_connection, connection_record):
+    """SQLAlchemy "connect" listener applying CONNECTION_PRAGMAS."""
+    cursor = dbapi_connection.cursor()
+    for pragma in CONNECTION_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def install_connection_pragmas(session_service):
+    """Apply CONNECTION_PRAGMAS to every new connection of a DatabaseSessionService."""
+    if session_service.db_engine.dialect.name == "sqlite":
+        event.listen(session_service.db_engine, "connect", set_sqlite_connection_pragmas)
+
+
+def query_plans(connection: sqlite3.Connection) -> dict[str, list[str]]:
+    """Return the EXPLAIN QUERY PLAN lines of every hot query."""
+    plans = {}
+    for name, sql in HOT_QUERIES.items():
+        rows = connection.execute(
+            "EXPLAIN QUERY PLAN " + sql,
+            {"app_name": "app", "user_id": "user", "session_id": "session"},
+        ).fetchall()
+        plans[name] = [row[-1] for row in rows]
+    return plans
+
+
+def migrate(db_path: str, vacuum: bool = False) -> dict:
+    """Add the indexes, enable WAL and refresh statistics of one database.
+
+    Args:
+        db_path: Path to the SQLite file.
+        vacuum: Also rebuild the file to give free pages back to the filesystem.
+
+    Returns:
+        A report with the journal mode, the indexes created, whether statistics were
+        gathered and the plans before / after.
+    """
+    with sqlite3.connect(db_path) as connection:
+        tables = {
+            row[0]
+            for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        }
+        if not {"events", "sessions"} <= tables:
+            raise ValueError(f"{db_path} is not an ADK session database")
+
+        plans_before = query_plans(connection)
+
+        existing = {
+            row[0]
+            for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        created = []
+        for name, sql in INDEXES.items():
+            connection.execute(sql)
+            if name not in existing:
+                created.append(name)
+
+        # Statistics for the planner, stored in sqlite_stat1. Without them SQLite
+        # assumes large tables, which suits the hot queries of a small store.
+        event_count = connection.execute("SELECT count(*) FROM events").fetchone()[0]
+        analyzed = event_count >= ANALYZE_MIN_EVENTS
+        if analyzed:
+            connection.execute("ANALYZE")
+        elif "sqlite_stat1" in tables:
+            # Left by an earlier run, while the store was even smaller
+            connection.execute("DELETE FROM sqlite_stat1 WHERE tbl IN ('events', 'sessions')")
+            connection.execute("ANALYZE sqlite_master")
+        connection.commit()
+
+        if vacuum:
+            connection.execute("VACUUM")
+
+        # WAL is persistent: readers no longer block the writer and commits are cheaper
+        journal_mode = connection.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        plans_after = query_plans(connection)
+
+    return {
+        "database": db_path,
+        "journal_mode": journal_mode,
+        "indexes_created": created,
+        "analyzed": analyzed,
+        "plans_before": plans_before,
+        "plans_after": plans_after,
+    }
+
+
+def print_report(report: dict):
+    print(f"Database: {report['database']}")
+    print(f"  journal_mode: {report['journal_mode']}")
+    print(f"  indexes created: {', '.join(report['indexes_created']) or 'none'}")
+    print(f"  statistics: {'refreshed' if report['analyzed'] else f'skipped, under {ANALYZE_MIN_EVENTS} events'}")
+    for name in HOT_QUERIES:
+        print(f"  {name}:")
+        for line in report["plans_before"][name]:
+            print(f"    before: {line}")
+        for line in report["plans_after"][name]:
+            print(f"    after:  {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Add indexes, enable WAL and report query plans of ADK session databases"
+    )
+    parser.add_argument("databases", nargs="+", help="SQLite session database files")
+    parser.add_argument("--vacuum", action="store_true", help="Rebuild the database files")
+    args = parser.parse_args()
+
+    for db_path in args.databases:
+        print_report(migrate(db_path, vacuum=args.vacuum))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+# Key-by-key persistence of session / user / app state
+#
+# DatabaseSessionService stores each state as one JSON blob (sessions.state,
+# user_states.state, app_states.state) and rewrites the whole blob whenever a
+# single key changes, e.g. a blog draft saved through output_key. Here a changed
+# key is upserted as its own row of `state_entries`, and the blobs only serve as
+# checkpoints the entries are folded into once a scope has collected enough of them.
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+    StorageEvent,
+    StorageSession,
+    StorageUserState,
+)
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    delete,
+    func,
+    or_,
+    select,
+    update,
+)
+
+from adk_helpers.event_codec import check_uncompressed
+from adk_helpers.sessions import _UPSERT_INSERTS
+from adk_helpers.tail_window import TailWindowSessionService
+
+
+# user_id / session_id of the entries of the wider scopes
+ANY = ""
+
+metadata = MetaData()
+
+state_entries = Table(
+    "state_entries",
+    metadata,
+    # (app, "", "") app state, (app, user, "") user state, (app, user, session) session state
+    Column("app_name", String(128), primary_key=True),
+    Column("user_id", String(128), primary_key=True),
+    Column("session_id", String(128), primary_key=True),
+    Column("key", String(256), primary_key=True),
+    Column("value", Text, nullable=True),
+    # Bumped on every write, lets caches notice changes made by other sessions
+    Column("revision", Integer, nullable=False, default=1),
+    Column("update_time", DateTime, default=func.now(), onupdate=func.now()),
+)
+
+
+class DeltaStateSessionService(DatabaseSessionService):
+    """DatabaseSessionService persisting state changes as one row per changed key.
+
+    append_event upserts the keys of the event's state delta into `state_entries`,
+    so a write costs O(changed keys) whatever the size of the state. Reads overlay
+    the entries on the state blobs. When a scope (an app, a user or a session) holds
+    more than `checkpoint_entries` entries they are folded into its blob and removed.
+
+    The blobs lag behind the entries: every service reading the database must be a
+    DeltaStateSessionService, or run checkpoint() first.
+    """
+
+    def __init__(self, db_url: str, checkpoint_entries: int = 64, **kwargs: Any):
+        super().__init__(db_url=db_url, **kwargs)
+        if self.db_engine.dialect.name not in _UPSERT_INSERTS:
+            raise ValueError(
+                f"DeltaStateSessionService needs upserts, not supported on {self.db_engine.dialect.name}"
+            )
+        check_uncompressed(self.db_engine, type(self).__name__)
+        metadata.create_all(self.db_engine)
+        self.checkpoint_entries = checkpoint_entries
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        state_deltas = _session_util.extract_state_delta(state)
+        session = await super().create_session(
+            app_name=app_name,
+            user_id=user_id,
+            state=state_deltas["session"],
+            session_id=session_id,
+        )
+        if state_deltas["app"] or state_deltas["user"]:
+            with self.database_session_factory() as sql_session:
+                self._upsert_entries(sql_session, app_name, user_id, session.id, state_deltas)
+                sql_session.commit()
+        return await self.get_session(app_name=app_name, user_id=user_id, session_id=session.id)
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        session = await super().get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+        if session is not None:
+            with self.database_session_factory() as sql_session:
+                self._overlay_entries(sql_session, [session], app_name, user_id)
+        return session
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        response = await super().list_sessions(app_name=app_name, user_id=user_id)
+        with self.database_session_factory() as sql_session:
+            self._overlay_entries(sql_session, response.sessions, app_name, user_id)
+        return response
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        await super().delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        with self.database_session_factory() as sql_session:
+            sql_session.execute(
+                delete(state_entries).where(
+                    state_entries.c.app_name == app_name,
+                    state_entries.c.user_id == user_id,
+                    state_entries.c.session_id == session_id,
+                )
+            )
+            sql_session.commit()
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        event = self._trim_temp_delta_state(event)
+
+        with self.database_session_factory() as sql_session:
+            storage_session = sql_session.get(
+                StorageSession, (session.app_name, session.user_id, session.id)
+            )
+            if self._last_update_time(sql_session, storage_session) > session.last_update_time:
+                raise ValueError(
+                    "The last_update_time provided in the session object is earlier than"
+                    " the update_time in the storage_session. Please check if it is a"
+                    " stale session."
+                )
+
+            self.apply_state_delta(sql_session, storage_session, event)
+            sql_session.add(StorageEvent.from_event(session, event))
+            sql_session.commit()
+            session.last_update_time = self._last_update_time(sql_session, storage_session)
+
+        # Skip DatabaseSessionService.append_event, only update the in-memory session
+        await BaseSessionService.append_event(self, session=session, event=event)
+
+        if event.actions and event.actions.state_delta:
+            self._maybe_checkpoint(session.app_name, session.user_id, session.id, event)
+        return event
+
+    def apply_state_delta(self, sql_session, storage_session: StorageSession, event: Event):
+        """Same contract as adk_helpers.sessions.apply_state_delta, writing entries instead of blobs."""
+        if not event.actions or not event.actions.state_delta:
+            return
+        self._upsert_entries(
+            sql_session,
+            storage_session.app_name,
+            storage_session.user_id,
+            storage_session.id,
+            _session_util.extract_state_delta(event.actions.state_delta),
+        )
+
+    def merge_app_state(self, sql_session, app_name: str, app_delta: dict[str, Any]):
+        """Write app state keys that did not come from an event (e.g. copied from another shard)."""
+        self._upsert_entries(
+            sql_session, app_name, ANY, ANY, {"app": app_delta, "user": {}, "session": {}}
+        )
+
+    def checkpoint(
+        self,
+        app_name: str,
+        user_id: str = ANY,
+        session_id: str = ANY,
+    ) -> int:
+        """Fold the entries of one scope into its state blob, returns the number folded."""
+        with self.database_session_factory() as sql_session:
+            # DELETE ... RETURNING is the first write of the transaction, so no entry
+            # can be upserted between reading it and removing it
+            rows = sql_session.execute(
+                delete(state_entries)
+                .where(
+                    state_entries.c.app_name == app_name,
+                    state_entries.c.user_id == user_id,
+                    state_entries.c.session_id == session_id,
+                )
+                .returning(state_entries.c.key, state_entries.c.value)
+            ).all()
+            if not rows:
+                return 0
+            delta = {key: _load(value) for key, value in rows}
+
+            if session_id != ANY:
+                sessions = StorageSession.__table__
+                storage_session = sql_session.get(StorageSession, (app_name, user_id, session_id))
+                if storage_session is not None:
+                    # Keep update_time as is, live handles of the session must not turn stale
+                    sql_session.execute(
+                        update(sessions)
+                        .where(
+                            sessions.c.app_name == app_name,
+                            sessions.c.user_id == user_id,
+                            sessions.c.id == session_id,
+                        )
+                        .values(state=storage_session.state | delta, update_time=sessions.c.update_time)
+                    )
+            elif user_id != ANY:
+                storage_user_state = sql_session.get(StorageUserState, (app_name, user_id))
+                if storage_user_state is None:
+                    sql_session.add(StorageUserState(app_name=app_name, user_id=user_id, state=delta))
+                else:
+                    storage_user_state.state = storage_user_state.state | delta
+            else:
+                storage_app_state = sql_session.get(StorageAppState, (app_name))
+                if storage_app_state is None:
+                    sql_session.add(StorageAppState(app_name=app_name, state=delta))
+                else:
+                    storage_app_state.state = storage_app_state.state | delta
+            sql_session.commit()
+        return len(rows)
+
+    def checkpoint_all(self) -> int:
+        """Fold every entry into the blobs, e.g. before handing the database to other services."""
+        with self.database_session_factory() as sql_session:
+            scopes = sql_session.execute(
+                select(
+                    state_entries.c.app_name, state_entries.c.user_id, state_entries.c.session_id
+                ).distinct()
+            ).all()
+        return sum(self.checkpoint(*scope) for scope in scopes)
+
+    def shared_state_revision(self, app_name: str, user_id: str):
+        """Scalar subquery changing whenever an app / user entry of the session is written.
+
+        CachedSessionService adds it to the version it validates cached sessions with.
+        """
+        return (
+            select(func.coalesce(func.sum(state_entries.c.revision), 0))
+            .where(
+                state_entries.c.app_name == app_name,
+                state_entries.c.session_id == ANY,
+                or_(state_entries.c.user_id == ANY, state_entries.c.user_id == user_id),
+            )
+            .scalar_subquery()
+        )
+
+    def _upsert_entries(self, sql_session, app_name, user_id, session_id, state_deltas):
+        rows = []
+        for scope, scope_user, scope_session in (
+            ("app", ANY, ANY),
+            ("user", user_id, ANY),
+            ("session", user_id, session_id),
+        ):
+            for key, value in state_deltas[scope].items():
+                rows.append(
+                    {
+                        "app_name": app_name,
+                        "user_id": scope_user,
+                        "session_id": scope_session,
+                        "key": key,
+                        "value": json.dumps(value),
+                    }
+                )
+        if not rows:
+            return
+        insert = _UPSERT_INSERTS[self.db_engine.dialect.name](state_entries).values(rows)
+        sql_session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[
+                    state_entries.c.app_name,
+                    state_entries.c.user_id,
+                    state_entries.c.session_id,
+                    state_entries.c.key,
+                ],
+                set_={
+                    "value": insert.excluded.value,
+                    "revision": state_entries.c.revision + 1,
+                    "update_time": func.now(),
+                },
+            )
+        )
+
+    def _overlay_entries(self, sql_session, sessions: list[Session], app_name: str, user_id: Optional[str]):
+        # Entries are newer than the blobs the base service merged the state from
+        stmt = select(state_entries).where(state_entries.c.app_name == app_name)
+        if user_id is not None:
+            stmt = stmt.where(or_(state_entries.c.user_id == user_id, state_entries.c.user_id == ANY))
+        if len(sessions) == 1:
+            stmt = stmt.where(
+                or_(state_entries.c.session_id == sessions[0].id, state_entries.c.session_id == ANY)
+            )
+        app_entries = {}
+        user_entries: dict[str, dict[str, Any]] = {}
+        session_entries: dict[tuple[str, str], dict[str, Any]] = {}
+        session_update_times: dict[tuple[str, str], datetime] = {}
+        for row in sql_session.execute(stmt):
+            value = _load(row.value)
+            if row.user_id == ANY:
+                app_entries[State.APP_PREFIX + row.key] = value
+            elif row.session_id == ANY:
+                user_entries.setdefault(row.user_id, {})[State.USER_PREFIX + row.key] = value
+            else:
+                scope = (row.user_id, row.session_id)
+                session_entries.setdefault(scope, {})[row.key] = value
+                session_update_times[scope] = max(
+                    session_update_times.get(scope, row.update_time), row.update_time
+                )
+
+        for session in sessions:
+            scope = (session.user_id, session.id)
+            session.state.update(app_entries)
+            session.state.update(user_entries.get(session.user_id, {}))
+            session.state.update(session_entries.get(scope, {}))
+            if scope in session_update_times:
+                session.last_update_time = max(
+                    session.last_update_time, self._timestamp(session_update_times[scope])
+                )
+
+    def _last_update_time(self, sql_session, storage_session: StorageSession) -> float:
+        # Session-scope entries change the session without touching its row
+        latest_entry = sql_session.execute(
+            select(func.max(state_entries.c.update_time)).where(
+                state_entries.c.app_name == storage_session.app_name,
+                state_entries.c.user_id == storage_session.user_id,
+                state_entries.c.session_id == storage_session.id,
+            )
+        ).scalar()
+        sql_session.refresh(storage_session)
+        last_update_time = storage_session.update_timestamp_tz
+        if latest_entry is not None:
+            last_update_time = max(last_update_time, self._timestamp(latest_entry))
+        return last_update_time
+
+    def _maybe_checkpoint(self, app_name: str, user_id: str, session_id: str, event: Event):
+        state_deltas = _session_util.extract_state_delta(event.actions.state_delta)
+        scopes = []
+        if state_deltas["app"]:
+            scopes.append((app_name, ANY, ANY))
+        if state_deltas["user"]:
+            scopes.append((app_name, user_id, ANY))
+        if state_deltas["session"]:
+            scopes.append((app_name, user_id, session_id))
+
+        with self.database_session_factory() as sql_session:
+            full_scopes = [
+                scope
+                for scope in scopes
+                if sql_session.execute(
+                    select(func.count()).select_from(state_entries).where(
+                        state_entries.c.app_name == scope[0],
+                        state_entries.c.user_id == scope[1],
+                        state_entries.c.session_id == scope[2],
+                    )
+                ).scalar()
+                > self.checkpoint_entries
+            ]
+        for scope in full_scopes:
+            self.checkpoint(*scope)
+
+    def _timestamp(self, value: datetime) -> float:
+        # Same conversion as StorageSession.update_timestamp_tz
+        if self.db_engine.dialect.name == "sqlite":
+            return value.replace(tzinfo=timezone.utc).timestamp()
+        return value.timestamp()
+
+
+class DeltaStateTailWindowSessionService(DeltaStateSessionService, TailWindowSessionService):
+    """TailWindowSessionService loading, with the state persisted key by key."""
+
+
+def _load(value: Optional[str]) -> Any:
+    return json.loads(value) if value is not None else None
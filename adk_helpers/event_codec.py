@@ -0,0 +1,401 @@
+# Compressed, column-by-column encoding of the large JSON payloads of the `events` table
+#
+# Usage (in place, on a stopped database):
+#   python -m adk_helpers.event_codec compress chatbot.db --force
+#   python -m adk_helpers.event_codec decompress chatbot.db
+#
+# content, grounding_metadata, usage_metadata and citation_metadata are moved out
+# of `events` into one `event_payloads` row per event. Each field is compressed as
+# its own frame (zstd when the `zstandard` package is installed, zlib otherwise),
+# with a dictionary trained on the database's own payloads, so a single field can
+# be decoded without touching the others.
+#
+# Only CompressedSessionService reads a compressed database: the other session
+# services of adk_helpers refuse to open one (check_uncompressed) and ADK's own
+# services would load events without their content. `compress` therefore needs
+# --force, once every reader of the database is a CompressedSessionService.
+
+import argparse
+import json
+import struct
+import zlib
+from collections import Counter
+from typing import Any, Optional
+
+from google.adk.sessions.database_session_service import StorageEvent
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKeyConstraint,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    func,
+    inspect,
+    select,
+    text,
+)
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always available
+    zstandard = None
+
+
+# The event columns stored compressed
+PAYLOAD_FIELDS = ("content", "grounding_metadata", "usage_metadata", "citation_metadata")
+
+metadata = MetaData()
+
+payload_dictionaries = Table(
+    "event_payload_dictionaries",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("codec", String(16), nullable=False),
+    Column("data", LargeBinary, nullable=False),
+    Column("create_time", DateTime, default=func.now()),
+)
+
+_events = StorageEvent.__table__
+event_payloads = Table(
+    "event_payloads",
+    metadata,
+    Column("id", String(128), primary_key=True),
+    Column("app_name", String(128), primary_key=True),
+    Column("user_id", String(128), primary_key=True),
+    Column("session_id", String(128), primary_key=True),
+    Column("codec", String(16), nullable=False),
+    Column("dictionary_id", Integer, nullable=True),
+    Column("data", LargeBinary, nullable=False),
+    # Deleting a session deletes its events, and with them their payloads
+    ForeignKeyConstraint(
+        ["id", "app_name", "user_id", "session_id"],
+        [_events.c.id, _events.c.app_name, _events.c.user_id, _events.c.session_id],
+        ondelete="CASCADE",
+    ),
+)
+
+
+class PayloadCodec:
+    """Compresses a dict of JSON texts into one blob of independently decodable frames.
+
+    Blob layout: u32 header length | header JSON {field: [offset, length]} | frames
+    """
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        dictionary: Optional[bytes] = None,
+        dictionary_id: Optional[int] = None,
+        level: int = 6,
+    ):
+        if name is None:
+            name = "zstd" if zstandard is not None else "zlib"
+        if name == "zstd" and zstandard is None:
+            raise ValueError("The zstd codec needs the `zstandard` package")
+        if name not in ("zstd", "zlib"):
+            raise ValueError(f"Unknown codec {name!r}")
+        self.name = name
+        self.dictionary = dictionary
+        self.dictionary_id = dictionary_id
+        self.level = level
+
+        if name == "zstd":
+            dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self._compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def encode(self, fields: dict[str, str]) -> bytes:
+        """Compress {field: json_text}, fields set to None are left out."""
+        header = {}
+        frames = []
+        offset = 0
+        for field, json_text in fields.items():
+            if json_text is None:
+                continue
+            frame = self._compress(json_text.encode("utf-8"))
+            header[field] = [offset, len(frame)]
+            frames.append(frame)
+            offset += len(frame)
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        return struct.pack("<I", len(header_bytes)) + header_bytes + b"".join(frames)
+
+    def decode_field(self, blob: bytes, field: str) -> Optional[str]:
+        """Return the JSON text of one field, decompressing only its frame."""
+        return EventPayload(self, blob).json_text(field)
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            return self._compressor.compress(data)
+        if self.dictionary:
+            compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level)
+        return compressor.compress(data) + compressor.flush()
+
+    def _decompress(self, frame: bytes) -> bytes:
+        if self.name == "zstd":
+            return self._decompressor.decompress(frame)
+        if self.dictionary:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+        else:
+            decompressor = zlib.decompressobj()
+        return decompressor.decompress(frame) + decompressor.flush()
+
+
+class EventPayload:
+    """Lazy view on an encoded blob: a field is decompressed and parsed on first access."""
+
+    def __init__(self, codec: PayloadCodec, blob: bytes):
+        self.codec = codec
+        self.blob = blob
+        (header_length,) = struct.unpack_from("<I", blob)
+        self._frames_start = 4 + header_length
+        self._header = json.loads(blob[4:self._frames_start])
+        self._decoded: dict[str, Any] = {}
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        return tuple(self._header)
+
+    def json_text(self, field: str) -> Optional[str]:
+        if field not in self._header:
+            return None
+        offset, length = self._header[field]
+        start = self._frames_start + offset
+        return self.codec._decompress(self.blob[start:start + length]).decode("utf-8")
+
+    def get(self, field: str) -> Any:
+        if field not in self._decoded:
+            json_text = self.json_text(field)
+            self._decoded[field] = json.loads(json_text) if json_text is not None else None
+        return self._decoded[field]
+
+
+def train_dictionary(samples: list[bytes], codec_name: str, size: int = 32 * 1024) -> bytes:
+    """Build a compression dictionary from sample payloads.
+
+    zstd trains a real dictionary; zlib uses a preset dictionary of the most common
+    samples, with the most frequent ones last (closest to the data being compressed).
+    """
+    if codec_name == "zstd":
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            # Not enough distinct samples to train on, compress without a dictionary
+            return b""
+
+    # zlib only looks at the last 32 KiB of the preset dictionary
+    chosen = []
+    total = 0
+    for sample, _ in Counter(samples).most_common():
+        if total >= size:
+            break
+        chosen.append(sample)
+        total += len(sample)
+    return b"".join(reversed(chosen))[-size:]
+
+
+def load_codec(connection, dictionary_id: Optional[int] = None) -> PayloadCodec:
+    """Codec using the given dictionary, or the latest one stored in the database."""
+    stmt = select(payload_dictionaries)
+    if dictionary_id is not None:
+        stmt = stmt.where(payload_dictionaries.c.id == dictionary_id)
+    row = connection.execute(stmt.order_by(payload_dictionaries.c.id.desc())).first()
+    if row is None:
+        return PayloadCodec()
+    return PayloadCodec(row.codec, dictionary=row.data, dictionary_id=row.id)
+
+
+def store_dictionary(connection, codec_name: str, dictionary: bytes) -> int:
+    result = connection.execute(
+        payload_dictionaries.insert().values(codec=codec_name, data=dictionary)
+    )
+    return result.inserted_primary_key[0]
+
+
+def check_uncompressed(db_engine, reader: str):
+    """Raise a ValueError if the database holds compressed event payloads.
+
+    Called by the session services that read `events` directly, they would load the
+    events of a compressed database without their content.
+    """
+    if not inspect(db_engine).has_table(event_payloads.name):
+        return
+    with db_engine.connect() as connection:
+        if connection.execute(select(event_payloads.c.id).limit(1)).first() is None:
+            return
+    raise ValueError(
+        f"{db_engine.url.database} holds compressed event payloads, which {reader} cannot read."
+        " Use a CompressedSessionService, or run `python -m adk_helpers.event_codec decompress` on it"
+    )
+
+
+def compress_database(
+    db_url: str,
+    codec_name: Optional[str] = None,
+    sample_size: int = 2000,
+    batch_size: int = 500,
+    force: bool = False,
+) -> dict:
+    """Move the payload columns of every event into compressed event_payloads rows.
+
+    Refuses to run without `force`: afterwards only CompressedSessionService can
+    read the events.
+
+    Returns the number of events converted and the payload bytes before / after.
+    """
+    if not force:
+        raise ValueError(
+            "Once compressed, the database can only be read by CompressedSessionService:"
+            " switch every service using it first, then compress with force=True (--force)"
+        )
+    engine = create_engine(db_url)
+    metadata.create_all(engine)
+    field_list = ", ".join(PAYLOAD_FIELDS)
+    not_null = " OR ".join(f"{field} IS NOT NULL" for field in PAYLOAD_FIELDS)
+
+    with engine.begin() as connection:
+        # Train the dictionary on a random sample of the existing payloads
+        rows = connection.execute(
+            text(
+                f"SELECT {field_list} FROM events WHERE {not_null}"
+                " ORDER BY random() LIMIT :limit"
+            ),
+            {"limit": sample_size},
+        ).fetchall()
+        samples = [
+            value.encode("utf-8") for row in rows for value in row if value is not None
+        ]
+        codec_name = codec_name or PayloadCodec().name
+        dictionary = None
+        if len(samples) >= 10:
+            dictionary = train_dictionary(samples, codec_name)
+        dictionary_id = (
+            store_dictionary(connection, codec_name, dictionary) if dictionary else None
+        )
+        codec = PayloadCodec(codec_name, dictionary=dictionary, dictionary_id=dictionary_id)
+
+    converted = bytes_before = bytes_after = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text(
+                    f"SELECT id, app_name, user_id, session_id, {field_list} FROM events"
+                    f" WHERE {not_null} LIMIT :limit"
+                ),
+                {"limit": batch_size},
+            ).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                fields = dict(zip(PAYLOAD_FIELDS, row[4:]))
+                blob = codec.encode(fields)
+                bytes_before += sum(len(v.encode("utf-8")) for v in fields.values() if v)
+                bytes_after += len(blob)
+                key = dict(id=row.id, app_name=row.app_name, user_id=row.user_id, session_id=row.session_id)
+                connection.execute(
+                    event_payloads.insert().values(
+                        **key, codec=codec.name, dictionary_id=codec.dictionary_id, data=blob
+                    )
+                )
+                connection.execute(
+                    text(
+                        "UPDATE events SET "
+                        + ", ".join(f"{field} = NULL" for field in PAYLOAD_FIELDS)
+                        + " WHERE id = :id AND app_name = :app_name"
+                        " AND user_id = :user_id AND session_id = :session_id"
+                    ),
+                    key,
+                )
+            converted += len(rows)
+
+    _vacuum(engine)
+    return {"events": converted, "bytes_before": bytes_before, "bytes_after": bytes_after}
+
+
+def decompress_database(db_url: str, batch_size: int = 500) -> dict:
+    """Inverse of compress_database: put the payloads back into the events columns."""
+    engine = create_engine(db_url)
+    metadata.create_all(engine)
+    codecs: dict[Optional[int], PayloadCodec] = {}
+    restored = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select(event_payloads).limit(batch_size)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                if row.dictionary_id not in codecs:
+                    codecs[row.dictionary_id] = (
+                        load_codec(connection, row.dictionary_id)
+                        if row.dictionary_id is not None
+                        else PayloadCodec(row.codec)
+                    )
+                payload = EventPayload(codecs[row.dictionary_id], row.data)
+                key = dict(id=row.id, app_name=row.app_name, user_id=row.user_id, session_id=row.session_id)
+                connection.execute(
+                    text(
+                        "UPDATE events SET "
+                        + ", ".join(f"{field} = :{field}" for field in PAYLOAD_FIELDS)
+                        + " WHERE id = :id AND app_name = :app_name"
+                        " AND user_id = :user_id AND session_id = :session_id"
+                    ),
+                    {**key, **{field: payload.json_text(field) for field in PAYLOAD_FIELDS}},
+                )
+                connection.execute(
+                    event_payloads.delete().where(
+                        *(event_payloads.c[name] == value for name, value in key.items())
+                    )
+                )
+            restored += len(rows)
+
+    _vacuum(engine)
+    return {"events": restored}
+
+
+def _vacuum(engine):
+    # Give the freed pages back to the filesystem
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.exec_driver_sql("VACUUM")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compress / decompress the event payloads of ADK session databases in place"
+    )
+    parser.add_argument("command", choices=["compress", "decompress"])
+    parser.add_argument("databases", nargs="+", help="SQLite session database files")
+    parser.add_argument("--codec", choices=["zstd", "zlib"], default=None)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Compress even though only CompressedSessionService reads compressed databases",
+    )
+    args = parser.parse_args()
+    if args.command == "compress" and not args.force:
+        parser.error(
+            "only CompressedSessionService reads compressed databases, the agents' session"
+            " services would fail on them; pass --force once they all use it"
+        )
+
+    for db_path in args.databases:
+        db_url = f"sqlite:///{db_path}"
+        if args.command == "compress":
+            report = compress_database(db_url, codec_name=args.codec, force=True)
+            ratio = report["bytes_after"] / report["bytes_before"] if report["bytes_before"] else 1.0
+            print(
+                f"{db_path}: {report['events']} events, payloads "
+                f"{report['bytes_before']} -> {report['bytes_after']} bytes ({ratio:.1%})"
+            )
+        else:
+            report = decompress_database(db_url)
+            print(f"{db_path}: {report['events']} events restored")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# Streaming export of the `events` table of ADK session databases
+#
+# Usage:
+#   python -m adk_helpers.event_export my_agent.db
+#   python -m adk_helpers.event_export chatbot.db --app agents --author user \
+#       --since 2025-11-01 --until 2025-12-01 --format parquet -o events.parquet
+#
+# Rows are streamed through a server-side cursor and written batch by batch, so
+# memory stays bounded by --batch-size whatever the size of the database. SQLite
+# files are opened read-only; in WAL mode the export never blocks the writers.
+
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import MetaData, Table, and_, create_engine, inspect, select
+from sqlalchemy.engine import make_url
+
+from adk_helpers.event_codec import PAYLOAD_FIELDS, EventPayload, PayloadCodec, load_codec
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Only needed for --format parquet
+    pyarrow = None
+
+
+# Event columns holding JSON, decoded in the JSONL output
+JSON_COLUMNS = {
+    "content",
+    "grounding_metadata",
+    "custom_metadata",
+    "usage_metadata",
+    "citation_metadata",
+    "input_transcription",
+    "output_transcription",
+}
+# Pickled EventActions, not portable outside of Python
+SKIPPED_COLUMNS = {"actions"}
+
+
+class ExportFilter:
+    """Row filters of an export, every one of them optional."""
+
+    def __init__(
+        self,
+        app_name: Optional[str] = None,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        author: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ):
+        self.app_name = app_name
+        self.user_id = user_id
+        self.session_id = session_id
+        self.author = author
+        # Event timestamps are stored as naive local times
+        self.since = _local_naive(since)
+        self.until = _local_naive(until)
+
+    def where(self, events: Table) -> list:
+        clauses = []
+        for name in ("app_name", "user_id", "session_id", "author"):
+            value = getattr(self, name)
+            if value is not None:
+                clauses.append(events.c[name] == value)
+        if self.since is not None:
+            clauses.append(events.c.timestamp >= self.since)
+        if self.until is not None:
+            clauses.append(events.c.timestamp < self.until)
+        return clauses
+
+
+def read_only_url(db_url: str) -> str:
+    """Open SQLite files read-only, other databases are left as they are."""
+    url = make_url(db_url)
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return db_url
+    return f"sqlite:///file:{url.database}?mode=ro&uri=true"
+
+
+def stream_events(
+    db_url: str,
+    export_filter: Optional[ExportFilter] = None,
+    batch_size: int = 1000,
+) -> Iterator[list[dict[str, Any]]]:
+    """Yield the matching events as batches of column dicts, session by session in timestamp order.
+
+    Payloads moved to `event_payloads` by `python -m adk_helpers.event_codec compress`
+    are decoded back into their columns.
+    """
+    export_filter = export_filter or ExportFilter()
+    engine = create_engine(read_only_url(db_url))
+    try:
+        table_names = set(inspect(engine).get_table_names())
+        table_metadata = MetaData()
+        events = Table("events", table_metadata, autoload_with=engine)
+        columns = [column for column in events.c if column.name not in SKIPPED_COLUMNS]
+
+        stmt = select(*columns)
+        payloads = None
+        if "event_payloads" in table_names:
+            payloads = Table("event_payloads", table_metadata, autoload_with=engine)
+            stmt = stmt.add_columns(
+                payloads.c.codec, payloads.c.dictionary_id, payloads.c.data.label("payload")
+            ).outerjoin(
+                payloads,
+                and_(*(payloads.c[name] == events.c[name] for name in ("id", "app_name", "user_id", "session_id"))),
+            )
+        # Session by session, the order of ix_events_session_timestamp: rows stream as
+        # the index is walked, a global timestamp order would sort the whole table first
+        stmt = stmt.where(*export_filter.where(events)).order_by(
+            events.c.app_name, events.c.user_id, events.c.session_id, events.c.timestamp
+        )
+
+        codecs: dict[Any, PayloadCodec] = {}
+        with engine.connect() as connection:
+            # Server-side cursor: rows are fetched from the database batch by batch
+            result = connection.execution_options(
+                stream_results=True, yield_per=batch_size
+            ).execute(stmt)
+            for partition in result.partitions(batch_size):
+                batch = []
+                for row in partition:
+                    record = {column.name: row._mapping[column.name] for column in columns}
+                    if payloads is not None and row.payload is not None:
+                        key = (row.codec, row.dictionary_id)
+                        if key not in codecs:
+                            codecs[key] = (
+                                load_codec(connection, row.dictionary_id)
+                                if row.dictionary_id is not None
+                                else PayloadCodec(row.codec)
+                            )
+                        payload = EventPayload(codecs[key], row.payload)
+                        for field in PAYLOAD_FIELDS:
+                            record[field] = payload.json_text(field)
+                    batch.append(record)
+                yield batch
+    finally:
+        engine.dispose()
+
+
+def export_events(
+    db_url: str,
+    output,
+    output_format: str = "jsonl",
+    export_filter: Optional[ExportFilter] = None,
+    batch_size: int = 1000,
+) -> dict[str, Any]:
+    """Write the matching events to `output` (a text stream for jsonl, a path for parquet).
+
+    Returns the number of rows written, the elapsed seconds and the rows per second.
+    """
+    if output_format == "parquet" and pyarrow is None:
+        raise ValueError("The parquet format needs the `pyarrow` package")
+
+    started = time.perf_counter()
+    rows = 0
+    writer = None
+    if output_format == "parquet":
+        schema = _arrow_schema(db_url)
+    try:
+        for batch in stream_events(db_url, export_filter, batch_size):
+            if output_format == "jsonl":
+                for record in batch:
+                    output.write(json.dumps(_jsonl_record(record), ensure_ascii=False) + "\n")
+            else:
+                table = pyarrow.Table.from_pylist(
+                    [_columnar_record(record) for record in batch], schema=schema
+                )
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(output, schema)
+                # One row group per batch, nothing is kept once it is written
+                writer.write_table(table)
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed else 0.0,
+    }
+
+
+def _arrow_schema(db_url: str):
+    # Fixed schema from the table definition, a batch of NULLs must not decide a column type
+    engine = create_engine(read_only_url(db_url))
+    try:
+        events = Table("events", MetaData(), autoload_with=engine)
+    finally:
+        engine.dispose()
+    fields = []
+    for column in events.c:
+        if column.name in SKIPPED_COLUMNS:
+            continue
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = str
+        arrow_type = {
+            bool: pyarrow.bool_(),
+            int: pyarrow.int64(),
+            float: pyarrow.float64(),
+            datetime: pyarrow.timestamp("us"),
+        }.get(python_type, pyarrow.string())
+        fields.append(pyarrow.field(column.name, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def _jsonl_record(record: dict[str, Any]) -> dict[str, Any]:
+    out = {}
+    for name, value in record.items():
+        if name in JSON_COLUMNS and isinstance(value, str):
+            value = json.loads(value)
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        out[name] = value
+    return out
+
+
+def _columnar_record(record: dict[str, Any]) -> dict[str, Any]:
+    # JSON columns stay JSON text, their shape varies from row to row
+    return {
+        name: json.dumps(value) if name in JSON_COLUMNS and not isinstance(value, (str, type(None))) else value
+        for name, value in record.items()
+    }
+
+
+def _local_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the events of an ADK session database")
+    parser.add_argument("database", help="SQLite session database file")
+    parser.add_argument("--app", dest="app_name")
+    parser.add_argument("--user", dest="user_id")
+    parser.add_argument("--session", dest="session_id")
+    parser.add_argument("--author")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="ISO date/time, inclusive")
+    parser.add_argument("--until", type=datetime.fromisoformat, help="ISO date/time, exclusive")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout, jsonl only)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not args.output:
+        parser.error("--format parquet needs --output")
+
+    export_filter = ExportFilter(
+        app_name=args.app_name,
+        user_id=args.user_id,
+        session_id=args.session_id,
+        author=args.author,
+        since=args.since,
+        until=args.until,
+    )
+    db_url = f"sqlite:///{args.database}"
+    if args.format == "parquet":
+        report = export_events(db_url, args.output, "parquet", export_filter, args.batch_size)
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            report = export_events(db_url, output, "jsonl", export_filter, args.batch_size)
+    else:
+        report = export_events(db_url, sys.stdout, "jsonl", export_filter, args.batch_size)
+
+    # The report goes to stderr, stdout may be the export itself
+    print(
+        f"{args.database}: {report['rows']} rows in {report['seconds']:.2f}s"
+        f" ({report['rows_per_second']:.0f} rows/s)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+# Memory service persisted in the SQLite session store, searched with FTS5
+#
+# InMemoryMemoryService forgets everything on restart and rebuilding it means
+# re-ingesting every session. Here remembered events are rows of an FTS5 table
+# in the same SQLite file as the sessions (or the same shards, with num_shards):
+# - startup reads nothing, memory lives on disk whatever its size
+# - new events are inserted as they come (IncrementalMemoryService), and the
+#   high-water mark of every session is stored with them in one transaction, so
+#   a restart neither loses nor duplicates anything
+# - searches go through the FTS index, ranked by FTS5's bm25
+# - an event whose text is already remembered for the user (same author, same
+#   normalized text) is not stored again, it only counts as one more use
+# - per-user and total size budgets are enforced on every ingestion by evicting
+#   the memories with the lowest score: last use, plus a bonus per use
+# - the database work runs in a worker thread, the event loop never waits on
+#   SQLite; uses are counted in memory and written with the next ingestion, so a
+#   search is a single read
+#
+# Usage:
+#   memory_service = SqliteFtsMemoryService("sqlite:///chatbot.db", num_shards=4)
+#   memory_service.stats()  # entries / bytes per user and in total, evictions, duplicates
+
+import asyncio
+import hashlib
+import json
+import math
+import threading
+import time
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.memory import _utils
+from google.adk.memory.base_memory_service import SearchMemoryResponse
+from google.adk.memory.memory_entry import MemoryEntry
+from google.genai import types
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    func,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.engine import make_url
+
+from adk_helpers.bm25_memory import tokenize
+from adk_helpers.db_maintenance import set_sqlite_connection_pragmas
+from adk_helpers.memory import HighWaterMark, IncrementalMemoryService, content_hash, event_text
+from adk_helpers.sessions import _UPSERT_INSERTS
+from adk_helpers.sharded_sessions import shard_index, shard_urls
+
+
+metadata = MetaData()
+
+# High-water marks of the ingested sessions, written with the events they cover
+memory_marks = Table(
+    "memory_marks",
+    metadata,
+    Column("app_name", String(128), primary_key=True),
+    Column("user_id", String(128), primary_key=True),
+    Column("session_id", String(128), primary_key=True),
+    Column("timestamp", Float, nullable=False),
+    # JSON list of the ids of the events at `timestamp`
+    Column("event_ids", Text, nullable=False),
+)
+
+# One row per remembered event, same rowid as its memory_fts row
+memory_entries = Table(
+    "memory_entries",
+    metadata,
+    Column("rowid", Integer, primary_key=True),
+    Column("owner", String(32), nullable=False),
+    Column("content_hash", String(40), nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("hits", Integer, nullable=False, default=0),
+    Column("last_access", Float, nullable=False),
+    # Eviction order, lowest first: last_access + FREQUENCY_BONUS_SECONDS * log2(1 + hits)
+    Column("score", Float, nullable=False),
+    UniqueConstraint("owner", "content_hash", name="uq_memory_entries_owner_hash"),
+    Index("ix_memory_entries_owner_score", "owner", "score"),
+    Index("ix_memory_entries_score", "score"),
+)
+
+# Entries / bytes per owner, and of the whole database under TOTAL
+memory_usage = Table(
+    "memory_usage",
+    metadata,
+    Column("owner", String(32), primary_key=True),
+    Column("app_name", String(128), nullable=True),
+    Column("user_id", String(128), nullable=True),
+    Column("entries", Integer, nullable=False),
+    Column("bytes", Integer, nullable=False),
+)
+
+TOTAL = "*"
+
+# A use of a memory (search hit or repeated ingestion) is worth this much recency,
+# log-scaled: 1 use = 1 week, 3 uses = 2 weeks, 7 uses = 3 weeks
+FREQUENCY_BONUS_SECONDS = 7 * 24 * 3600.0
+# Evictions go a bit under the budget, not to evict again on the next ingestion
+EVICTION_HEADROOM = 0.9
+# Uses counted in memory per database before a search writes them itself
+MAX_PENDING_USES = 1024
+
+
+def memory_score(last_access: float, hits: int) -> float:
+    return last_access + FREQUENCY_BONUS_SECONDS * math.log2(1 + hits)
+
+# `owner` is one token per (app, user) so a search only matches that user's rows
+CREATE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts USING fts5("
+    "owner, text,"
+    " app_name UNINDEXED, user_id UNINDEXED, session_id UNINDEXED, event_id UNINDEXED,"
+    " author UNINDEXED, timestamp UNINDEXED, content UNINDEXED,"
+    " tokenize = 'porter unicode61')"
+)
+
+
+def owner_token(app_name: str, user_id: str) -> str:
+    return "o" + hashlib.sha1(f"{app_name}/{user_id}".encode("utf-8")).hexdigest()[:20]
+
+
+def match_query(app_name: str, user_id: str, query: str) -> Optional[str]:
+    """FTS5 query of a user's events containing any word of the query, None without words."""
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return None
+    words = " OR ".join(f'"{term}"' for term in terms)
+    return f"owner:{owner_token(app_name, user_id)} AND ({words})"
+
+
+class SqliteFtsMemoryService(IncrementalMemoryService):
+    """Memory service storing remembered events in an FTS5 table of the session database.
+
+    With `num_shards` the events of a user go to the user's session shard
+    (ShardedSessionService with the same db_url and num_shards), `max_bytes` is
+    then split evenly between the shards.
+
+    Sizes are the bytes of the stored text and content, the FTS index adds
+    roughly as much again.
+
+    Args:
+        db_url: SQLite URL of the session store.
+        num_shards: Number of session shards, None for a single database.
+        top_k: Number of events returned by a search.
+        max_entries_per_user: Memories kept per user, None for no limit.
+        max_bytes_per_user: Bytes of memories kept per user, None for no limit.
+        max_bytes: Bytes of memories kept in total, None for no limit.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        num_shards: Optional[int] = None,
+        top_k: int = 10,
+        max_entries_per_user: Optional[int] = 10_000,
+        max_bytes_per_user: Optional[int] = 16 * 1024 * 1024,
+        max_bytes: Optional[int] = 1024 * 1024 * 1024,
+    ):
+        # The marks are in the database, only the recently used ones stay in memory
+        super().__init__(max_cached_marks=10_000)
+        if make_url(db_url).get_backend_name() != "sqlite":
+            raise ValueError("SqliteFtsMemoryService needs a SQLite database")
+        self.num_shards = num_shards
+        self.top_k = top_k
+        self.max_entries_per_user = max_entries_per_user
+        self.max_bytes_per_user = max_bytes_per_user
+        self.max_bytes_per_database = max_bytes // (num_shards or 1) if max_bytes is not None else None
+        self.duplicates = 0
+        self.evictions = 0
+        urls = shard_urls(db_url, num_shards) if num_shards else [db_url]
+        self._engines = []
+        for url in urls:
+            engine = create_engine(url)
+            event.listen(engine, "connect", set_sqlite_connection_pragmas)
+            with engine.begin() as connection:
+                connection.execute(text(CREATE_FTS_TABLE))
+            metadata.create_all(engine)
+            self._engines.append(engine)
+        # One writer per database, SQLite serializes them anyway
+        self._write_locks = [threading.Lock() for _ in self._engines]
+        # Per database, rowid -> (uses, last use) not written yet
+        self._uses_lock = threading.Lock()
+        self._pending_uses: list[dict[int, tuple[int, float]]] = [{} for _ in self._engines]
+
+    def _shard(self, user_id: str) -> int:
+        return shard_index(user_id, self.num_shards) if self.num_shards else 0
+
+    def load_high_water_mark(self, app_name: str, user_id: str, session_id: str) -> Optional[HighWaterMark]:
+        with self._engines[self._shard(user_id)].connect() as connection:
+            row = connection.execute(
+                select(memory_marks.c.timestamp, memory_marks.c.event_ids).where(
+                    memory_marks.c.app_name == app_name,
+                    memory_marks.c.user_id == user_id,
+                    memory_marks.c.session_id == session_id,
+                )
+            ).first()
+        return HighWaterMark(row.timestamp, set(json.loads(row.event_ids))) if row else None
+
+    async def add_events_to_memory(self, *, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        await asyncio.to_thread(self._add_events, app_name, user_id, session_id, events)
+
+    async def search_memory(self, *, app_name: str, user_id: str, query: str) -> SearchMemoryResponse:
+        response = SearchMemoryResponse()
+        match = match_query(app_name, user_id, query)
+        if match is None:
+            return response
+        rows = await asyncio.to_thread(self._search, user_id, match)
+        for row in rows:
+            response.memories.append(
+                MemoryEntry(
+                    content=types.Content.model_validate_json(row.content),
+                    author=row.author,
+                    timestamp=_utils.format_timestamp(row.timestamp),
+                )
+            )
+        return response
+
+    def flush_uses(self):
+        """Write the uses counted since the last ingestion of each database."""
+        for shard, engine in enumerate(self._engines):
+            with self._write_locks[shard], engine.begin() as connection:
+                self._write_uses(connection, shard)
+
+    def _add_events(self, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        shard = self._shard(user_id)
+        owner = owner_token(app_name, user_id)
+        now = time.time()
+        insert = _UPSERT_INSERTS["sqlite"]
+        with self._write_locks[shard], self._engines[shard].begin() as connection:
+            added_entries = 0
+            added_bytes = 0
+            for event in events:
+                row = {
+                    "owner": owner,
+                    "text": event_text(event),
+                    "app_name": app_name,
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "event_id": event.id,
+                    "author": event.author,
+                    "timestamp": event.timestamp,
+                    "content": event.content.model_dump_json(exclude_none=True),
+                }
+                size = len(row["text"].encode("utf-8")) + len(row["content"].encode("utf-8"))
+                digest = content_hash(event)
+                inserted = connection.execute(
+                    insert(memory_entries)
+                    .values(
+                        owner=owner, content_hash=digest, size=size, hits=0,
+                        last_access=now, score=memory_score(now, 0),
+                    )
+                    .on_conflict_do_nothing(index_elements=["owner", "content_hash"])
+                )
+                if not inserted.rowcount:
+                    # Already remembered: one more use instead of one more copy
+                    self.duplicates += 1
+                    rowid = connection.execute(
+                        select(memory_entries.c.rowid).where(
+                            memory_entries.c.owner == owner, memory_entries.c.content_hash == digest
+                        )
+                    ).scalar()
+                    self._count_uses(shard, [rowid], now)
+                    continue
+                connection.execute(
+                    text(
+                        "INSERT INTO memory_fts (rowid, owner, text, app_name, user_id, session_id, event_id, author, timestamp, content)"
+                        " VALUES (:rowid, :owner, :text, :app_name, :user_id, :session_id, :event_id, :author, :timestamp, :content)"
+                    ),
+                    {"rowid": inserted.inserted_primary_key[0], **row},
+                )
+                added_entries += 1
+                added_bytes += size
+
+            # Before the budgets, so that the evictions see the latest uses
+            self._write_uses(connection, shard)
+            if added_entries:
+                self._add_usage(connection, owner, app_name, user_id, added_entries, added_bytes)
+                self._add_usage(connection, TOTAL, None, None, added_entries, added_bytes)
+                self._enforce_budgets(connection, owner)
+
+            row = connection.execute(
+                select(memory_marks.c.timestamp, memory_marks.c.event_ids).where(
+                    memory_marks.c.app_name == app_name,
+                    memory_marks.c.user_id == user_id,
+                    memory_marks.c.session_id == session_id,
+                )
+            ).first()
+            mark = HighWaterMark(row.timestamp, set(json.loads(row.event_ids))) if row else HighWaterMark()
+            mark = mark.advanced(events)
+            values = {"timestamp": mark.timestamp, "event_ids": json.dumps(sorted(mark.event_ids))}
+            connection.execute(
+                insert(memory_marks)
+                .values(app_name=app_name, user_id=user_id, session_id=session_id, **values)
+                .on_conflict_do_update(index_elements=["app_name", "user_id", "session_id"], set_=values)
+            )
+
+    def _search(self, user_id: str, match: str):
+        shard = self._shard(user_id)
+        with self._engines[shard].connect() as connection:
+            rows = connection.execute(
+                text(
+                    "SELECT rowid, author, timestamp, content FROM memory_fts"
+                    " WHERE memory_fts MATCH :match ORDER BY rank LIMIT :limit"
+                ),
+                {"match": match, "limit": self.top_k},
+            ).all()
+        # Recalled memories are the last to be evicted
+        if rows and self._count_uses(shard, [row.rowid for row in rows], time.time()) >= MAX_PENDING_USES:
+            with self._write_locks[shard], self._engines[shard].begin() as connection:
+                self._write_uses(connection, shard)
+        return rows
+
+    def stats(self) -> dict[str, Any]:
+        """Memory footprint: entries and bytes per user and in total, database sizes, evictions and duplicates."""
+        users = {}
+        total = {"entries": 0, "bytes": 0, "database_bytes": 0}
+        for engine in self._engines:
+            with engine.connect() as connection:
+                for row in connection.execute(select(memory_usage)).all():
+                    if row.owner == TOTAL:
+                        total["entries"] += row.entries
+                        total["bytes"] += row.bytes
+                    else:
+                        users[f"{row.app_name}/{row.user_id}"] = {"entries": row.entries, "bytes": row.bytes}
+                page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+                page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+                total["database_bytes"] += page_count * page_size
+        return {"users": users, "total": total, "evictions": self.evictions, "duplicates": self.duplicates}
+
+    def close(self):
+        self.flush_uses()
+        for engine in self._engines:
+            engine.dispose()
+
+    def _count_uses(self, shard: int, rowids: list[int], now: float) -> int:
+        """Count one use of each row, returns the number of rows with pending uses."""
+        with self._uses_lock:
+            pending = self._pending_uses[shard]
+            for rowid in rowids:
+                uses, _ = pending.get(rowid, (0, now))
+                pending[rowid] = (uses + 1, now)
+            return len(pending)
+
+    def _write_uses(self, connection, shard: int):
+        with self._uses_lock:
+            pending, self._pending_uses[shard] = self._pending_uses[shard], {}
+        if not pending:
+            return
+        # Evicted since their use: not found, nothing to update
+        rows = connection.execute(
+            select(memory_entries.c.rowid, memory_entries.c.hits).where(memory_entries.c.rowid.in_(list(pending)))
+        ).all()
+        if not rows:
+            return
+        updates = []
+        for row in rows:
+            uses, last_access = pending[row.rowid]
+            updates.append({
+                "entry": row.rowid,
+                "new_hits": row.hits + uses,
+                "new_last_access": last_access,
+                "new_score": memory_score(last_access, row.hits + uses),
+            })
+        connection.execute(
+            update(memory_entries)
+            .where(memory_entries.c.rowid == bindparam("entry"))
+            .values(
+                hits=bindparam("new_hits"),
+                last_access=bindparam("new_last_access"),
+                score=bindparam("new_score"),
+            ),
+            updates,
+        )
+
+    def _add_usage(self, connection, owner: str, app_name: Optional[str], user_id: Optional[str], entries: int, size: int):
+        insert = _UPSERT_INSERTS["sqlite"]
+        connection.execute(
+            insert(memory_usage)
+            .values(owner=owner, app_name=app_name, user_id=user_id, entries=entries, bytes=size)
+            .on_conflict_do_update(
+                index_elements=["owner"],
+                set_={
+                    "entries": memory_usage.c.entries + entries,
+                    "bytes": memory_usage.c.bytes + size,
+                },
+            )
+        )
+
+    def _usage(self, connection, owner: str) -> tuple[int, int]:
+        row = connection.execute(
+            select(memory_usage.c.entries, memory_usage.c.bytes).where(memory_usage.c.owner == owner)
+        ).first()
+        return (row.entries, row.bytes) if row else (0, 0)
+
+    def _enforce_budgets(self, connection, owner: str):
+        entries, size = self._usage(connection, owner)
+        excess_entries = entries - int(self.max_entries_per_user * EVICTION_HEADROOM) if (
+            self.max_entries_per_user is not None and entries > self.max_entries_per_user
+        ) else 0
+        excess_bytes = size - int(self.max_bytes_per_user * EVICTION_HEADROOM) if (
+            self.max_bytes_per_user is not None and size > self.max_bytes_per_user
+        ) else 0
+        if excess_entries > 0 or excess_bytes > 0:
+            self._evict(connection, excess_entries, excess_bytes, memory_entries.c.owner == owner)
+
+        if self.max_bytes_per_database is not None:
+            _, total_bytes = self._usage(connection, TOTAL)
+            if total_bytes > self.max_bytes_per_database:
+                self._evict(connection, 0, total_bytes - int(self.max_bytes_per_database * EVICTION_HEADROOM))
+
+    def _evict(self, connection, entries: int, size: int, *where):
+        """Delete the lowest scored entries until `entries` entries and `size` bytes are freed."""
+        freed_entries = 0
+        freed_bytes = 0
+        while freed_entries < entries or freed_bytes < size:
+            victims = connection.execute(
+                select(memory_entries.c.rowid, memory_entries.c.owner, memory_entries.c.size)
+                .where(*where)
+                .order_by(memory_entries.c.score)
+                .limit(256)
+            ).all()
+            if not victims:
+                break
+            chosen = []
+            for victim in victims:
+                if freed_entries >= entries and freed_bytes >= size:
+                    break
+                chosen.append(victim)
+                freed_entries += 1
+                freed_bytes += victim.size
+            rowids = [victim.rowid for victim in chosen]
+            connection.execute(
+                text("DELETE FROM memory_fts WHERE rowid IN (SELECT value FROM json_each(:rowids))"),
+                {"rowids": json.dumps(rowids)},
+            )
+            connection.execute(delete(memory_entries).where(memory_entries.c.rowid.in_(rowids)))
+            by_owner: dict[str, list[int]] = {}
+            for victim in chosen:
+                by_owner.setdefault(victim.owner, [0, 0])
+                by_owner[victim.owner][0] += 1
+                by_owner[victim.owner][1] += victim.size
+            for victim_owner, (count, victim_bytes) in by_owner.items():
+                self._add_usage(connection, victim_owner, None, None, -count, -victim_bytes)
+            self._add_usage(connection, TOTAL, None, None, -len(chosen), -sum(victim.size for victim in chosen))
+            self.evictions += len(chosen)
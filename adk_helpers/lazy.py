@@ -0,0 +1,95 @@
+# Objects built on first use, for the module-level services and runners of the agents
+#
+# `adk web` / `adk run` import an agent package only to find its root_agent, and
+# short-lived workers import it for one task. A DatabaseSessionService built at
+# import time connects and creates its tables (a ShardedSessionService creates
+# every shard file) before anything needs them. Lazy defers the construction to
+# the first attribute access:
+#
+#   session_service = Lazy(lambda: CachedSessionService(DatabaseSessionService(db_url=db_url)))
+#   runner = Lazy(lambda: Runner(app=app, session_service=session_service))
+#
+# The proxy forwards attribute access and isinstance() checks to the object, so
+# it can be passed anywhere the object is expected.
+#
+# Agents are validated against their model type when they are defined, a model
+# has to exist at import time. LazyModel stands in for it and builds the real
+# one (configuration checks, client) on the first request:
+#
+#   model = LazyModel(model="gemini-2.5-flash", factory=create_model)
+
+import threading
+import time
+from typing import Any, AsyncGenerator, Callable, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from pydantic import PrivateAttr
+
+
+class Lazy:
+    """Proxy building its object with `factory` the first time it is used.
+
+    Construction happens once, under a lock; `seconds` is how long it took.
+
+    Args:
+        factory: Builds the object.
+        name: Shown in repr() and in startup profiles, defaults to the factory's name.
+    """
+
+    __slots__ = ("_factory", "_instance", "_lock", "_name", "seconds")
+
+    def __init__(self, factory: Callable[[], Any], name: Optional[str] = None):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+        object.__setattr__(self, "_name", name or getattr(factory, "__name__", "lazy"))
+        object.__setattr__(self, "seconds", None)
+
+    @property
+    def constructed(self) -> bool:
+        return self.seconds is not None
+
+    def get(self) -> Any:
+        """The object, built now if it was not yet."""
+        if self.seconds is None:
+            with self._lock:
+                if self.seconds is None:
+                    started = time.perf_counter()
+                    object.__setattr__(self, "_instance", self._factory())
+                    object.__setattr__(self, "seconds", time.perf_counter() - started)
+        return self._instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.get(), name, value)
+
+    # isinstance() falls back to __class__: the proxy passes the checks of the object's type
+    @property
+    def __class__(self):
+        return type(self.get())
+
+    def __repr__(self) -> str:
+        if self.seconds is None:
+            return f"<Lazy {self._name}, not built>"
+        return repr(self._instance)
+
+
+class LazyModel(BaseLlm):
+    """Model built by `factory` on the first request, `model` is its name until then."""
+
+    factory: Callable[[], BaseLlm]
+
+    _llm: Optional[Lazy] = PrivateAttr(default=None)
+
+    def model_post_init(self, context: Any):
+        self._llm = Lazy(self.factory, self.model)
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        async for response in self._llm.generate_content_async(llm_request, stream):
+            yield response
+
+    def connect(self, llm_request):
+        return self._llm.connect(llm_request)
@@ -0,0 +1,369 @@
+# End-to-end load test of the agents of this repo with a stand-in model
+#
+# Usage:
+#   python -m adk_helpers.load_bench
+#   python -m adk_helpers.load_bench --apps greeting_agent,agent_with_memory --concurrency 1,8,32 \
+#       --sessions-per-worker 2 --turns 3 --first-token-seconds 0.35 --output-tokens 120 --json load.json
+#
+# Every app runs on the real stack: its agents, tools and plugins, a Runner and a
+# DatabaseSessionService on a fresh SQLite file. Only the Gemini models are
+# replaced by StandInChatModel, a deterministic local model calling each declared
+# tool once per turn and answering with a fixed number of tokens, after the
+# configured latency. Nothing is sent to Gemini.
+#
+# Reported per app:
+# - overhead: turn latency with a zero-latency model at concurrency 1, i.e. the
+#   cost of ADK, the session store, the plugins and our helpers per turn
+# - allocations: peak and retained traced memory per turn (tracemalloc)
+# - for each concurrency: turns/s and turn latency p50/p95/p99 with the model latency on
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, AsyncGenerator, Optional
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.apps.app import App
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from google.adk.runners import Runner
+from google.adk.sessions import DatabaseSessionService
+from google.adk.tools.agent_tool import AgentTool
+from google.genai import types
+from pydantic import BaseModel, PrivateAttr
+
+from adk_helpers.compaction import CHARS_PER_TOKEN
+from adk_helpers.memory import IncrementalInMemoryMemoryService
+from adk_helpers.session_driver import SessionDriver, SessionJob
+
+
+# App name -> agent or App, as module:attribute
+APPS = {
+    "greeting_agent": "greeting_agent.agent:root_agent",
+    "evaluating_agents": "evaluating_agents.agent:automation_app",
+    "agents_as_orchestrator": "agents_as_orchestrator.agent:root_agent",
+    "blog_writer_agent": "blog_writer_agent.agent:root_agent",
+    "agent_with_memory": "agent_with_memory.agent_with_memory:chatbot_app",
+}
+
+# Directories holding the agent packages, relative to the repository root
+AGENT_DIRECTORIES = ["basic-agent", "multi-agent"]
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUERIES = [
+    "Hi, I am Alex. What can you do for me?",
+    "Tell me about the latest findings on battery recycling.",
+    "Turn on the lights in the kitchen and summarize what you did.",
+    "What did I ask you first?",
+]
+
+# Tools the stand-in never calls: they hand the turn over to another agent
+_NOT_CALLED = {"transfer_to_agent"}
+
+
+class StandInChatModel(BaseLlm):
+    """Deterministic chat model: calls every declared tool once per turn, then answers.
+
+    A turn is the contents after the last user text. Each call waits
+    `first_token_seconds`, plus `output_tokens / output_tokens_per_second` for
+    answers. Answers are `output_tokens` tokens of text, or a JSON object matching
+    the response schema. set_model_response (structured output with tools) is
+    called last.
+
+    The name starts with gemini-2 so ADK's built-in tools (google_search) accept it.
+    """
+
+    model: str = "gemini-2.5-flash-lite"
+    first_token_seconds: float = 0.35
+    output_tokens: int = 120
+    output_tokens_per_second: float = 250.0
+
+    _calls: int = PrivateAttr(default=0)
+    _tool_calls: int = PrivateAttr(default=0)
+    _modelled_seconds: float = PrivateAttr(default=0.0)
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self._calls += 1
+        declarations = {
+            declaration.name: declaration
+            for tool in (llm_request.config.tools or [])
+            for declaration in (tool.function_declarations or [])
+            if declaration.name not in _NOT_CALLED
+        }
+        called = _called_this_turn(llm_request.contents)
+        pending = sorted(
+            (name for name in declarations if name not in called), key=lambda name: name == "set_model_response"
+        )
+        if pending:
+            await self._wait(self.first_token_seconds)
+            self._tool_calls += 1
+            declaration = declarations[pending[0]]
+            yield LlmResponse(
+                content=types.Content(
+                    role="model",
+                    parts=[types.Part(function_call=types.FunctionCall(name=declaration.name, args=_sample_arguments(declaration)))],
+                )
+            )
+            return
+
+        schema = llm_request.config.response_schema
+        if schema is not None:
+            text = json.dumps(_sample(_json_schema(schema)))
+            tokens = len(text) // CHARS_PER_TOKEN
+        else:
+            text = " ".join(f"word{position % 97}" for position in range(self.output_tokens))
+            tokens = self.output_tokens
+        await self._wait(self.first_token_seconds + tokens / self.output_tokens_per_second)
+        yield LlmResponse(content=types.Content(role="model", parts=[types.Part(text=text)]))
+
+    async def _wait(self, seconds: float):
+        self._modelled_seconds += seconds
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def reset(self):
+        self._calls = 0
+        self._tool_calls = 0
+        self._modelled_seconds = 0.0
+
+    def counters(self) -> dict[str, Any]:
+        return {"calls": self._calls, "tool_calls": self._tool_calls, "modelled_seconds": self._modelled_seconds}
+
+
+def _called_this_turn(contents: list[types.Content]) -> set[str]:
+    called = set()
+    for content in reversed(contents):
+        parts = content.parts or []
+        if content.role == "user" and any(part.text for part in parts):
+            break
+        called.update(part.function_call.name for part in parts if part.function_call)
+    return called
+
+
+def _json_schema(schema) -> dict[str, Any]:
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        return schema.model_json_schema()
+    if isinstance(schema, types.Schema):
+        return schema.model_dump(mode="json", exclude_none=True)
+    return schema
+
+
+def _sample_arguments(declaration: types.FunctionDeclaration) -> dict[str, Any]:
+    if declaration.parameters_json_schema is not None:
+        return _sample(declaration.parameters_json_schema)
+    if declaration.parameters is not None:
+        return _sample(_json_schema(declaration.parameters))
+    return {}
+
+
+def _sample(schema: dict[str, Any], definitions: Optional[dict[str, Any]] = None) -> Any:
+    """A value matching a JSON schema (or a google.genai Schema dumped to a dict)."""
+    definitions = definitions if definitions is not None else schema.get("$defs", schema.get("defs", {}))
+    if "$ref" in schema:
+        return _sample(definitions[schema["$ref"].rsplit("/", 1)[-1]], definitions)
+    for alternatives in ("anyOf", "any_of"):
+        if schema.get(alternatives):
+            choices = [choice for choice in schema[alternatives] if str(choice.get("type", "")).lower() != "null"]
+            return _sample((choices or schema[alternatives])[0], definitions)
+    if schema.get("enum"):
+        return schema["enum"][0]
+    kind = str(schema.get("type", "object")).lower()
+    if kind == "object":
+        return {name: _sample(value, definitions) for name, value in (schema.get("properties") or {}).items()}
+    if kind == "array":
+        return [_sample(schema.get("items") or {"type": "string"}, definitions)]
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    return "stand-in"
+
+
+def replace_models(agent: BaseAgent, model: BaseLlm):
+    """Give every LLM agent of the tree, agents behind AgentTools included, the stand-in model."""
+    if isinstance(agent, LlmAgent):
+        agent.model = model
+        for tool in agent.tools:
+            if isinstance(tool, AgentTool):
+                replace_models(tool.agent, model)
+    for sub_agent in agent.sub_agents:
+        replace_models(sub_agent, model)
+
+
+def load_app(name: str, model: BaseLlm) -> App:
+    """The app of APPS[name] with its models replaced, agents without an App get a bare one."""
+    for directory in AGENT_DIRECTORIES:
+        path = os.path.join(REPOSITORY_ROOT, directory)
+        if path not in sys.path:
+            sys.path.append(path)
+    # The agent modules refuse to load without a key, the stand-in never uses it
+    os.environ.setdefault("GOOGLE_API_KEY", "stand-in")
+    module_name, _, attribute = APPS[name].partition(":")
+    loaded = getattr(importlib.import_module(module_name), attribute)
+    app = loaded if isinstance(loaded, App) else App(name=name, root_agent=loaded)
+    replace_models(app.root_agent, model)
+    return app
+
+
+async def _drain_plugins(app: App):
+    # Background work started by the turns (compaction) belongs to the level that started it
+    for plugin in app.plugins:
+        worker = getattr(plugin, "worker", None)
+        if worker is not None:
+            await worker.drain()
+
+
+def _jobs(label: str, sessions: int, turns: int) -> list[SessionJob]:
+    return [
+        SessionJob(f"user-{session % 16}", f"{label}-{session}", [QUERIES[turn % len(QUERIES)] for turn in range(turns)])
+        for session in range(sessions)
+    ]
+
+
+async def bench_app(name: str, args, directory: str) -> dict[str, Any]:
+    # No latency until the throughput levels: the overhead is measured alone
+    model = StandInChatModel(first_token_seconds=0.0, output_tokens=args.output_tokens, output_tokens_per_second=float("inf"))
+    app = load_app(name, model)
+    session_service = DatabaseSessionService(db_url=f"sqlite:///{os.path.join(directory, name)}.db")
+    runner = Runner(app=app, session_service=session_service, memory_service=IncrementalInMemoryMemoryService())
+    report: dict[str, Any] = {"app": name}
+    try:
+        # Warm-up: first-call imports and caches are not part of the overhead
+        await SessionDriver(runner, concurrency=1).run(_jobs("warmup", 1, 2))
+        await _drain_plugins(app)
+
+        # Framework overhead: zero model latency, one turn at a time
+        model.reset()
+        driver = SessionDriver(runner, concurrency=1)
+        await driver.run(_jobs("overhead", 2, args.turns))
+        await _drain_plugins(app)
+        stats = driver.stats()
+        report["overhead"] = {
+            "turns": stats["turns"],
+            "failed_turns": stats["failed_turns"],
+            "turn_p50": stats["turn_p50"],
+            "turn_p95": stats["turn_p95"],
+            "turn_p99": stats["turn_p99"],
+            "model_calls_per_turn": model.counters()["calls"] / max(1, stats["turns"]),
+        }
+
+        # Allocations per turn, traced separately: tracemalloc slows everything down
+        gc.collect()
+        tracemalloc.start()
+        peaks, retained = [], []
+        for turn in range(args.alloc_turns):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await SessionDriver(runner, concurrency=1).run([SessionJob("user-alloc", "alloc", [QUERIES[turn % len(QUERIES)]])])
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+        tracemalloc.stop()
+        await _drain_plugins(app)
+        report["allocations"] = {
+            "turns": args.alloc_turns,
+            "peak_bytes_per_turn": statistics.median(peaks) if peaks else 0,
+            "retained_bytes_per_turn": statistics.median(retained) if retained else 0,
+        }
+
+        # Throughput and latency with the model latency on
+        model.first_token_seconds = args.first_token_seconds
+        model.output_tokens_per_second = args.output_tokens_per_second
+        report["concurrency"] = []
+        for concurrency in args.concurrency:
+            model.reset()
+            driver = SessionDriver(runner, concurrency=concurrency)
+            await driver.run(_jobs(f"c{concurrency}", concurrency * args.sessions_per_worker, args.turns))
+            await _drain_plugins(app)
+            stats = driver.stats()
+            turns = max(1, stats["turns"])
+            report["concurrency"].append(
+                {
+                    "concurrency": concurrency,
+                    "turns": stats["turns"],
+                    "failed_turns": stats["failed_turns"],
+                    "turns_per_second": stats["turns_per_second"],
+                    "turn_p50": stats["turn_p50"],
+                    "turn_p95": stats["turn_p95"],
+                    "turn_p99": stats["turn_p99"],
+                    "model_seconds_per_turn": model.counters()["modelled_seconds"] / turns,
+                }
+            )
+    finally:
+        await runner.close()
+    return report
+
+
+async def run_benchmark(args) -> list[dict[str, Any]]:
+    reports = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.apps:
+            # The agents, their plugins (LoggingPlugin) and the scripts print a lot
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                started = time.monotonic()
+                report = await bench_app(name, args, directory)
+            report["seconds"] = time.monotonic() - started
+            reports.append(report)
+            _print_report(report)
+    return reports
+
+
+def _print_report(report: dict[str, Any]):
+    overhead = report["overhead"]
+    allocations = report["allocations"]
+    print(
+        f"{report['app']}: overhead p50 {overhead['turn_p50'] * 1000:.1f}ms p95 {overhead['turn_p95'] * 1000:.1f}ms"
+        f" p99 {overhead['turn_p99'] * 1000:.1f}ms, {overhead['model_calls_per_turn']:.1f} model calls/turn,"
+        f" peak {allocations['peak_bytes_per_turn'] / 1024:.0f} KiB retained"
+        f" {allocations['retained_bytes_per_turn'] / 1024:.0f} KiB per turn"
+    )
+    print(f"  {'concurrency':>11} {'turns':>6} {'failed':>6} {'turns/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'model/turn':>10}")
+    for level in report["concurrency"]:
+        print(
+            f"  {level['concurrency']:>11} {level['turns']:>6} {level['failed_turns']:>6}"
+            f" {level['turns_per_second']:>8.2f} {level['turn_p50']:>7.2f}s {level['turn_p95']:>7.2f}s"
+            f" {level['turn_p99']:>7.2f}s {level['model_seconds_per_turn']:>9.2f}s"
+        )
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the agents end to end with a stand-in model")
+    parser.add_argument("--apps", type=lambda value: value.split(","), default=list(APPS), help=f"Comma separated, from {', '.join(APPS)}")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32])
+    parser.add_argument("--sessions-per-worker", type=int, default=2, help="Sessions per concurrency slot at each level")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per session")
+    parser.add_argument("--alloc-turns", type=int, default=5, help="Turns traced for allocations")
+    parser.add_argument("--first-token-seconds", type=float, default=0.35)
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--output-tokens-per-second", type=float, default=250.0)
+    parser.add_argument("--json", dest="json_path", help="Write the reports to this file")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.apps if name not in APPS]
+    if unknown:
+        parser.error(f"Unknown apps: {', '.join(unknown)}")
+
+    reports = asyncio.run(run_benchmark(args))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(reports, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
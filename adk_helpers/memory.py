@@ -0,0 +1,156 @@
+# Memory services indexing every event once
+#
+# ADK's add_session_to_memory(session) hands the whole session over on every call
+# and InMemoryMemoryService rebuilds the session's entry from all of its events,
+# so calling it every turn costs O(n^2) over a conversation. The services below
+# keep a high-water mark per session and only index the events after it: call
+# add_session_to_memory once per turn or once at the end of the session, the
+# work is the same.
+
+import abc
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from google.adk.events.event import Event
+from google.adk.memory import _utils
+from google.adk.memory.base_memory_service import BaseMemoryService, SearchMemoryResponse
+from google.adk.memory.memory_entry import MemoryEntry
+from google.adk.sessions import Session
+
+
+def event_text(event: Event) -> str:
+    """The text of an event, empty for events without text parts."""
+    if not event.content or not event.content.parts:
+        return ""
+    return " ".join(part.text for part in event.content.parts if part.text)
+
+
+def content_hash(event: Event) -> str:
+    """Hash of who said what, the same text said twice by the same author is one memory."""
+    normalized = " ".join(event_text(event).split()).lower()
+    return hashlib.sha1(f"{event.author}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class HighWaterMark:
+    """Latest event of a session already indexed: its timestamp, and the ids indexed at that timestamp."""
+
+    def __init__(self, timestamp: float = float("-inf"), event_ids: Optional[set[str]] = None):
+        self.timestamp = timestamp
+        self.event_ids = event_ids or set()
+
+    def is_new(self, event: Event) -> bool:
+        return event.timestamp > self.timestamp or (
+            event.timestamp == self.timestamp and event.id not in self.event_ids
+        )
+
+    def advanced(self, events: list[Event]) -> "HighWaterMark":
+        timestamp = max([self.timestamp] + [event.timestamp for event in events])
+        event_ids = {event.id for event in events if event.timestamp == timestamp}
+        if timestamp == self.timestamp:
+            event_ids |= self.event_ids
+        return HighWaterMark(timestamp, event_ids)
+
+
+class IncrementalMemoryService(BaseMemoryService):
+    """Base of the memory services indexing only the events added since the last call.
+
+    Subclasses implement add_events_to_memory and search_memory. The mark is a
+    timestamp, not a position, so sessions loaded as a tail window (TailWindow-
+    SessionService) work as long as memory is fed at least once per tail.
+
+    Services persisting their marks (load_high_water_mark) can bound the marks
+    kept in memory with `max_cached_marks`, the least recently used are dropped.
+    """
+
+    def __init__(self, max_cached_marks: Optional[int] = None):
+        self._marks_lock = threading.Lock()
+        self._marks: OrderedDict[tuple[str, str, str], HighWaterMark] = OrderedDict()
+        self.max_cached_marks = max_cached_marks
+
+    async def add_session_to_memory(self, session: Session) -> int:
+        """Index the events of the session not indexed yet, returns how many there were."""
+        key = (session.app_name, session.user_id, session.id)
+        # Taken and advanced under the lock, concurrent calls never index an event twice
+        with self._marks_lock:
+            mark = self._marks.get(key)
+            if mark is None:
+                mark = self.load_high_water_mark(*key) or HighWaterMark()
+            events = [event for event in session.events if mark.is_new(event)]
+            if not events:
+                return 0
+            advanced = mark.advanced(events)
+            self._marks[key] = advanced
+            self._marks.move_to_end(key)
+            if self.max_cached_marks is not None and len(self._marks) > self.max_cached_marks:
+                self._marks.popitem(last=False)
+
+        indexable = [event for event in events if event_text(event)]
+        try:
+            if indexable:
+                await self.add_events_to_memory(
+                    app_name=session.app_name, user_id=session.user_id, session_id=session.id, events=indexable
+                )
+        except Exception:
+            with self._marks_lock:
+                # Give the events back to the next call, unless another call moved on meanwhile
+                if self._marks.get(key) is advanced:
+                    self._marks[key] = mark
+            raise
+        return len(indexable)
+
+    def high_water_mark(self, app_name: str, user_id: str, session_id: str) -> Optional[HighWaterMark]:
+        with self._marks_lock:
+            return self._marks.get((app_name, user_id, session_id))
+
+    def load_high_water_mark(self, app_name: str, user_id: str, session_id: str) -> Optional[HighWaterMark]:
+        """Mark of a session not seen since the service started, for services persisting their index."""
+        return None
+
+    @abc.abstractmethod
+    async def add_events_to_memory(self, *, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        """Index new events of a session, each event is passed once."""
+
+
+def _extract_words_lower(text: str) -> set[str]:
+    return {word.lower() for word in re.findall(r"[A-Za-z]+", text)}
+
+
+class IncrementalInMemoryMemoryService(IncrementalMemoryService):
+    """InMemoryMemoryService with incremental ingestion, same keyword matching.
+
+    The words of an event are extracted once, when it is indexed, instead of at
+    every search.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        # "{app_name}/{user_id}" -> (event, words of the event)
+        self._user_events: dict[str, list[tuple[Event, set[str]]]] = {}
+
+    async def add_events_to_memory(self, *, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        entries = [(event, _extract_words_lower(event_text(event))) for event in events]
+        with self._lock:
+            self._user_events.setdefault(f"{app_name}/{user_id}", []).extend(
+                (event, words) for event, words in entries if words
+            )
+
+    async def search_memory(self, *, app_name: str, user_id: str, query: str) -> SearchMemoryResponse:
+        with self._lock:
+            user_events = list(self._user_events.get(f"{app_name}/{user_id}", []))
+
+        words_in_query = _extract_words_lower(query)
+        response = SearchMemoryResponse()
+        for event, words in user_events:
+            if words_in_query & words:
+                response.memories.append(
+                    MemoryEntry(
+                        content=event.content,
+                        author=event.author,
+                        timestamp=_utils.format_timestamp(event.timestamp),
+                    )
+                )
+        return response
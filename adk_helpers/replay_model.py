@@ -0,0 +1,306 @@
+# Record-and-replay model backend
+#
+# RecordReplayModel wraps a real model. In "record" mode every request goes to
+# the wrapped model and the responses are stored, keyed by a hash of the
+# normalized prompt. In "replay" mode the stored responses are returned without
+# any network call: runs are free, deterministic and take milliseconds.
+#
+# The store is one SQLite file, responses zlib-compressed. It can be seeded
+# without any recording: from the `events` tables of existing session databases
+# (each model event is the response to the events before it) and from evalsets.
+#
+# Usage:
+#   python -m adk_helpers.replay_model seed replay.db chatbot.db my_agent.db \
+#       --evalset evaluating_agents/home_automation_tests.evalset.json
+#   python -m adk_helpers.replay_model stats replay.db
+#
+#   wrap_models(root_agent, "replay.db", mode="record")   # against Gemini
+#   wrap_models(root_agent, "replay.db", mode="replay")   # offline, in CI
+#
+# The key is the conversation only: roles, texts (whitespace collapsed), function
+# calls and responses without their ids. The system instruction and the tool
+# declarations are left out so sessions and evalsets, which do not store them,
+# can seed the store. Two agents given the same conversation share a response.
+
+import argparse
+import hashlib
+import json
+import threading
+import zlib
+from typing import Any, AsyncGenerator, Optional
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_response import LlmResponse
+from google.adk.tools.agent_tool import AgentTool
+from google.genai import types
+from pydantic import PrivateAttr
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, MetaData, String, Table, create_engine, func, select
+
+from adk_helpers.compaction_bench import load_recorded_sessions
+from adk_helpers.sessions import _UPSERT_INSERTS
+
+
+metadata = MetaData()
+
+model_recordings = Table(
+    "model_recordings",
+    metadata,
+    # sha256 of the normalized prompt
+    Column("prompt_hash", String(64), primary_key=True),
+    # zlib-compressed JSON list of LlmResponse dumps, the non-partial responses of the call
+    Column("responses", LargeBinary, nullable=False),
+    # "recorded", "session" or "evalset"
+    Column("source", String(16), nullable=False),
+    Column("replays", Integer, nullable=False, default=0),
+    Column("create_time", DateTime, default=func.now()),
+)
+
+MODES = ("record", "replay")
+
+
+def normalized_prompt(contents: list[types.Content]) -> list:
+    """The conversation of a prompt, without what varies between two runs of it."""
+    normalized = []
+    for content in contents:
+        parts = []
+        for part in content.parts or []:
+            if part.thought:
+                continue
+            if part.function_call:
+                parts.append({"call": part.function_call.name, "args": part.function_call.args or {}})
+            elif part.function_response:
+                parts.append({"result": part.function_response.name, "response": part.function_response.response or {}})
+            elif part.inline_data and part.inline_data.data:
+                parts.append({"data": hashlib.sha256(part.inline_data.data).hexdigest()})
+            elif part.text and part.text.strip():
+                parts.append({"text": " ".join(part.text.split())})
+        if parts:
+            normalized.append([content.role or "user", parts])
+    return normalized
+
+
+def prompt_hash(contents: list[types.Content]) -> str:
+    encoded = json.dumps(normalized_prompt(contents), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _without_call_ids(response: LlmResponse) -> dict[str, Any]:
+    # ADK gives calls without an id a fresh one, a replayed id would be shared by every replay
+    dumped = response.model_dump(mode="json", exclude_none=True)
+    for part in (dumped.get("content") or {}).get("parts", []):
+        for key in ("function_call", "function_response"):
+            if key in part:
+                part[key].pop("id", None)
+    return dumped
+
+
+class ReplayStore:
+    """Prompt hash -> responses, in a SQLite file.
+
+    Args:
+        path: SQLite file, created if missing.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.engine = create_engine(f"sqlite:///{path}")
+        metadata.create_all(self.engine)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[list[LlmResponse]]:
+        with self.engine.begin() as connection:
+            data = connection.execute(
+                select(model_recordings.c.responses).where(model_recordings.c.prompt_hash == key)
+            ).scalar()
+            if data is None:
+                return None
+            connection.execute(
+                model_recordings.update()
+                .where(model_recordings.c.prompt_hash == key)
+                .values(replays=model_recordings.c.replays + 1)
+            )
+        return [LlmResponse.model_validate(response) for response in json.loads(zlib.decompress(data))]
+
+    def put(self, key: str, responses: list[dict[str, Any]], source: str, replace: bool = True) -> bool:
+        """Store the responses of a prompt, returns False when an existing row was kept.
+
+        Seeds pass replace=False: a recording is never overwritten by a guess.
+        """
+        values = {"responses": zlib.compress(json.dumps(responses, separators=(",", ":")).encode("utf-8"), 9), "source": source}
+        insert = _UPSERT_INSERTS["sqlite"](model_recordings).values(prompt_hash=key, replays=0, **values)
+        if replace:
+            insert = insert.on_conflict_do_update(index_elements=["prompt_hash"], set_=values)
+        else:
+            insert = insert.on_conflict_do_nothing(index_elements=["prompt_hash"])
+        with self._lock, self.engine.begin() as connection:
+            # 0 when ON CONFLICT DO NOTHING skipped the row
+            return connection.execute(insert).rowcount > 0
+
+    def stats(self) -> dict[str, Any]:
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(
+                    model_recordings.c.source,
+                    func.count(),
+                    func.sum(func.length(model_recordings.c.responses)),
+                    func.sum(model_recordings.c.replays),
+                ).group_by(model_recordings.c.source)
+            ).all()
+        return {source: {"prompts": count, "bytes": size or 0, "replays": replays or 0} for source, count, size, replays in rows}
+
+    def close(self):
+        self.engine.dispose()
+
+
+class RecordReplayModel(BaseLlm):
+    """Model recording the responses of `inner`, or replaying them from a ReplayStore.
+
+    In replay mode a prompt that was never recorded goes to `fallback` when there
+    is one (not recorded), otherwise the call fails with a ValueError naming the
+    prompt hash.
+    """
+
+    inner: Optional[BaseLlm] = None
+    fallback: Optional[BaseLlm] = None
+    store_path: str
+    mode: str = "replay"
+
+    _store: Optional[ReplayStore] = PrivateAttr(default=None)
+
+    def model_post_init(self, context: Any):
+        if self.mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {self.mode!r}")
+        if self.mode == "record" and self.inner is None:
+            raise ValueError("Recording needs the `inner` model")
+
+    @property
+    def store(self) -> ReplayStore:
+        if self._store is None:
+            self._store = ReplayStore(self.store_path)
+        return self._store
+
+    async def generate_content_async(self, llm_request, stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        key = prompt_hash(llm_request.contents)
+        if self.mode == "replay":
+            responses = self.store.get(key)
+            if responses is not None:
+                for response in responses:
+                    yield response
+                return
+            if self.fallback is None:
+                raise ValueError(f"No recorded response for prompt {key}")
+            async for response in self.fallback.generate_content_async(llm_request, stream):
+                yield response
+            return
+
+        recorded = []
+        async for response in self.inner.generate_content_async(llm_request, stream):
+            if not response.partial:
+                recorded.append(_without_call_ids(response))
+            yield response
+        # Failed calls (no content) are not replayed, the next run asks again
+        if recorded and not any(response.get("error_code") for response in recorded):
+            self.store.put(key, recorded, "recorded")
+
+
+def wrap_models(
+    agent: BaseAgent, store_path: str, mode: str = "replay", fallback: Optional[BaseLlm] = None
+) -> list[RecordReplayModel]:
+    """Wrap the model of every LLM agent of the tree, agents behind AgentTools included.
+
+    Returns the wrappers, they share one store per `store_path`.
+    """
+    store = ReplayStore(store_path)
+    wrappers = []
+
+    def wrap(agent: BaseAgent):
+        if isinstance(agent, LlmAgent):
+            model = RecordReplayModel(
+                model=agent.canonical_model.model,
+                inner=agent.canonical_model,
+                fallback=fallback,
+                store_path=store_path,
+                mode=mode,
+            )
+            model._store = store
+            agent.model = model
+            wrappers.append(model)
+            for tool in agent.tools:
+                if isinstance(tool, AgentTool):
+                    wrap(tool.agent)
+        for sub_agent in agent.sub_agents:
+            wrap(sub_agent)
+
+    wrap(agent)
+    return wrappers
+
+
+def _response(content: types.Content) -> list[dict[str, Any]]:
+    return [_without_call_ids(LlmResponse(content=content))]
+
+
+def seed_from_database(store: ReplayStore, db_url: str) -> int:
+    """Seed the store from the sessions of a database, returns the number of prompts added."""
+    added = 0
+    for events in load_recorded_sessions(db_url).values():
+        contents: list[types.Content] = []
+        for event in events:
+            if event.author != "user" and event.content.role == "model":
+                added += store.put(prompt_hash(contents), _response(event.content), "session", replace=False)
+            contents.append(event.content)
+    return added
+
+
+def seed_from_evalset(store: ReplayStore, path: str) -> int:
+    """Seed the store from the conversations of an evalset, returns the number of prompts added."""
+    with open(path, encoding="utf-8") as evalset_file:
+        evalset = json.load(evalset_file)
+    added = 0
+    for eval_case in evalset.get("eval_cases", []):
+        contents: list[types.Content] = []
+        for invocation in eval_case.get("conversation", []):
+            contents.append(types.Content.model_validate(invocation["user_content"]))
+            intermediate = invocation.get("intermediate_data") or {}
+            for event in intermediate.get("invocation_events", []):
+                content = types.Content.model_validate(event["content"])
+                if content.role == "model":
+                    added += store.put(prompt_hash(contents), _response(content), "evalset", replace=False)
+                contents.append(content)
+            if invocation.get("final_response"):
+                content = types.Content.model_validate(invocation["final_response"])
+                content.role = "model"
+                added += store.put(prompt_hash(contents), _response(content), "evalset", replace=False)
+                contents.append(content)
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed or inspect a model replay store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    seed = commands.add_parser("seed", help="Add the model responses of session databases and evalsets")
+    seed.add_argument("store", help="Replay store (SQLite file)")
+    seed.add_argument("databases", nargs="*", help="SQLite session databases")
+    seed.add_argument("--evalset", action="append", default=[], help="Evalset JSON file, repeatable")
+    stats = commands.add_parser("stats", help="Prompts, size and replays per source")
+    stats.add_argument("store", help="Replay store (SQLite file)")
+    args = parser.parse_args()
+
+    store = ReplayStore(args.store)
+    try:
+        if args.command == "seed":
+            for database in args.databases:
+                print(f"{database}: {seed_from_database(store, f'sqlite:///{database}')} responses")
+            for evalset in args.evalset:
+                print(f"{evalset}: {seed_from_evalset(store, evalset)} responses")
+        for source, source_stats in store.stats().items():
+            print(
+                f"{source}: {source_stats['prompts']} prompts, {source_stats['bytes']} bytes,"
+                f" {source_stats['replays']} replays"
+            )
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# Local HTTP server streaming the agents' events over Server-Sent Events
+#
+# The runners are loaded once per process and shared by every request: their
+# session services (and the connection pools behind them), memory services and
+# compaction workers live as long as the server. Turns of different sessions run
+# concurrently, turns of one session are played one after the other.
+#
+# Usage:
+#   python -m adk_helpers.server --port 8080
+#   python -m adk_helpers.server --runner research=agent_with_memory.agent:research_runner
+#
+#   curl -N -X POST localhost:8080/apps/research/users/alice/sessions/trip/run \
+#       -H 'Content-Type: application/json' -d '{"message": "Hi, I am Alice"}'
+#   curl localhost:8080/stats
+#
+# Each event of the turn is sent as an `event` message (the Event as JSON), the
+# stream ends with a `done` message holding the time to first byte and the
+# duration of the turn, or an `error` message.
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from google.adk.agents.run_config import RunConfig, StreamingMode
+from google.adk.runners import Runner
+from google.genai import types
+from pydantic import BaseModel
+
+from adk_helpers.memory import IncrementalMemoryService
+from adk_helpers.session_driver import load_runner
+from adk_helpers.sessions import get_or_create_session
+
+
+logger = logging.getLogger(__name__)
+
+# Name in the URL -> runner, as module:attribute
+DEFAULT_RUNNERS = {
+    "research": "agent_with_memory.agent:research_runner",
+    "chatbot": "agent_with_memory.agent_with_memory:chatbot_runner",
+    "automation": "evaluating_agents.agent:automation_agent_runner",
+}
+
+# Partial events carry the text chunks as the model produces them
+STREAMING = RunConfig(streaming_mode=StreamingMode.SSE)
+
+# Latencies kept per app for the percentiles of /stats
+LATENCY_WINDOW = 10_000
+
+
+class RunRequest(BaseModel):
+    message: str
+    # Initial state, only used when the session is created
+    state: Optional[dict[str, Any]] = None
+
+
+class _AppStats:
+    def __init__(self):
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.ttfb: list[float] = []
+        self.durations: list[float] = []
+
+    def record(self, ttfb: float, duration: float):
+        self.ttfb.append(ttfb)
+        self.durations.append(duration)
+        if len(self.ttfb) > LATENCY_WINDOW:
+            del self.ttfb[: len(self.ttfb) - LATENCY_WINDOW]
+            del self.durations[: len(self.durations) - LATENCY_WINDOW]
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "ttfb_p50": _percentile(self.ttfb, 0.50),
+            "ttfb_p95": _percentile(self.ttfb, 0.95),
+            "ttfb_p99": _percentile(self.ttfb, 0.99),
+            "duration_p50": _percentile(self.durations, 0.50),
+            "duration_p95": _percentile(self.durations, 0.95),
+            "duration_p99": _percentile(self.durations, 0.99),
+        }
+
+
+class AgentServer:
+    """Serves runners over HTTP, one SSE stream per turn.
+
+    Args:
+        runners: Name in the URL -> runner.
+        max_in_flight: Turns running at once in the process, the others wait their turn.
+    """
+
+    def __init__(self, runners: dict[str, Runner], max_in_flight: int = 64):
+        self.runners = runners
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        # (name, user_id, session_id) -> [lock, requests holding or waiting for it]
+        self._session_locks: dict[tuple[str, str, str], list] = {}
+        self._stats = {name: _AppStats() for name in runners}
+
+    def app(self) -> FastAPI:
+        @contextlib.asynccontextmanager
+        async def lifespan(_: FastAPI):
+            yield
+            for runner in self.runners.values():
+                await runner.close()
+
+        app = FastAPI(lifespan=lifespan)
+
+        @app.get("/apps")
+        async def list_apps() -> dict[str, str]:
+            return {name: runner.app_name for name, runner in self.runners.items()}
+
+        @app.get("/stats")
+        async def stats() -> dict[str, Any]:
+            return {name: app_stats.as_dict() for name, app_stats in self._stats.items()}
+
+        @app.post("/apps/{name}/users/{user_id}/sessions/{session_id}/run")
+        async def run(name: str, user_id: str, session_id: str, request: RunRequest) -> StreamingResponse:
+            runner = self.runners.get(name)
+            if runner is None:
+                raise HTTPException(status_code=404, detail=f"No app {name!r}")
+            return StreamingResponse(
+                self.stream_turn(name, runner, user_id, session_id, request, time.monotonic()),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        return app
+
+    async def stream_turn(
+        self, name: str, runner: Runner, user_id: str, session_id: str, request: RunRequest, received: float
+    ) -> AsyncIterator[str]:
+        """SSE messages of one turn, `received` is when the request came in (for the time to first byte)."""
+        app_stats = self._stats[name]
+        app_stats.requests += 1
+        app_stats.in_flight += 1
+        ttfb = None
+        events = 0
+        try:
+            async with self._session_lock(name, user_id, session_id), self._slots:
+                session = await get_or_create_session(
+                    runner.session_service,
+                    app_name=runner.app_name,
+                    user_id=user_id,
+                    session_id=session_id,
+                    state=request.state,
+                )
+                async for event in runner.run_async(
+                    user_id=user_id,
+                    session_id=session.id,
+                    new_message=types.Content(role="user", parts=[types.Part(text=request.message)]),
+                    run_config=STREAMING,
+                ):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - received
+                    events += 1
+                    yield _sse("event", event.model_dump_json(exclude_none=True, by_alias=True))
+
+                duration = time.monotonic() - received
+                ttfb = duration if ttfb is None else ttfb
+                app_stats.record(ttfb, duration)
+                logger.info("%s %s/%s: ttfb %.3fs, %d events in %.3fs", name, user_id, session_id, ttfb, events, duration)
+                yield _sse("done", json.dumps({"ttfb": ttfb, "duration": duration, "events": events}))
+
+                # The answer is out, index the turn before the session takes its next one
+                if isinstance(runner.memory_service, IncrementalMemoryService):
+                    session = await runner.session_service.get_session(
+                        app_name=runner.app_name, user_id=user_id, session_id=session.id
+                    )
+                    await runner.memory_service.add_session_to_memory(session)
+        except Exception as error:
+            app_stats.errors += 1
+            logger.exception("%s %s/%s failed", name, user_id, session_id)
+            yield _sse("error", json.dumps({"error": repr(error)}))
+        finally:
+            app_stats.in_flight -= 1
+
+    @contextlib.asynccontextmanager
+    async def _session_lock(self, name: str, user_id: str, session_id: str):
+        key = (name, user_id, session_id)
+        entry = self._session_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # Nobody holds or waits for it, idle sessions keep no lock
+                del self._session_locks[key]
+
+
+def _sse(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the agents over HTTP with Server-Sent Events")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--runner",
+        action="append",
+        metavar="NAME=MODULE:ATTRIBUTE",
+        help="Runner to serve under /apps/NAME, repeatable (default: research, chatbot and automation)",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Turns running at once")
+    args = parser.parse_args()
+
+    specs = DEFAULT_RUNNERS
+    if args.runner:
+        specs = {}
+        for spec in args.runner:
+            name, separator, target = spec.partition("=")
+            if not separator:
+                parser.error(f"--runner must be NAME=MODULE:ATTRIBUTE, got {spec!r}")
+            specs[name] = target
+
+    logging.basicConfig(level=logging.INFO)
+    server = AgentServer({name: load_runner(target) for name, target in specs.items()}, args.max_in_flight)
+    uvicorn.run(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# In-process LRU cache of hydrated sessions in front of a DatabaseSessionService
+
+import asyncio
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, NamedTuple, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions import _session_util
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+    StorageEvent,
+    StorageSession,
+    StorageUserState,
+)
+from sqlalchemy import Text, bindparam, cast, func, literal_column, select
+
+from adk_helpers.event_codec import check_uncompressed
+
+
+class SessionVersion(NamedTuple):
+    """What a cached session is validated against, read in one query of index probes.
+
+    The session's update_time alone is not enough: ADK only rewrites the session
+    row for session-scope state deltas, and on SQLite with a one second resolution.
+    A new event is seen through the latest event timestamp (events are stamped
+    when created, after the ones already stored); compaction summaries, the only
+    events placed inside the history, through their count in the small
+    ix_events_session_compactions partial index. The app / user states are
+    compared by content, their update_time would miss quick successive writes.
+    """
+
+    session_update_time: datetime
+    last_event_time: Optional[datetime]
+    summary_count: int
+    app_state_json: Optional[str]
+    user_state_json: Optional[str]
+    # Only for base services persisting state key by key (DeltaStateSessionService)
+    shared_state_revision: Optional[int] = None
+
+
+class _CacheEntry:
+    def __init__(self, session: Session, version: SessionVersion):
+        self.session = session
+        self.version = version
+
+
+class CachedSessionService(BaseSessionService):
+    """Bounded LRU cache of hydrated Session objects keyed by (app_name, user_id, session_id).
+
+    Every get_session reads the session's version (update_time of the session, the
+    latest timestamp of its events and the number of its summaries, the app and user
+    state rows) with a single query of index probes, and only serves the cached copy
+    when nothing changed, so a write made by another process is never hidden. Appends made through this service
+    keep the cached copy up to date instead of invalidating it. When the base service
+    loads a window of the history (TailWindowSessionService), the cached copy is
+    trimmed to that window after each append, so hits and misses serve the same events.
+
+    Callers always get a copy, the cached session is never shared.
+    """
+
+    def __init__(self, base_service: DatabaseSessionService, max_entries: int = 1024):
+        # Subclasses (TailWindow, DeltaState, Compressed) check their database themselves
+        if type(base_service) is DatabaseSessionService:
+            check_uncompressed(base_service.db_engine, "DatabaseSessionService")
+        self.base_service = base_service
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple[str, str, str], _CacheEntry] = OrderedDict()
+        self._version_stmt = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stats(self) -> dict[str, Any]:
+        """Return the cache counters, used to size max_entries."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        return await self.base_service.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        # Partial loads are not cached
+        if config is not None:
+            return await self.base_service.get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+
+        key = (app_name, user_id, session_id)
+        version = await asyncio.to_thread(self._read_version, key)
+        if version is None:
+            self._drop(key)
+            return None
+
+        entry = self._entries.get(key)
+        if entry is not None and _same_session(entry.version, version):
+            if entry.version != version:
+                # Only the app / user state changed, re-merge it from the version
+                self._refresh_shared_state(entry, version)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.session.model_copy(deep=True)
+
+        if entry is not None:
+            self.invalidations += 1
+        self.misses += 1
+
+        # The version is read before loading, a write in between only makes the
+        # entry look stale on the next lookup
+        session = await self.base_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            self._drop(key)
+            return None
+        self._put(key, _CacheEntry(session.model_copy(deep=True), version))
+        return session
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        return await self.base_service.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        self._drop((app_name, user_id, session_id))
+        await self.base_service.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        event = await self.base_service.append_event(session=session, event=event)
+        if event.partial:
+            return event
+
+        key = (session.app_name, session.user_id, session.id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return event
+
+        # The cached copy can follow along only if our event is the single change
+        # to the session since it was cached
+        version = await asyncio.to_thread(self._read_version, key)
+        if (
+            version is None
+            or version.last_event_time != _expected_last_event_time(entry.version, event)
+            or version.summary_count != entry.version.summary_count + _is_summary_row(event)
+            or (
+                self._timestamp(version.session_update_time) != session.last_update_time
+                # Key-by-key state persistence leaves the session row untouched
+                and version.session_update_time != entry.version.session_update_time
+            )
+            or version.shared_state_revision != _expected_revision(entry.version, event)
+        ):
+            self.invalidations += 1
+            self._drop(key)
+            return event
+
+        entry.session.events.append(event)
+        if hasattr(self.base_service, "window_events"):
+            entry.session.events = self.base_service.window_events(entry.session.events)
+        self._update_session_state(entry.session, event)
+        entry.session.last_update_time = session.last_update_time
+        self._refresh_shared_state(entry, version)
+        return event
+
+    def _put(self, key, entry: _CacheEntry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+
+    def _read_version(self, key) -> Optional[SessionVersion]:
+        if self._version_stmt is None:
+            self._version_stmt = self._version_statement()
+        app_name, user_id, session_id = key
+        with self.base_service.database_session_factory() as sql_session:
+            row = sql_session.execute(
+                self._version_stmt,
+                {"app_name": app_name, "user_id": user_id, "session_id": session_id},
+            ).first()
+        return SessionVersion(*row) if row is not None else None
+
+    def _version_statement(self):
+        # Built once, the session is bound at execution
+        app_name = bindparam("app_name")
+        user_id = bindparam("user_id")
+        session_id = bindparam("session_id")
+        events_of_session = (
+            StorageEvent.app_name == app_name,
+            StorageEvent.user_id == user_id,
+            StorageEvent.session_id == session_id,
+        )
+        columns = [
+            StorageSession.update_time,
+            # One probe of ix_events_session_timestamp
+            select(func.max(StorageEvent.timestamp))
+            .where(*events_of_session)
+            .scalar_subquery(),
+            # The predicate as literals, so that SQLite uses the partial index
+            select(func.count())
+            .select_from(StorageEvent)
+            .where(
+                *events_of_session,
+                StorageEvent.author == literal_column("'user'"),
+                literal_column("events.content").is_(None),
+            )
+            .scalar_subquery(),
+            select(cast(literal_column("app_states.state"), Text))
+            .where(StorageAppState.app_name == app_name)
+            .scalar_subquery(),
+            select(cast(literal_column("user_states.state"), Text))
+            .where(
+                StorageUserState.app_name == app_name,
+                StorageUserState.user_id == user_id,
+            )
+            .scalar_subquery(),
+        ]
+        if hasattr(self.base_service, "shared_state_revision"):
+            columns.append(self.base_service.shared_state_revision(app_name, user_id))
+        return select(*columns).where(
+            StorageSession.app_name == app_name,
+            StorageSession.user_id == user_id,
+            StorageSession.id == session_id,
+        )
+
+    def _refresh_shared_state(self, entry: _CacheEntry, version: SessionVersion):
+        # Re-merge the app / user state if they changed, from the rows just read
+        if (
+            version.app_state_json != entry.version.app_state_json
+            or version.user_state_json != entry.version.user_state_json
+        ):
+            app_state = json.loads(version.app_state_json or "{}")
+            user_state = json.loads(version.user_state_json or "{}")
+            state = {
+                key: value
+                for key, value in entry.session.state.items()
+                if not key.startswith((State.APP_PREFIX, State.USER_PREFIX))
+            }
+            state.update({State.APP_PREFIX + k: v for k, v in app_state.items()})
+            state.update({State.USER_PREFIX + k: v for k, v in user_state.items()})
+            entry.session.state = state
+        entry.version = version
+
+    def _timestamp(self, value: datetime) -> float:
+        # Same conversion as StorageSession.update_timestamp_tz
+        if self.base_service.db_engine.dialect.name == "sqlite":
+            return value.replace(tzinfo=timezone.utc).timestamp()
+        return value.timestamp()
+
+
+def _same_session(cached: SessionVersion, current: SessionVersion) -> bool:
+    if cached.shared_state_revision is not None:
+        # The app / user state is not all in the state rows, reload on any change
+        return cached == current
+    # Session row and events unchanged, app / user state may have moved on
+    return (
+        cached.session_update_time == current.session_update_time
+        and cached.last_event_time == current.last_event_time
+        and cached.summary_count == current.summary_count
+    )
+
+
+def _expected_last_event_time(cached: SessionVersion, event: Event) -> datetime:
+    # Same conversion as StorageEvent.from_event
+    timestamp = datetime.fromtimestamp(event.timestamp)
+    if cached.last_event_time is None:
+        return timestamp
+    return max(cached.last_event_time, timestamp)
+
+
+def _is_summary_row(event: Event) -> int:
+    # The rows of ix_events_session_compactions
+    return int(event.author == "user" and event.content is None)
+
+
+def _expected_revision(cached: SessionVersion, event: Event) -> Optional[int]:
+    # Every app / user key of our own event bumps the revision by one
+    if cached.shared_state_revision is None:
+        return None
+    if not event.actions or not event.actions.state_delta:
+        return cached.shared_state_revision
+    state_deltas = _session_util.extract_state_delta(event.actions.state_delta)
+    return cached.shared_state_revision + len(state_deltas["app"]) + len(state_deltas["user"])
@@ -0,0 +1,249 @@
+# Concurrent driver running many conversations against one runner
+#
+# run_session plays the queries of one session one after another, so a batch of
+# thousands of conversations runs one model call at a time. The driver runs the
+# sessions concurrently, at most `concurrency` turns in flight, while the turns
+# of a session stay in order: a turn starts once the previous turn of the same
+# session has finished (the next query depends on the history it appended).
+#
+# Usage:
+#   driver = SessionDriver(research_runner, concurrency=16)
+#   results = await driver.run([SessionJob("alice", "trip", ["Hi", "Where do I go?"]), ...])
+#   print(driver.stats())
+#
+#   python -m adk_helpers.session_driver agent_with_memory.agent:research_runner jobs.jsonl --concurrency 16
+#   (one job per line: {"user_id": ..., "session_id": ..., "queries": [...]})
+
+import argparse
+import asyncio
+import importlib
+import json
+import time
+from typing import Any, Callable, Optional
+
+from google.adk.events.event import Event
+from google.adk.runners import Runner
+from google.genai import types
+
+from adk_helpers.sessions import get_or_create_session
+
+
+class SessionJob:
+    """Queries to play in order in one session.
+
+    Several jobs may name the same session, they are played one after the other
+    in the order they were given. Once one of them fails the later ones are not
+    played, their results carry the same error.
+    """
+
+    def __init__(self, user_id: str, session_id: str, queries: list[str], state: Optional[dict[str, Any]] = None):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.queries = [queries] if isinstance(queries, str) else list(queries)
+        self.state = state
+
+
+class SessionResult:
+    """Final responses of a job, one per query played, and the error that stopped it if any."""
+
+    def __init__(self, job: SessionJob):
+        self.job = job
+        self.responses: list[str] = []
+        self.error: Optional[BaseException] = None
+
+
+class SessionDriver:
+    """Runs SessionJobs concurrently against a runner.
+
+    Sessions are handed to `concurrency` worker tasks, each playing the turns of
+    one session at a time, so turns in flight never exceed `concurrency` and the
+    turns of a session never overlap. A failed turn stops its session (later
+    queries would run against a history missing a turn), the other sessions go on.
+
+    stats() reports throughput and the latency of turns: to the first event and
+    to the end of the turn.
+
+    Args:
+        runner: Runner the sessions are played against.
+        concurrency: Maximum number of turns in flight.
+        turn_timeout: Seconds a turn may take before it fails, None for no limit.
+        on_event: Called with (job, event) for every event of every turn.
+    """
+
+    def __init__(
+        self,
+        runner: Runner,
+        concurrency: int = 8,
+        turn_timeout: Optional[float] = None,
+        on_event: Optional[Callable[[SessionJob, Event], None]] = None,
+    ):
+        self.runner = runner
+        self.concurrency = concurrency
+        self.turn_timeout = turn_timeout
+        self.on_event = on_event
+
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.turns = 0
+        self.failed_turns = 0
+        self.events = 0
+        self.seconds = 0.0
+        self._first_event_latencies: list[float] = []
+        self._turn_latencies: list[float] = []
+
+    async def run(self, jobs: list[SessionJob]) -> list[SessionResult]:
+        """Play every job, returns their results in the order of `jobs`."""
+        results = [SessionResult(job) for job in jobs]
+        # Jobs of one session become one unit of work, played in order by one worker
+        by_session: dict[tuple[str, str], list[SessionResult]] = {}
+        for result in results:
+            by_session.setdefault((result.job.user_id, result.job.session_id), []).append(result)
+
+        queue: asyncio.Queue[list[SessionResult]] = asyncio.Queue()
+        for session_results in by_session.values():
+            queue.put_nowait(session_results)
+
+        started = time.monotonic()
+        workers = [asyncio.create_task(self._work(queue)) for _ in range(min(self.concurrency, queue.qsize()))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.seconds += time.monotonic() - started
+        return results
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "sessions": self.sessions,
+            "failed_sessions": self.failed_sessions,
+            "turns": self.turns,
+            "failed_turns": self.failed_turns,
+            "events": self.events,
+            "seconds": self.seconds,
+            "turns_per_second": self.turns / self.seconds if self.seconds else 0.0,
+            "first_event_p50": _percentile(self._first_event_latencies, 0.50),
+            "first_event_p95": _percentile(self._first_event_latencies, 0.95),
+            "turn_p50": _percentile(self._turn_latencies, 0.50),
+            "turn_p95": _percentile(self._turn_latencies, 0.95),
+            "turn_p99": _percentile(self._turn_latencies, 0.99),
+            "turn_max": max(self._turn_latencies, default=0.0),
+        }
+
+    async def _work(self, queue: asyncio.Queue):
+        while not queue.empty():
+            failure = None
+            for result in queue.get_nowait():
+                self.sessions += 1
+                if failure is not None:
+                    # Not played: it would run against a history missing the failed turn
+                    result.error = failure
+                    self.failed_sessions += 1
+                    continue
+                try:
+                    await self._play(result)
+                except Exception as error:
+                    result.error = failure = error
+                    self.failed_sessions += 1
+
+    async def _play(self, result: SessionResult):
+        job = result.job
+        session = await get_or_create_session(
+            self.runner.session_service,
+            app_name=self.runner.app_name,
+            user_id=job.user_id,
+            session_id=job.session_id,
+            state=job.state,
+        )
+        for query in job.queries:
+            try:
+                if self.turn_timeout is None:
+                    response = await self._turn(job, session.id, query)
+                else:
+                    response = await asyncio.wait_for(self._turn(job, session.id, query), self.turn_timeout)
+            except Exception:
+                self.failed_turns += 1
+                raise
+            result.responses.append(response)
+
+    async def _turn(self, job: SessionJob, session_id: str, query: str) -> str:
+        started = time.monotonic()
+        first_event = None
+        response = ""
+        async for event in self.runner.run_async(
+            user_id=job.user_id,
+            session_id=session_id,
+            new_message=types.Content(role="user", parts=[types.Part(text=query)]),
+        ):
+            if first_event is None:
+                first_event = time.monotonic() - started
+            self.events += 1
+            if self.on_event is not None:
+                self.on_event(job, event)
+            if event.is_final_response() and event.content and event.content.parts:
+                response = "".join(part.text for part in event.content.parts if part.text)
+        self.turns += 1
+        self._first_event_latencies.append(first_event if first_event is not None else time.monotonic() - started)
+        self._turn_latencies.append(time.monotonic() - started)
+        return response
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def load_jobs(path: str) -> list[SessionJob]:
+    """Jobs of a JSONL file, one {"user_id", "session_id", "queries"[, "state"]} object per line."""
+    jobs = []
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            if line.strip():
+                job = json.loads(line)
+                jobs.append(SessionJob(job["user_id"], job["session_id"], job["queries"], job.get("state")))
+    return jobs
+
+
+def load_runner(spec: str) -> Runner:
+    """The runner named by "package.module:attribute"."""
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Runner must be given as module:attribute, got {spec!r}")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+async def _drive(args):
+    runner = load_runner(args.runner)
+    driver = SessionDriver(runner, concurrency=args.concurrency, turn_timeout=args.turn_timeout)
+    try:
+        results = await driver.run(load_jobs(args.jobs))
+    finally:
+        await runner.close()
+    for result in results:
+        if result.error is not None:
+            print(f"{result.job.user_id}/{result.job.session_id}: failed after {len(result.responses)} turns: {result.error!r}")
+    stats = driver.stats()
+    print(
+        f"{stats['sessions']} sessions ({stats['failed_sessions']} failed), {stats['turns']} turns"
+        f" in {stats['seconds']:.1f}s: {stats['turns_per_second']:.2f} turns/s"
+    )
+    print(
+        f"first event p50 {stats['first_event_p50']:.2f}s p95 {stats['first_event_p95']:.2f}s,"
+        f" turn p50 {stats['turn_p50']:.2f}s p95 {stats['turn_p95']:.2f}s p99 {stats['turn_p99']:.2f}s"
+        f" max {stats['turn_max']:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many conversations concurrently against a runner")
+    parser.add_argument("runner", help="Runner as module:attribute, e.g. agent_with_memory.agent:research_runner")
+    parser.add_argument("jobs", help="JSONL file, one {user_id, session_id, queries} object per line")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum turns in flight")
+    parser.add_argument("--turn-timeout", type=float, help="Seconds before a turn fails")
+    asyncio.run(_drive(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# Helpers for creating / retrieving sessions shared by the run_session helpers of the agents
+
+from datetime import timezone
+from typing import Any, Optional
+
+from google.adk.errors.already_exists_error import AlreadyExistsError
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions import _session_util
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+    StorageSession,
+    StorageUserState,
+    _merge_state,
+)
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+
+# Dialects that support "INSERT ... ON CONFLICT DO NOTHING RETURNING"
+_UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+async def get_or_create_session(
+    session_service: BaseSessionService,
+    *,
+    app_name: str,
+    user_id: str,
+    session_id: str,
+    state: Optional[dict[str, Any]] = None,
+) -> Session:
+    """Return a handle for the session, creating the session if it does not exist.
+
+    For a DatabaseSessionService on SQLite/PostgreSQL this is a single atomic upsert
+    against the `sessions` table, so two workers racing on the same session_id both get
+    the session instead of a duplicate key error. The returned handle carries the
+    session state merged with the app: and user: state, as get_session returns it,
+    but no events: the Runner loads the history itself in run_async, so it is never
+    loaded twice per turn.
+
+    Other session services fall back to get_session + create_session.
+
+    Args:
+        session_service: The session service the runner uses.
+        app_name: The name of the app.
+        user_id: The id of the user.
+        session_id: The id of the session to get or create.
+        state: Initial state, only used when the session is created.
+
+    Returns:
+        The session (without events when the upsert path was used).
+    """
+    # Layers in front of a DatabaseSessionService expose it as `base_service`,
+    # sharded services pick the user's shard with `shard_for`
+    database_service = session_service
+    while hasattr(database_service, "base_service") or hasattr(database_service, "shard_for"):
+        if hasattr(database_service, "shard_for"):
+            database_service = database_service.shard_for(user_id)
+            continue
+        # An archived session must come back before the upsert, or it would be recreated empty
+        if hasattr(database_service, "restore_session"):
+            await database_service.restore_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+        database_service = database_service.base_service
+
+    if isinstance(database_service, DatabaseSessionService):
+        dialect_name = database_service.db_engine.dialect.name
+        if dialect_name in _UPSERT_INSERTS:
+            return await _upsert_database_session(
+                database_service, app_name, user_id, session_id, state
+            )
+
+    session = await session_service.get_session(
+        app_name=app_name, user_id=user_id, session_id=session_id
+    )
+    if session is not None:
+        return session
+    try:
+        return await session_service.create_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, state=state
+        )
+    except (AlreadyExistsError, IntegrityError):
+        # Lost the race against another worker, the session exists by now
+        return await session_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+
+async def _upsert_database_session(
+    session_service: DatabaseSessionService,
+    app_name: str,
+    user_id: str,
+    session_id: str,
+    state: Optional[dict[str, Any]],
+) -> Session:
+    insert = _UPSERT_INSERTS[session_service.db_engine.dialect.name]
+    sessions = StorageSession.__table__
+    state_deltas = _session_util.extract_state_delta(state)
+
+    with session_service.database_session_factory() as sql_session:
+        # Insert the session row, or do nothing if it already exists.
+        # RETURNING only yields a row when this call created the session.
+        result = sql_session.execute(
+            insert(sessions)
+            .values(
+                app_name=app_name,
+                user_id=user_id,
+                id=session_id,
+                state=state_deltas["session"],
+            )
+            .on_conflict_do_nothing(
+                index_elements=[sessions.c.app_name, sessions.c.user_id, sessions.c.id]
+            )
+            .returning(sessions.c.state, sessions.c.update_time)
+        )
+        row = result.first()
+
+        if row is None:
+            # The session already exists, read only its row (never the events)
+            result = sql_session.execute(
+                select(sessions.c.state, sessions.c.update_time).where(
+                    sessions.c.app_name == app_name,
+                    sessions.c.user_id == user_id,
+                    sessions.c.id == session_id,
+                )
+            )
+            row = result.first()
+        else:
+            # New session: append_event expects the app / user state rows to exist
+            _ensure_state_rows(
+                sql_session,
+                insert,
+                app_name,
+                user_id,
+                state_deltas["app"],
+                state_deltas["user"],
+            )
+
+        sql_session.commit()
+
+        session_state, update_time = row
+        storage_app_state = sql_session.get(StorageAppState, (app_name))
+        storage_user_state = sql_session.get(StorageUserState, (app_name, user_id))
+        merged_state = _merge_state(
+            storage_app_state.state if storage_app_state else {},
+            storage_user_state.state if storage_user_state else {},
+            session_state or {},
+        )
+
+        if session_service.db_engine.dialect.name == "sqlite":
+            # SQLite returns naive datetimes that are stored in UTC
+            last_update_time = update_time.replace(tzinfo=timezone.utc).timestamp()
+        else:
+            last_update_time = update_time.timestamp()
+
+        session = Session(
+            app_name=app_name,
+            user_id=user_id,
+            id=session_id,
+            state=merged_state,
+            events=[],
+            last_update_time=last_update_time,
+        )
+        # DeltaStateSessionService keeps the latest keys in state_entries, newer than the blobs
+        if hasattr(session_service, "_overlay_entries"):
+            session_service._overlay_entries(sql_session, [session], app_name, user_id)
+
+    return session
+
+
+def _ensure_state_rows(sql_session, insert, app_name, user_id, app_delta, user_delta):
+    # Same bookkeeping create_session does for app_states and user_states, but as
+    # upserts so that two new sessions of the same user can be created concurrently
+    sql_session.execute(
+        insert(StorageAppState.__table__)
+        .values(app_name=app_name, state={})
+        .on_conflict_do_nothing()
+    )
+    sql_session.execute(
+        insert(StorageUserState.__table__)
+        .values(app_name=app_name, user_id=user_id, state={})
+        .on_conflict_do_nothing()
+    )
+
+    if app_delta:
+        storage_app_state = sql_session.get(StorageAppState, (app_name))
+        storage_app_state.state = storage_app_state.state | app_delta
+    if user_delta:
+        storage_user_state = sql_session.get(StorageUserState, (app_name, user_id))
+        storage_user_state.state = storage_user_state.state | user_delta
+
+
+def apply_state_delta(sql_session, storage_session: StorageSession, event: Event):
+    """Apply the state delta of an event to the storage rows, like DatabaseSessionService.append_event.
+
+    Used by the services that write StorageEvent rows themselves.
+    """
+    if not event.actions or not event.actions.state_delta:
+        return
+    app_name, user_id = storage_session.app_name, storage_session.user_id
+    state_deltas = _session_util.extract_state_delta(event.actions.state_delta)
+
+    if state_deltas["app"]:
+        storage_app_state = sql_session.get(StorageAppState, (app_name))
+        if storage_app_state is None:
+            storage_app_state = StorageAppState(app_name=app_name, state={})
+            sql_session.add(storage_app_state)
+        storage_app_state.state = (storage_app_state.state or {}) | state_deltas["app"]
+    if state_deltas["user"]:
+        storage_user_state = sql_session.get(StorageUserState, (app_name, user_id))
+        if storage_user_state is None:
+            storage_user_state = StorageUserState(app_name=app_name, user_id=user_id, state={})
+            sql_session.add(storage_user_state)
+        storage_user_state.state = (storage_user_state.state or {}) | state_deltas["user"]
+    if state_deltas["session"]:
+        storage_session.state = storage_session.state | state_deltas["session"]
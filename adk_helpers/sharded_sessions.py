@@ -0,0 +1,286 @@
+# Session service hash-partitioning users across several SQLite files
+#
+# Usage (one-off, splits an existing database into its shard files):
+#   python -m adk_helpers.sharded_sessions chatbot.db --shards 4
+
+import argparse
+import asyncio
+import contextlib
+import os
+import sqlite3
+import threading
+import zlib
+from typing import Any, Callable, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+)
+from sqlalchemy.engine import make_url
+
+from adk_helpers.db_maintenance import install_connection_pragmas
+from adk_helpers.event_codec import check_uncompressed
+
+
+def shard_index(user_id: str, num_shards: int) -> int:
+    """Stable shard of a user (Python's hash() is salted per process)."""
+    return zlib.crc32(user_id.encode("utf-8")) % num_shards
+
+
+def shard_urls(db_url: str, num_shards: int) -> list[str]:
+    """sqlite:///chatbot.db -> sqlite:///chatbot-shard-0.db, sqlite:///chatbot-shard-1.db, ..."""
+    url = make_url(db_url)
+    root, ext = os.path.splitext(url.database)
+    return [
+        url.set(database=f"{root}-shard-{index}{ext or '.db'}").render_as_string(hide_password=False)
+        for index in range(num_shards)
+    ]
+
+
+class _ShardWorker:
+    """Thread with its own event loop running every call of one shard.
+
+    The ADK database services do their SQL synchronously inside the coroutines;
+    running each shard on its own thread lets the shards write in parallel
+    instead of one after the other on the caller's loop.
+    """
+
+    def __init__(self, name: str):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    async def call(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        return await asyncio.wrap_future(future)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class ShardedSessionService(BaseSessionService):
+    """Same API as DatabaseSessionService, with users spread over `num_shards` SQLite files.
+
+    A session lives in the shard of its user, so every call touches a single file
+    with its own engine, connection pool and writer lock. App state is shared by all
+    users: app: deltas are written to the user's shard and then copied to the others.
+
+    Args:
+        db_url: URL of the unsharded database, the shard files are named after it.
+        num_shards: Number of shard files. Changing it moves users between shards,
+            re-split the original database with the new count.
+        shard_factory: Builds the service of one shard from its URL, e.g. to put a
+            cache or a write-behind layer in front of each shard.
+        split_existing: Split `db_url` into the shards when none of them holds sessions
+            yet (shard files created by SqliteFtsMemoryService only hold memory tables).
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        num_shards: int = 4,
+        shard_factory: Optional[Callable[[str], BaseSessionService]] = None,
+        split_existing: bool = True,
+    ):
+        self.num_shards = num_shards
+        self.shard_db_urls = shard_urls(db_url, num_shards)
+        if split_existing and not any(
+            _has_sessions_table(make_url(url).database) for url in self.shard_db_urls
+        ):
+            source = make_url(db_url).database
+            if os.path.exists(source):
+                split_database(source, num_shards)
+
+        shard_factory = shard_factory or (lambda url: DatabaseSessionService(db_url=url))
+        self.shards = [shard_factory(url) for url in self.shard_db_urls]
+        for shard in self.shards:
+            database_service = _database_service(shard)
+            # Subclasses (TailWindow, DeltaState, Compressed) check their database themselves
+            if type(database_service) is DatabaseSessionService:
+                check_uncompressed(database_service.db_engine, "DatabaseSessionService")
+            install_connection_pragmas(database_service)
+        self._workers = [_ShardWorker(f"session-shard-{index}") for index in range(num_shards)]
+
+    def shard_for(self, user_id: str) -> BaseSessionService:
+        return self.shards[shard_index(user_id, self.num_shards)]
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        index = shard_index(user_id, self.num_shards)
+        session = await self._workers[index].call(
+            self.shards[index].create_session(
+                app_name=app_name, user_id=user_id, state=state, session_id=session_id
+            )
+        )
+        await self._share_app_state(index, app_name, state or {})
+        return session
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        index = shard_index(user_id, self.num_shards)
+        return await self._workers[index].call(
+            self.shards[index].get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+        )
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        if user_id is not None:
+            index = shard_index(user_id, self.num_shards)
+            return await self._workers[index].call(
+                self.shards[index].list_sessions(app_name=app_name, user_id=user_id)
+            )
+        responses = await asyncio.gather(
+            *(
+                worker.call(shard.list_sessions(app_name=app_name))
+                for worker, shard in zip(self._workers, self.shards)
+            )
+        )
+        return ListSessionsResponse(
+            sessions=[session for response in responses for session in response.sessions]
+        )
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        index = shard_index(user_id, self.num_shards)
+        await self._workers[index].call(
+            self.shards[index].delete_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+        )
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        index = shard_index(session.user_id, self.num_shards)
+        event = await self._workers[index].call(
+            self.shards[index].append_event(session=session, event=event)
+        )
+        if not event.partial and event.actions and event.actions.state_delta:
+            await self._share_app_state(index, session.app_name, event.actions.state_delta)
+        return event
+
+    async def close(self):
+        """Close the shard services that need it (e.g. write-behind) and stop the workers."""
+        for worker, shard in zip(self._workers, self.shards):
+            if hasattr(shard, "close"):
+                await worker.call(shard.close())
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
+
+    async def _share_app_state(self, source_index: int, app_name: str, delta: dict[str, Any]):
+        app_delta = {
+            key.removeprefix(State.APP_PREFIX): value
+            for key, value in delta.items()
+            if key.startswith(State.APP_PREFIX)
+        }
+        if not app_delta:
+            return
+        await asyncio.gather(
+            *(
+                worker.call(_merge_app_state(shard, app_name, app_delta))
+                for index, (worker, shard) in enumerate(zip(self._workers, self.shards))
+                if index != source_index
+            )
+        )
+
+def _has_sessions_table(db_path: str) -> bool:
+    if not os.path.exists(db_path):
+        return False
+    with contextlib.closing(sqlite3.connect(db_path)) as connection:
+        return connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'"
+        ).fetchone() is not None
+
+
+def _database_service(service: BaseSessionService) -> DatabaseSessionService:
+    while hasattr(service, "base_service"):
+        service = service.base_service
+    return service
+
+
+async def _merge_app_state(shard: BaseSessionService, app_name: str, app_delta: dict[str, Any]):
+    database_service = _database_service(shard)
+    with database_service.database_session_factory() as sql_session:
+        storage_app_state = sql_session.get(StorageAppState, (app_name))
+        if hasattr(database_service, "merge_app_state"):
+            # The shard keeps state its own way (e.g. DeltaStateSessionService)
+            database_service.merge_app_state(sql_session, app_name, app_delta)
+        elif storage_app_state is None:
+            sql_session.add(StorageAppState(app_name=app_name, state=app_delta))
+        else:
+            storage_app_state.state = storage_app_state.state | app_delta
+        sql_session.commit()
+
+
+def split_database(db_path: str, num_shards: int) -> dict[str, int]:
+    """Copy the sessions of an existing database into its shard files.
+
+    The source file is left untouched. Returns the number of sessions per shard file.
+    """
+    report = {}
+    for index, url in enumerate(shard_urls(f"sqlite:///{db_path}", num_shards)):
+        shard_path = make_url(url).database
+        # Creates the ADK schema of the shard
+        DatabaseSessionService(db_url=url).db_engine.dispose()
+
+        with sqlite3.connect(shard_path) as connection:
+            connection.create_function(
+                "shard_index", 1, lambda user_id: shard_index(user_id, num_shards), deterministic=True
+            )
+            connection.execute("ATTACH DATABASE ? AS source", (db_path,))
+            for table, user_filter in (
+                ("app_states", "1"),
+                ("user_states", f"shard_index(user_id) = {index}"),
+                ("sessions", f"shard_index(user_id) = {index}"),
+                ("events", f"shard_index(user_id) = {index}"),
+            ):
+                columns = ", ".join(
+                    row[1] for row in connection.execute(f"PRAGMA main.table_info({table})")
+                )
+                connection.execute(
+                    f"INSERT OR IGNORE INTO main.{table} ({columns})"
+                    f" SELECT {columns} FROM source.{table} WHERE {user_filter}"
+                )
+            connection.commit()
+            connection.execute("DETACH DATABASE source")
+            report[shard_path] = connection.execute("SELECT count(*) FROM sessions").fetchone()[0]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Split an ADK session database into hash-partitioned shard files"
+    )
+    parser.add_argument("database", help="SQLite session database file")
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args()
+
+    for shard_path, sessions in split_database(args.database, args.shards).items():
+        print(f"{shard_path}: {sessions} sessions")
+
+
+if __name__ == "__main__":
+    main()
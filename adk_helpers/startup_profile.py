@@ -0,0 +1,139 @@
+# Import-time profile of the agent modules
+#
+# Usage:
+#   python -m adk_helpers.startup_profile agent_with_memory evaluating_agents.agent
+#   python -m adk_helpers.startup_profile agent_with_memory.agent_with_memory --top 30 --construct
+#
+# Each module is imported in a fresh interpreter with `python -X importtime`, as
+# `adk web` / `adk run` or a worker process would on a cold start. Reported per
+# module: the wall time of the import, the imports taking the longest (cumulative,
+# with their own "self" time), the time per top-level package, and the time spent
+# in the repository's own modules (the agent package and adk_helpers). With --construct the Lazy objects of the module
+# (services, runners) are built afterwards and timed one by one.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any
+
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter. The import goes through __import__: -X importtime
+# does not time importlib.import_module
+_IMPORT = "import sys; __import__(sys.argv[1])"
+# Same, then builds the module's Lazy objects and prints their construction times
+_CONSTRUCT = """
+import json, sys
+__import__(sys.argv[1])
+from adk_helpers.lazy import Lazy
+module = sys.modules[sys.argv[1]]
+timings = {}
+for name, value in list(vars(module).items()):
+    if isinstance(value, Lazy):
+        value.get()
+        timings[name] = value.seconds
+print("\\nLAZY " + json.dumps(timings))
+"""
+
+
+def parse_importtime(stderr: str) -> list[dict[str, Any]]:
+    """The entries of `-X importtime` output: module, self and cumulative seconds, nesting depth."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self": int(self_us) / 1e6,
+                "cumulative": int(cumulative_us) / 1e6,
+            }
+        )
+    return imports
+
+
+def profile_module(module: str, construct: bool = False) -> dict[str, Any]:
+    """Import `module` in a fresh interpreter and profile the import."""
+    code = _CONSTRUCT if construct else _IMPORT
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [REPOSITORY_ROOT, environment.get("PYTHONPATH")]))
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code, module],
+        cwd=REPOSITORY_ROOT,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    imports = parse_importtime(completed.stderr)
+    if completed.returncode:
+        errors = [line for line in completed.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {module} failed:\n" + "\n".join(errors[-20:]))
+
+    packages: dict[str, float] = {}
+    for entry in imports:
+        package = entry["module"].split(".")[0]
+        if package in ("google", "opentelemetry") and "." in entry["module"]:
+            package = ".".join(entry["module"].split(".")[:2])
+        packages[package] = packages.get(package, 0.0) + entry["self"]
+
+    own_packages = {module.split(".")[0], "adk_helpers"}
+    constructed = {}
+    for line in completed.stdout.splitlines():
+        if line.startswith("LAZY "):
+            constructed = json.loads(line[len("LAZY "):])
+    return {
+        "module": module,
+        "wall_seconds": wall,
+        "import_seconds": sum(entry["self"] for entry in imports),
+        "repository_seconds": sum(entry["self"] for entry in imports if entry["module"].split(".")[0] in own_packages),
+        "imports": imports,
+        "packages": dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)),
+        "constructed": constructed,
+    }
+
+
+def _print_profile(profile: dict[str, Any], top: int):
+    print(
+        f"{profile['module']}: {profile['wall_seconds']:.2f}s wall, {profile['import_seconds']:.2f}s importing,"
+        f" {profile['repository_seconds'] * 1000:.1f}ms in the repository's modules"
+    )
+    print(f"  {'cumulative':>10} {'self':>8}  import")
+    for entry in sorted(profile["imports"], key=lambda entry: entry["cumulative"], reverse=True)[:top]:
+        print(f"  {entry['cumulative'] * 1000:>8.1f}ms {entry['self'] * 1000:>6.1f}ms  {'  ' * entry['depth']}{entry['module']}")
+    print("  by package:")
+    for package, seconds in list(profile["packages"].items())[:top]:
+        print(f"  {seconds * 1000:>8.1f}ms  {package}")
+    if profile["constructed"]:
+        print("  built on first use:")
+        for name, seconds in profile["constructed"].items():
+            print(f"  {seconds * 1000:>8.1f}ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the import time of agent modules")
+    parser.add_argument("modules", nargs="+", help="Modules or agent packages, e.g. agent_with_memory.agent")
+    parser.add_argument("--top", type=int, default=20, help="Imports and packages listed per module")
+    parser.add_argument("--construct", action="store_true", help="Also build and time the module's Lazy objects")
+    parser.add_argument("--json", dest="json_path", help="Write the profiles to this file")
+    args = parser.parse_args()
+
+    profiles = []
+    for module in args.modules:
+        profile = profile_module(module, construct=args.construct)
+        profiles.append(profile)
+        _print_profile(profile, args.top)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as output:
+            json.dump(profiles, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# Session service that only loads the tail of a session's event history
+
+from datetime import datetime
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import Session
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageAppState,
+    StorageEvent,
+    StorageSession,
+    StorageUserState,
+    _merge_state,
+)
+from sqlalchemy import and_, literal_column, or_, select
+
+from adk_helpers.compaction import compaction_of, live_summaries
+from adk_helpers.event_codec import check_uncompressed
+
+
+class TailWindowSessionService(DatabaseSessionService):
+    """DatabaseSessionService that keeps per-turn load time flat for long sessions.
+
+    get_session (without an explicit config) loads only:
+    - the last `tail_size` events,
+    - the latest compaction summary together with the events since the start of the
+      range it summarizes, so the prompt and the next compaction see the same
+      history they would with a full load, and
+    - every older summary not merged into another one (TokenBudgetCompactionPlugin
+      with merge_fanout), which holds the older context and takes part in the merges.
+
+    Everything older stays in the database until load_older_events is called.
+    Sessions of apps without event compaction only see their last `tail_size` events.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        tail_size: int = 30,
+        page_size: int = 50,
+        **kwargs: Any,
+    ):
+        super().__init__(db_url=db_url, **kwargs)
+        check_uncompressed(self.db_engine, type(self).__name__)
+        self.tail_size = tail_size
+        self.page_size = page_size
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        # An explicit config asks for a specific window, honour it as is
+        if config is not None:
+            return await super().get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id, config=config
+            )
+
+        with self.database_session_factory() as sql_session:
+            storage_session = sql_session.get(
+                StorageSession, (app_name, user_id, session_id)
+            )
+            if storage_session is None:
+                return None
+
+            # 1. The last tail_size events
+            result = sql_session.execute(
+                _events_query(app_name, user_id, session_id)
+                .order_by(StorageEvent.timestamp.desc())
+                .limit(self.tail_size)
+            )
+            storage_events = list(reversed(result.scalars().all()))
+
+            # 2. Extend the window back to the start of the latest compaction
+            summaries = self._summary_events(sql_session, app_name, user_id, session_id)
+            compaction_start = _latest_compaction_start(summaries)
+            if compaction_start is not None:
+                compaction_start = datetime.fromtimestamp(compaction_start)
+            if (
+                storage_events
+                and compaction_start is not None
+                and compaction_start < storage_events[0].timestamp
+            ):
+                result = sql_session.execute(
+                    _events_query(app_name, user_id, session_id)
+                    .filter(StorageEvent.timestamp >= compaction_start)
+                    .filter(StorageEvent.timestamp < storage_events[0].timestamp)
+                    .order_by(StorageEvent.timestamp)
+                )
+                storage_events = list(result.scalars().all()) + storage_events
+
+            storage_app_state = sql_session.get(StorageAppState, (app_name))
+            storage_user_state = sql_session.get(
+                StorageUserState, (app_name, user_id)
+            )
+            merged_state = _merge_state(
+                storage_app_state.state if storage_app_state else {},
+                storage_user_state.state if storage_user_state else {},
+                storage_session.state,
+            )
+
+            # 3. The live summaries older than the window, they come before all of it
+            events = [e.to_event() for e in storage_events]
+            loaded = {event.id for event in events}
+            events = [event for event in live_summaries(summaries) if event.id not in loaded] + events
+            return storage_session.to_session(state=merged_state, events=events)
+
+    def window_events(self, events: list[Event]) -> list[Event]:
+        """The events of a session get_session would load, out of the ones held in memory.
+
+        Layers keeping sessions in memory (CachedSessionService) trim them with this
+        after each append, so they serve the same history as a fresh load.
+        """
+        events = sorted(events, key=lambda event: event.timestamp)
+        summaries = [event for event in events if _is_summary(event)]
+        window_start = max(0, len(events) - self.tail_size)
+        compaction_start = _latest_compaction_start(summaries)
+        if compaction_start is not None:
+            while window_start > 0 and events[window_start - 1].timestamp >= compaction_start:
+                window_start -= 1
+        window = events[window_start:]
+        in_window = {id(event) for event in window}
+        return [event for event in live_summaries(summaries) if id(event) not in in_window] + window
+
+    async def load_older_events(
+        self, session: Session, limit: Optional[int] = None
+    ) -> list[Event]:
+        """Page in the events that precede the ones already loaded in the session.
+
+        The events are merged into `session.events` in chronological order. The older
+        summaries get_session loads ahead of the window do not count as loaded history.
+
+        Args:
+            session: A session returned by get_session.
+            limit: The maximum number of events to load, defaults to `page_size`.
+
+        Returns:
+            The loaded events, an empty list once the start of the history is reached.
+        """
+        stmt = _events_query(session.app_name, session.user_id, session.id)
+
+        history = [e for e in session.events if not _is_summary(e)]
+        if history:
+            # Events sharing the boundary timestamp are told apart by id
+            boundary = datetime.fromtimestamp(history[0].timestamp)
+            loaded_at_boundary = [
+                e.id for e in history if e.timestamp == history[0].timestamp
+            ]
+            stmt = stmt.filter(
+                or_(
+                    StorageEvent.timestamp < boundary,
+                    and_(
+                        StorageEvent.timestamp == boundary,
+                        StorageEvent.id.not_in(loaded_at_boundary),
+                    ),
+                )
+            )
+        loaded_summaries = [e.id for e in session.events if _is_summary(e)]
+        if loaded_summaries:
+            stmt = stmt.filter(StorageEvent.id.not_in(loaded_summaries))
+
+        stmt = stmt.order_by(StorageEvent.timestamp.desc()).limit(limit or self.page_size)
+        with self.database_session_factory() as sql_session:
+            result = sql_session.execute(stmt)
+            older_events = [e.to_event() for e in reversed(result.scalars().all())]
+
+        session.events[:] = sorted(session.events + older_events, key=lambda e: e.timestamp)
+        return older_events
+
+    def _summary_events(
+        self, sql_session, app_name: str, user_id: str, session_id: str
+    ) -> list[Event]:
+        # Compaction events are authored by "user" and carry no content, which
+        # narrows the rows whose pickled actions have to be inspected. The author is
+        # a literal so SQLite can use the ix_events_session_compactions partial index
+        result = sql_session.execute(
+            _events_query(app_name, user_id, session_id)
+            .filter(StorageEvent.author == literal_column("'user'"))
+            .filter(StorageEvent.content.is_(None))
+            .order_by(StorageEvent.timestamp)
+        )
+        events = (storage_event.to_event() for storage_event in result.scalars())
+        return [event for event in events if _is_summary(event)]
+
+
+def _is_summary(event: Event) -> bool:
+    compaction = compaction_of(event)
+    return (
+        compaction is not None
+        and compaction.start_timestamp is not None
+        and compaction.end_timestamp is not None
+    )
+
+
+def _latest_compaction_start(summaries: list[Event]) -> Optional[float]:
+    # A merge ends where the last summary it merges ends, the narrower range wins the tie
+    if not summaries:
+        return None
+    latest = max(
+        (compaction_of(event) for event in summaries),
+        key=lambda compaction: (compaction.end_timestamp, compaction.start_timestamp),
+    )
+    return latest.start_timestamp
+
+
+def _events_query(app_name: str, user_id: str, session_id: str):
+    return (
+        select(StorageEvent)
+        .filter(StorageEvent.app_name == app_name)
+        .filter(StorageEvent.user_id == user_id)
+        .filter(StorageEvent.session_id == session_id)
+    )
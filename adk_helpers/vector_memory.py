@@ -0,0 +1,295 @@
+# Local vector memory service for the load_memory tool, no external vector DB
+#
+# Keyword recall (InMemoryMemoryService, BM25MemoryService) only finds events
+# sharing words with the query. This service embeds every remembered event with
+# a local embedder and answers with the events closest to the query embedding:
+# "trip to Lisbon" finds "travelling to Lisbon next week".
+#
+# The embeddings of a user are rows of one contiguous float32 matrix, a search is
+# one matrix-vector product and an argpartition. Above `ann_threshold` events an
+# IVF index (k-means cells, only the `nprobe` cells closest to the query are
+# scanned) keeps searches sublinear.
+#
+# Usage:
+#   memory_service = VectorMemoryService(embedder=TfidfEmbedder(), top_k=10)
+#   Runner(app=..., session_service=..., memory_service=memory_service)
+
+import hashlib
+import math
+import re
+import threading
+from typing import Optional, Protocol
+
+from google.adk.events.event import Event
+from google.adk.memory import _utils
+from google.adk.memory.base_memory_service import SearchMemoryResponse
+from google.adk.memory.memory_entry import MemoryEntry
+
+from adk_helpers.memory import IncrementalMemoryService, event_text
+
+try:
+    import numpy
+except ImportError:  # Only needed by this module, the other memory services are pure Python
+    numpy = None
+
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class Embedder(Protocol):
+    """Turns texts into L2-normalized float32 rows, the same dimension for documents and queries."""
+
+    dim: int
+
+    def embed_documents(self, texts: list[str]): ...
+
+    def embed_query(self, text: str): ...
+
+
+class HashingEmbedder:
+    """Feature hashing of words, word bigrams and character trigrams.
+
+    Character trigrams make inflections and close spellings share features
+    ("travel", "travelling"), word bigrams keep some word order. Buckets come
+    from blake2b, so embeddings are stable across processes (unlike hash()).
+
+    Args:
+        dim: Embedding dimension.
+        char_ngrams: Also hash the character trigrams of every word.
+    """
+
+    def __init__(self, dim: int = 512, char_ngrams: bool = True):
+        if numpy is None:
+            raise ValueError("Vector memory needs the `numpy` package")
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self._bucket_cache: dict[str, tuple[int, float]] = {}
+
+    def features(self, text: str) -> dict[str, float]:
+        words = _WORD_PATTERN.findall(text.lower())
+        counts: dict[str, float] = {}
+        for position, word in enumerate(words):
+            counts[word] = counts.get(word, 0.0) + 1.0
+            if position:
+                bigram = f"{words[position - 1]} {word}"
+                counts[bigram] = counts.get(bigram, 0.0) + 1.0
+            if self.char_ngrams and len(word) > 3:
+                padded = f"<{word}>"
+                for start in range(len(padded) - 2):
+                    trigram = "#" + padded[start:start + 3]
+                    # Trigrams count less than whole words
+                    counts[trigram] = counts.get(trigram, 0.0) + 0.25
+        # Sublinear term frequency, a repeated word is not ten times as relevant
+        return {feature: 1.0 + math.log(count) if count >= 1 else count for feature, count in counts.items()}
+
+    def embed_documents(self, texts: list[str]):
+        return numpy.vstack([self._vector(self.features(text)) for text in texts]) if texts else numpy.zeros((0, self.dim), numpy.float32)
+
+    def embed_query(self, text: str):
+        return self._vector(self.features(text))
+
+    def _bucket(self, feature: str) -> tuple[int, float]:
+        bucket = self._bucket_cache.get(feature)
+        if bucket is None:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            # The sign bit halves the bias of colliding features
+            bucket = (digest % self.dim, 1.0 if digest >> 63 else -1.0)
+            if len(self._bucket_cache) < 1_000_000:
+                self._bucket_cache[feature] = bucket
+        return bucket
+
+    def _vector(self, features: dict[str, float], weights: Optional[dict[str, float]] = None):
+        vector = numpy.zeros(self.dim, numpy.float32)
+        for feature, value in features.items():
+            index, sign = self._bucket(feature)
+            vector[index] += sign * value * (weights.get(feature, 1.0) if weights else 1.0)
+        norm = numpy.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class TfidfEmbedder(HashingEmbedder):
+    """HashingEmbedder with inverse document frequencies applied to the query.
+
+    Document frequencies are counted as documents are embedded. Stored rows keep
+    plain term frequencies (they never need re-embedding as the counts move), the
+    query is weighted by idf, so rare shared words weigh more than common ones.
+    """
+
+    def __init__(self, dim: int = 512, char_ngrams: bool = True):
+        super().__init__(dim=dim, char_ngrams=char_ngrams)
+        self.documents = 0
+        self.document_frequency: dict[str, int] = {}
+
+    def embed_documents(self, texts: list[str]):
+        rows = []
+        for text in texts:
+            features = self.features(text)
+            self.documents += 1
+            for feature in features:
+                self.document_frequency[feature] = self.document_frequency.get(feature, 0) + 1
+            rows.append(self._vector(features))
+        return numpy.vstack(rows) if rows else numpy.zeros((0, self.dim), numpy.float32)
+
+    def embed_query(self, text: str):
+        features = self.features(text)
+        weights = {
+            feature: math.log((1 + self.documents) / (1 + self.document_frequency.get(feature, 0))) + 1.0
+            for feature in features
+        }
+        return self._vector(features, weights)
+
+
+def _train_centroids(matrix, cells: int, iterations: int = 8, seed: int = 0):
+    # Spherical k-means on a sample: rows are unit vectors, similarity is the dot product
+    rng = numpy.random.default_rng(seed)
+    sample = matrix[rng.choice(len(matrix), size=min(len(matrix), cells * 32), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=cells, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = numpy.argmax(sample @ centroids.T, axis=1)
+        order = numpy.argsort(assignment, kind="stable")
+        present, starts = numpy.unique(assignment[order], return_index=True)
+        sums = numpy.add.reduceat(sample[order], starts, axis=0)
+        norms = numpy.linalg.norm(sums, axis=1, keepdims=True)
+        centroids[present] = sums / numpy.maximum(norms, 1e-12)
+    return centroids
+
+
+class _UserVectors:
+    """Embeddings of the events remembered for one user, rows of one contiguous matrix.
+
+    Once an IVF index is built the first `indexed` rows are sorted by cell, cell c
+    being rows offsets[c]:offsets[c + 1], so a cell is scored as a view of the
+    matrix, without gathering rows. Rows added since are assigned a cell as they
+    come, in `tail_cells`, and gathered when their cell is probed.
+    """
+
+    def __init__(self, dim: int):
+        self.matrix = numpy.zeros((1024, dim), numpy.float32)
+        self.size = 0
+        self.events: list[Event] = []
+        self.centroids = None
+        self.offsets = None
+        self.indexed = 0
+        self.tail_cells = None
+
+    def add(self, events: list[Event], rows):
+        if self.size + len(rows) > len(self.matrix):
+            # Capacity doubles, appending stays amortized O(1) per row
+            capacity = max(2 * len(self.matrix), self.size + len(rows))
+            matrix = numpy.zeros((capacity, self.matrix.shape[1]), numpy.float32)
+            matrix[: self.size] = self.matrix[: self.size]
+            self.matrix = matrix
+        self.matrix[self.size: self.size + len(rows)] = rows
+        self.size += len(rows)
+        self.events.extend(events)
+        if self.centroids is not None:
+            self.tail_cells = numpy.concatenate([self.tail_cells, numpy.argmax(rows @ self.centroids.T, axis=1)])
+
+    def build_ivf(self, cells: int):
+        # k-means picks its initial centroids among the rows, at most one cell per row
+        cells = min(cells, self.size)
+        rows = self.matrix[: self.size]
+        self.centroids = _train_centroids(rows, cells)
+        assignment = numpy.argmax(rows @ self.centroids.T, axis=1)
+        order = numpy.argsort(assignment, kind="stable")
+        self.matrix[: self.size] = rows[order]
+        self.events = [self.events[position] for position in order.tolist()]
+        self.offsets = numpy.searchsorted(assignment[order], numpy.arange(cells + 1))
+        self.indexed = self.size
+        self.tail_cells = numpy.zeros(0, numpy.int64)
+
+    def score(self, query, nprobe: int):
+        """Scores and row numbers of the rows in the cells closest to the query, all rows without an index."""
+        if self.centroids is None:
+            return self.matrix[: self.size] @ query, numpy.arange(self.size)
+        cells = numpy.argsort(self.centroids @ query)[::-1][:nprobe]
+        ranges = [(int(self.offsets[cell]), int(self.offsets[cell + 1])) for cell in cells.tolist()]
+        tail = self.indexed + numpy.flatnonzero(numpy.isin(self.tail_cells, cells))
+        scores = [self.matrix[start:end] @ query for start, end in ranges] + [self.matrix[tail] @ query]
+        rows = [numpy.arange(start, end) for start, end in ranges] + [tail]
+        return numpy.concatenate(scores), numpy.concatenate(rows)
+
+
+class VectorMemoryService(IncrementalMemoryService):
+    """Memory service returning the remembered events closest to the query embedding.
+
+    Searches are exact (brute-force dot products over the user's matrix) up to
+    `ann_threshold` events, approximate above: an IVF index of about sqrt(n)
+    cells is built, rebuilt once a quarter more events came in, and only the
+    `nprobe` cells closest to the query are scored.
+
+    Args:
+        embedder: Local embedder, defaults to TfidfEmbedder().
+        top_k: Number of events returned by a search.
+        min_score: Events scoring at or below it are not returned.
+        ann_threshold: Number of events of a user above which the IVF index is used, None to never use it.
+        nprobe: Number of IVF cells scanned per search.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        top_k: int = 10,
+        min_score: float = 0.0,
+        ann_threshold: Optional[int] = 20_000,
+        nprobe: int = 32,
+    ):
+        if numpy is None:
+            raise ValueError("VectorMemoryService needs the `numpy` package")
+        if ann_threshold is not None and ann_threshold < 1:
+            raise ValueError("ann_threshold must be at least 1")
+        super().__init__()
+        self.embedder = embedder or TfidfEmbedder()
+        self.top_k = top_k
+        self.min_score = min_score
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._users: dict[str, _UserVectors] = {}
+
+    async def add_events_to_memory(self, *, app_name: str, user_id: str, session_id: str, events: list[Event]):
+        events = [event for event in events if event_text(event).strip()]
+        if not events:
+            return
+        with self._lock:
+            # Embedding under the lock too: TfidfEmbedder counts document frequencies
+            rows = self.embedder.embed_documents([event_text(event) for event in events])
+            vectors = self._users.setdefault(f"{app_name}/{user_id}", _UserVectors(self.embedder.dim))
+            vectors.add(events, rows)
+            if self.ann_threshold is not None and vectors.size >= self.ann_threshold:
+                # Rebuilt once the unindexed tail reaches a quarter of the indexed rows
+                if vectors.centroids is None or vectors.size >= 1.25 * vectors.indexed:
+                    vectors.build_ivf(cells=max(16, int(math.sqrt(vectors.size))))
+
+    async def search_memory(self, *, app_name: str, user_id: str, query: str) -> SearchMemoryResponse:
+        response = SearchMemoryResponse()
+        for _, event in self.search(app_name, user_id, query):
+            response.memories.append(
+                MemoryEntry(
+                    content=event.content,
+                    author=event.author,
+                    timestamp=_utils.format_timestamp(event.timestamp),
+                )
+            )
+        return response
+
+    def search(self, app_name: str, user_id: str, query: str, top_k: Optional[int] = None) -> list[tuple[float, Event]]:
+        """The closest events to the query with their cosine similarities, best first."""
+        top_k = top_k or self.top_k
+        with self._lock:
+            vectors = self._users.get(f"{app_name}/{user_id}")
+            if vectors is None or not vectors.size:
+                return []
+            query_vector = self.embedder.embed_query(query)
+            scores, rows = vectors.score(query_vector, self.nprobe)
+
+            if len(scores) > top_k:
+                best = numpy.argpartition(-scores, top_k)[:top_k]
+            else:
+                best = numpy.arange(len(scores))
+            best = best[numpy.argsort(-scores[best])]
+            return [
+                (float(scores[position]), vectors.events[int(rows[position])])
+                for position in best
+                if scores[position] > self.min_score
+            ]
@@ -0,0 +1,358 @@
+# Write-behind layer that batches event persistence in front of a DatabaseSessionService
+
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions import BaseSessionService, Session
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import (
+    DatabaseSessionService,
+    StorageEvent,
+    StorageSession,
+)
+
+from adk_helpers.event_codec import check_uncompressed
+from adk_helpers.sessions import apply_state_delta
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindSessionService(BaseSessionService):
+    """Buffers appended events in memory and persists them in batched transactions.
+
+    Every event is first appended to a journal file (one JSON line), then applied to
+    the in-memory session and queued. The queue is written to the database in a
+    single transaction, off the event loop, when it reaches `batch_size` events,
+    every `flush_interval` seconds, before any read of the database and on close().
+    A failed write keeps the events queued and journaled for the next flush; the
+    periodic flush logs it and tries again after `flush_interval`.
+
+    The journal is fsync'ed as a group commit: one fsync, off the event loop, for
+    everything journaled during `sync_interval`. A crash of the process loses
+    nothing (every line is handed to the OS when the event is appended), a crash of
+    the machine at most the last `sync_interval` seconds of events.
+
+    Each process journals to its own file, `<database>-writebehind-<pid>.jsonl`,
+    locked while the process runs. On start, the journals no live process holds
+    are replayed into the database.
+
+    The hooks of the base service still apply: the stale-session check of
+    append_event (once per session and batch), the state storage and the
+    checkpoints of a DeltaStateSessionService.
+
+    Opt-in: wrap the DatabaseSessionService the runner would otherwise use and call
+    close() when shutting down.
+    """
+
+    def __init__(
+        self,
+        base_service: DatabaseSessionService,
+        batch_size: int = 32,
+        flush_interval: float = 1.0,
+        journal_path: Optional[str] = None,
+        fsync: bool = True,
+        sync_interval: float = 0.05,
+    ):
+        # Subclasses (TailWindow, DeltaState, Compressed) check their database themselves
+        if type(base_service) is DatabaseSessionService:
+            check_uncompressed(base_service.db_engine, "DatabaseSessionService")
+        self.base_service = base_service
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.sync_interval = sync_interval
+
+        if journal_path is None:
+            database = base_service.db_engine.url.database
+            if not database or database == ":memory:":
+                raise ValueError("journal_path is required for non file-based databases")
+            journals = glob.glob(glob.escape(database) + "-writebehind-*.jsonl")
+            journal_path = f"{database}-writebehind-{os.getpid()}.jsonl"
+        else:
+            journals = [journal_path]
+        self.journal_path = journal_path
+        # Base services keeping state their own way (e.g. DeltaStateSessionService) provide it
+        self._apply_state_delta = getattr(base_service, "apply_state_delta", apply_state_delta)
+        self._last_update_time = getattr(base_service, "_last_update_time", _last_update_time)
+        self._maybe_checkpoint = getattr(base_service, "_maybe_checkpoint", None)
+
+        # (session, event) pairs waiting to be written, and the sessions they belong to
+        self._pending: list[tuple[Session, Event]] = []
+        self._pending_sessions: set[tuple[str, str, str]] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        # One write at a time, readers wait for the write in flight
+        self._flush_lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Replay whatever previous processes journaled but did not flush
+        self.recovered_events = sum(self._recover(path) for path in sorted(journals))
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(self._journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._journal.close()
+            raise ValueError(f"The journal {self.journal_path} is used by another process")
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        await self.flush()
+        return await self.base_service.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        # Readers must see every event that was appended so far
+        await self.flush()
+        return await self.base_service.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        await self.flush()
+        return await self.base_service.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        await self.flush()
+        await self.base_service.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if self._closed:
+            raise RuntimeError("WriteBehindSessionService is closed")
+        if event.partial:
+            return event
+
+        event = self._trim_temp_delta_state(event)
+        key = _session_key(session)
+        if key not in self._pending_sessions:
+            # The events queued after this one extend the same handle, checking it once per batch is enough
+            self._check_not_stale(session)
+        self._write_journal(session, event)
+        # Update the in-memory session right away, the database catches up later
+        await super().append_event(session=session, event=event)
+        self._pending.append((session, event))
+        self._pending_sessions.add(key)
+
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(
+                self._flush_after_interval()
+            )
+        return event
+
+    async def flush(self) -> int:
+        """Write all pending events in one transaction, returns the number written.
+
+        Waits for the write in flight first, if any.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, []
+            pending_sessions, self._pending_sessions = self._pending_sessions, set()
+
+            try:
+                update_times = await asyncio.to_thread(self._write, pending)
+            except BaseException:
+                # Nothing was written: the events stay queued, and journaled, for the next flush
+                self._pending[:0] = pending
+                self._pending_sessions |= pending_sessions
+                raise
+
+            # Keep the handles usable with the base service's stale-session check
+            for session, _ in pending:
+                session.last_update_time = update_times.get(
+                    _session_key(session), session.last_update_time
+                )
+
+            # Events appended while the batch was written are journaled but not written yet
+            if not self._pending:
+                self._journal.truncate(0)
+                self._journal.seek(0)
+
+            if self._maybe_checkpoint is not None:
+                await asyncio.to_thread(self._checkpoint, pending)
+            return len(pending)
+
+    async def close(self) -> None:
+        """Flush the remaining events and close the journal."""
+        if self._closed:
+            return
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        # The database holds every event, the journal needs no more syncing
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+        self._journal.close()
+        os.remove(self.journal_path)
+        self._closed = True
+
+    async def _flush_after_interval(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                # Cancelled by close(), the write in flight still finishes and close() waits for it
+                await asyncio.shield(self.flush())
+            except Exception:
+                logger.exception(
+                    "Write-behind flush failed, %d events stay queued", len(self._pending)
+                )
+
+    def _write(self, pending: list[tuple[Session, Event]]) -> dict[tuple[str, str, str], float]:
+        with self.base_service.database_session_factory() as sql_session:
+            storage_sessions = _write_events(
+                sql_session,
+                [(_session_key(s), e) for s, e in pending],
+                self._apply_state_delta,
+            )
+            sql_session.commit()
+            return {
+                key: self._last_update_time(sql_session, storage_session)
+                for key, storage_session in storage_sessions.items()
+            }
+
+    def _checkpoint(self, pending: list[tuple[Session, Event]]):
+        for session, event in pending:
+            if event.actions and event.actions.state_delta:
+                self._maybe_checkpoint(session.app_name, session.user_id, session.id, event)
+
+    async def _sync_after_interval(self):
+        await asyncio.sleep(self.sync_interval)
+        # The thread syncs a duplicate of the descriptor, close() may close the journal meanwhile
+        await asyncio.to_thread(_fsync, os.dup(self._journal.fileno()))
+
+    def _check_not_stale(self, session: Session):
+        with self.base_service.database_session_factory() as sql_session:
+            storage_session = sql_session.get(StorageSession, _session_key(session))
+            if (
+                storage_session is not None
+                and self._last_update_time(sql_session, storage_session) > session.last_update_time
+            ):
+                raise ValueError(
+                    "The last_update_time provided in the session object is earlier than"
+                    " the update_time in the storage_session. Please check if it is a"
+                    " stale session."
+                )
+
+    def _write_journal(self, session: Session, event: Event):
+        record = {
+            "app_name": session.app_name,
+            "user_id": session.user_id,
+            "session_id": session.id,
+            "event": event.model_dump(mode="json", exclude_none=True),
+        }
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        if self.fsync and (self._sync_task is None or self._sync_task.done()):
+            self._sync_task = asyncio.get_running_loop().create_task(self._sync_after_interval())
+
+    def _recover(self, journal_path: str) -> int:
+        try:
+            journal = open(journal_path, "r+", encoding="utf-8")
+        except FileNotFoundError:
+            return 0
+        with journal:
+            try:
+                fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # The journal of a running process
+                return 0
+            recovered = self._replay(journal)
+            os.remove(journal_path)
+        return recovered
+
+    def _replay(self, journal) -> int:
+        entries = []
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn write of the last line during the crash
+                break
+            key = (record["app_name"], record["user_id"], record["session_id"])
+            entries.append((key, Event.model_validate(record["event"])))
+        if not entries:
+            return 0
+
+        with self.base_service.database_session_factory() as sql_session:
+            # Events that were flushed before the journal got truncated are skipped
+            entries = [
+                (key, event)
+                for key, event in entries
+                if sql_session.get(StorageEvent, (event.id, *key)) is None
+            ]
+            _write_events(sql_session, entries, self._apply_state_delta)
+            sql_session.commit()
+        return len(entries)
+
+
+def _session_key(session: Session) -> tuple[str, str, str]:
+    return (session.app_name, session.user_id, session.id)
+
+
+def _last_update_time(sql_session, storage_session: StorageSession) -> float:
+    return storage_session.update_timestamp_tz
+
+
+def _fsync(descriptor: int):
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def _write_events(
+    sql_session, entries, apply_state=apply_state_delta
+) -> dict[tuple[str, str, str], StorageSession]:
+    storage_sessions = {}
+    for key, event in entries:
+        app_name, user_id, session_id = key
+        storage_session = storage_sessions.get(key)
+        if storage_session is None:
+            storage_session = sql_session.get(StorageSession, key)
+            if storage_session is None:
+                # The session was deleted meanwhile, its events go with it
+                continue
+            storage_sessions[key] = storage_session
+
+        apply_state(sql_session, storage_session, event)
+
+        sql_session.add(
+            StorageEvent.from_event(
+                Session(app_name=app_name, user_id=user_id, id=session_id), event
+            )
+        )
+    return storage_sessions
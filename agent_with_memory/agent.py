@@ -1,4 +1,5 @@
 # This file includes creating and managing sessions using ADK
+# Run from the repository root (it imports adk_helpers): python -m agent_with_memory.agent
 
 # Importing libraries
 from dotenv import load_dotenv
@@ -10,15 +11,13 @@ from google.genai import types
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService, DatabaseSessionService
 from typing import Dict, Any
-from google.adk.apps.app import App, EventsCompactionConfig
+from google.adk.apps.app import App
 from google.adk.tools.tool_context import ToolContext
-
-# Checking configuration
-load_dotenv()
-google_api_key = os.getenv("GOOGLE_API_KEY")
-if not google_api_key:
-    raise ValueError("Configuration Error")
-
+from adk_helpers.compaction import CompactionWorker, TokenBudgetCompactionPlugin
+from adk_helpers.console import STREAMING_RUN_CONFIG, ResponsePrinter, run_console
+from adk_helpers.lazy import Lazy, LazyModel
+from adk_helpers.session_cache import CachedSessionService
+from adk_helpers.sessions import get_or_create_session
 
 # Create retry configuration
 def create_retry_config():
@@ -30,12 +29,12 @@ def create_retry_config():
         http_status_codes=[429, 500, 502, 503, 504]
     )
 
-retry_config = create_retry_config()
-
 
 # Create DB persistence
 db_url = "sqlite:///my_agent_with_event_compaction.db"
-session_service = DatabaseSessionService(db_url=db_url)
+# Hydrated sessions are cached between turns, validated against the DB on every lookup
+# Built on first use: importing the module (adk web, workers) does not open the database
+session_service = Lazy(lambda: CachedSessionService(DatabaseSessionService(db_url=db_url)), "session_service")
 
 # Helper function that helps to manage the complete convesation between user and agent, it does creating/retrieving sessions
 # Also, query processing and response streaming
@@ -56,21 +55,15 @@ async def run_session(
 
     # Try to create a new session or retrieve the existing one
     try:
-        session = await session_service.get_session(
-            app_name = app_name,
-            user_id = USER_ID,
-            session_id= session_name
-        )
-        if session != None:
-            ()
-        else:
-            session = await session_service.create_session(
+        session = await get_or_create_session(
+            session_service,
             app_name = app_name,
             user_id = USER_ID,
-            session_id= session_name
+            session_id = session_name
         )
-    except:
-        print("Unable to create session")
+    except Exception as e:
+        print("Unable to create session: ", repr(e))
+        return
     print(session)
     print(type(session))
     # Process queries of user
@@ -89,33 +82,37 @@ async def run_session(
             # Convert query to the ADK content format
             query = types.Content(role="user", parts=[types.Part(text=query)])
 
-            # Stream the agent's response asynchronously
+            # Stream the response as it is generated
+            printer = ResponsePrinter(MODEL_NAME)
             async for event in runner_instance.run_async(
                 user_id = USER_ID,
                 session_id = session.id,
-                new_message = query
+                new_message = query,
+                run_config = STREAMING_RUN_CONFIG
             ):
-                # Check if content of event is valid
-                if event.content and event.content.parts:
-                    # Filter out empty or "None" response before printing
-                    if (event.content.parts[0].text != "None"
-                        and event.content.parts[0].text
-                    ): 
-                        print(f"{MODEL_NAME}: ", event.content.parts[0].text)
+                printer(event)
     
     else:
         print("No queries")
 
-print("Created helper function")
-
 MODEL_NAME = "gemini-2.5-flash-lite"
 
+
+# Checking configuration, on the first request: importing the module (adk web, workers) needs no API key
+def create_model():
+    """Return the Gemini model"""
+    load_dotenv()
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("Configuration Error")
+    return Gemini(
+        model = MODEL_NAME,
+        retry_options = create_retry_config()
+    )
+
 chatbot_agent = Agent(
     name="agent_with_memory",
-    model = Gemini(
-        model = MODEL_NAME,
-        retry_options = retry_config
-    ),
+    model = LazyModel(model = MODEL_NAME, factory = create_model),
     description="A text chatbot"
 )
 
@@ -135,23 +132,28 @@ INITIAL_STATE = {"name": "bhoot",
     
 # )
 
-print("Agent Initialized")
-
 # Defining app for event compaction
+# Summaries are written by a background worker, the turn never waits for the summarization call
+compaction_worker = CompactionWorker()
+
 research_app_compacting = App(
     name = "research_app_compacting",
     root_agent= chatbot_agent,
-    events_compaction_config = EventsCompactionConfig(
-        compaction_interval = 5,
-        overlap_size = 2
-    ),
+    plugins = [
+        TokenBudgetCompactionPlugin(
+            token_budget = 8000,
+            keep_recent_tokens = 2000,
+            overlap_size = 2,
+            worker = compaction_worker
+        )
+    ],
 )
 
 # Creating a runner for compact app
-research_runner = Runner(
+research_runner = Lazy(lambda: Runner(
     app = research_app_compacting, 
-    session_service = session_service
-)
+    session_service = session_service.get()
+), "research_runner")
 
 
 # async def main():
@@ -169,14 +171,13 @@ research_runner = Runner(
 #             print("Warning: runner.close() raised: ", repr(e))
          
 async def main():
-    while True:
-        user_input = input("You: ")
-        
-        if user_input.lower() in ["exit"]:
-            print("Ending conversation")
-            break
-        
-        await run_session(research_runner, user_input, "tester_of_agentic_system")
+    try:
+        # stdin is read off the event loop, piped lines are queued as turns
+        await run_console(lambda user_input: run_session(research_runner, user_input, "tester_of_agentic_system"))
+    finally:
+        # Let the pending summaries land before exiting
+        await compaction_worker.close()
+        print("Compaction: ", compaction_worker.stats())
     
 if __name__ == "__main__":
     import asyncio
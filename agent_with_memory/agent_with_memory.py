@@ -1,4 +1,5 @@
 # This file includes required infomation to the user's long memory
+# Run from the repository root (it imports adk_helpers): python -m agent_with_memory.agent_with_memory
 
 
 # Importing libraries
@@ -6,15 +7,19 @@ from google.adk.agents import Agent
 from google.adk.models.google_llm import Gemini
 from google.genai import types
 from google.adk.tools import google_search, ToolContext, load_memory
-from google.adk.apps.app import App, EventsCompactionConfig
-from google.adk.memory import InMemoryMemoryService
+from google.adk.apps.app import App
 from google.adk.runners import Runner
-from google.adk.sessions import DatabaseSessionService
+from adk_helpers.compaction import CompactionWorker, TokenBudgetCompactionPlugin
+from adk_helpers.console import STREAMING_RUN_CONFIG, ResponsePrinter, run_console
+from adk_helpers.delta_state import DeltaStateTailWindowSessionService
+from adk_helpers.fts_memory import SqliteFtsMemoryService
+from adk_helpers.lazy import Lazy, LazyModel
+from adk_helpers.session_cache import CachedSessionService
+from adk_helpers.sessions import get_or_create_session
+from adk_helpers.sharded_sessions import ShardedSessionService
 from dotenv import load_dotenv
 from typing import Dict, Any
 
-load_dotenv()
-
 retry_config = types.HttpRetryOptions(
     attempts=7,
     initial_delay=2,
@@ -22,12 +27,26 @@ retry_config = types.HttpRetryOptions(
     http_status_codes=[429, 500, 502, 503]
 )
 
+# Only the latest compaction summary + the last events are loaded per turn
 database_url = "sqlite:///chatbot.db"
-session_service = DatabaseSessionService(db_url = database_url)
+# Hydrated sessions are cached between turns, validated against the DB on every lookup
+# Users are spread over chatbot-shard-{0..3}.db, each shard with its own writer
+# State changes are stored key by key, like in managing_session_using_tools.py which shares the shards
+# Built on first use: importing the module (adk web, workers) does not create the shards
+session_service = Lazy(lambda: ShardedSessionService(
+    database_url,
+    num_shards = 4,
+    shard_factory = lambda shard_url: CachedSessionService(
+        DeltaStateTailWindowSessionService(db_url = shard_url, tail_size = 30)
+    )
+), "session_service")
 
 # Define memory service
 
-memory_service = InMemoryMemoryService() # Built-in memory service for development and testing
+# Only the events added since the last call are indexed, once per turn
+# load_memory gets the 10 best events by BM25 from an FTS5 index stored in the user's
+# session shard: memory survives restarts and nothing is loaded at startup
+memory_service = Lazy(lambda: SqliteFtsMemoryService(database_url, num_shards = 4, top_k = 10), "memory_service")
 
 # Initial state
 initial_state = {
@@ -46,21 +65,15 @@ async def run_session_with_args(
     app_name = runner_instance.app_name
     # Check if a session exists with session_id if not create one
     try:
-        session = await session_service.get_session(
-            app_name = app_name,
-            user_id = USER_ID,
-            session_id= session_name
-        )
-        if session != None:
-            return
-        else:
-            session = await session_service.create_session(
+        session = await get_or_create_session(
+            session_service,
             app_name = app_name,
             user_id = USER_ID,
-            session_id= session_name
+            session_id = session_name
         )
-    except:
-        print("Unable to create session")
+    except Exception as e:
+        print("Unable to create session: ", repr(e))
+        return
         
     print(type(session))
         
@@ -76,29 +89,40 @@ async def run_session_with_args(
             # Convert the query in ADK content format:
             query = types.Content(role="user", parts=[types.Part(text = query)])
             
-            # Stream the response of agent asynchronously
+            # Stream the response as it is generated
+            printer = ResponsePrinter(runner_instance.app_name)
             async for event in runner_instance.run_async(
                 user_id=USER_ID,
                 session_id=session.id,
-                new_message=query
+                new_message=query,
+                run_config=STREAMING_RUN_CONFIG
             ):
-                if event.content and event.content.parts:
-                    if(event.content.parts[0].text != "None"
-                       and event.content.parts[0].text
-                       ):
-                           print(f"{runner_instance.app_name}: ", event.content.parts[0].text)
-                           await memory_service.add_session_to_memory(session)
+                printer(event)
+
+            # The turn is stored, index its events
+            session = await session_service.get_session(
+                app_name = app_name,
+                user_id = USER_ID,
+                session_id = session.id
+            )
+            await memory_service.add_session_to_memory(session)
     else:   
         print("No queries passed by the user")
         
         
+# Built on the first request, with the .env configuration: importing the module (adk web, workers) reads none
+def create_model():
+    load_dotenv()
+    return Gemini(
+        model="gemini-2.5-flash",
+        retry_options=retry_config
+    )
+
+
 # Defining agent
 root_agent = Agent(
     name="agent_with_memory",
-    model=Gemini(
-        model="gemini-2.5-flash",
-        retry_options=retry_config
-    ),
+    model=LazyModel(model="gemini-2.5-flash", factory=create_model),
     instruction="Helpful chatbot",
     description="""
     You are a helpful chatbot.
@@ -106,32 +130,38 @@ root_agent = Agent(
     tools=[load_memory]
 )
 
+# Summaries are written in the background, after the turn has been answered
+compaction_worker = CompactionWorker()
+
 chatbot_app = App(
     name="agents",
     root_agent=root_agent,
-    # Summarize session conversation using EventCompactionConfig
-    events_compaction_config= EventsCompactionConfig(
-        compaction_interval=3,
-        overlap_size=1
-    )
+    # Summarize session conversation once it grows past ~8k estimated prompt tokens
+    plugins=[
+        TokenBudgetCompactionPlugin(
+            token_budget=8000,
+            keep_recent_tokens=2000,
+            overlap_size=1,
+            merge_fanout=4, # Hierarchical summaries, the prompt keeps O(log n) of them
+            worker=compaction_worker
+        )
+    ]
 )
 
-chatbot_runner = Runner(
+chatbot_runner = Lazy(lambda: Runner(
     app=chatbot_app, # App or agent depending upon the use case or object used to build it
-    session_service=session_service,
-    memory_service=memory_service
-)
+    session_service=session_service.get(),
+    memory_service=memory_service.get()
+), "chatbot_runner")
 
 # Defining async function to start the execution
 async def main():
-    while True:
-        user_input = input("You: ")
-        
-        if user_input.lower() in ["exit"]:
-            print("Ending conversation")
-            break
-        
-        await run_session_with_args(chatbot_runner, user_input, "agent_with_memory_2")
+    try:
+        # stdin is read off the event loop, background tasks keep running between turns
+        await run_console(lambda user_input: run_session_with_args(chatbot_runner, user_input, "agent_with_memory_2"))
+    finally:
+        await compaction_worker.close()
+        print("Compaction: ", compaction_worker.stats())
         
 
 if __name__ == "__main__":
@@ -1,12 +1,12 @@
-import sqlite3
+# Print the events stored in my_agent.db, one JSON line per event
+# For filters and other formats use: python -m adk_helpers.event_export --help
+# Run from the repository root (it imports adk_helpers): python -m agent_with_memory.check_contents_in_db
+import sys
+
+from adk_helpers.event_export import export_events
 
 def check_data_in_db():
-    with sqlite3.connect("my_agent.db") as connection:
-        cursor = connection.cursor()
-        result = cursor.execute(
-            "select app_name, session_id, author, content from events"
-        )
-        for each in result.fetchall():
-            print(each)
-            
-check_data_in_db()
\ No newline at end of file
+    report = export_events("sqlite:///my_agent.db", sys.stdout)
+    print(f"{report['rows']} rows ({report['rows_per_second']:.0f} rows/s)", file=sys.stderr)
+
+check_data_in_db()
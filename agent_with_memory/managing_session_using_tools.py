@@ -1,4 +1,5 @@
 # This file includes how to make changes to a state using tools
+# Run from the repository root (it imports adk_helpers): python -m agent_with_memory.managing_session_using_tools
 
 # Importing libraries
 from google.adk.agents import Agent
@@ -7,12 +8,15 @@ from google.genai import types
 from google.adk.tools import google_search, ToolContext
 from google.adk.apps.app import App, EventsCompactionConfig
 from google.adk.runners import Runner
-from google.adk.sessions import DatabaseSessionService
+from adk_helpers.console import STREAMING_RUN_CONFIG, ResponsePrinter, run_console
+from adk_helpers.delta_state import DeltaStateSessionService
+from adk_helpers.lazy import Lazy, LazyModel
+from adk_helpers.sessions import get_or_create_session
+from adk_helpers.sharded_sessions import ShardedSessionService
+from adk_helpers.write_behind import WriteBehindSessionService
 from dotenv import load_dotenv
 from typing import Dict, Any
 
-load_dotenv()
-
 retry_config = types.HttpRetryOptions(
     attempts = 7,
     initial_delay=2,
@@ -21,7 +25,19 @@ retry_config = types.HttpRetryOptions(
 )
 
 database_url = "sqlite:///chatbot.db"
-session_service = DatabaseSessionService(db_url = database_url)
+# Users are spread over chatbot-shard-{0..3}.db, each shard with its own writer
+# Events of a turn (tool calls included) are journaled and written to the shard in batches
+# State changes (save_user_info) are stored key by key instead of rewriting the state blobs
+# Built on first use: importing the module (adk web, workers) does not create the shards
+session_service = Lazy(lambda: ShardedSessionService(
+    database_url,
+    num_shards = 4,
+    shard_factory = lambda shard_url: WriteBehindSessionService(
+        DeltaStateSessionService(db_url = shard_url),
+        batch_size = 32,
+        flush_interval = 1.0
+    )
+), "session_service")
 
 
 
@@ -42,21 +58,15 @@ async def run_session_with_args(
     app_name = runner_instance.app_name
     # Check if a session exists with session_id if not create one
     try:
-        session = await session_service.get_session(
-            app_name = app_name,
-            user_id = USER_ID,
-            session_id= session_name
-        )
-        if session != None:
-            return
-        else:
-            session = await session_service.create_session(
+        session = await get_or_create_session(
+            session_service,
             app_name = app_name,
             user_id = USER_ID,
-            session_id= session_name
+            session_id = session_name
         )
-    except:
-        print("Unable to create session")
+    except Exception as e:
+        print("Unable to create session: ", repr(e))
+        return
         
     print(type(session))
         
@@ -72,17 +82,15 @@ async def run_session_with_args(
             # Convert the query in ADK content format:
             query = types.Content(role="user", parts=[types.Part(text = query)])
             
-            # Stream the response of agent asynchronously
+            # Stream the response as it is generated
+            printer = ResponsePrinter(runner_instance.app_name)
             async for event in runner_instance.run_async(
                 user_id=USER_ID,
                 session_id = session.id,
-                new_message = query
+                new_message = query,
+                run_config = STREAMING_RUN_CONFIG
             ):
-                if event.content and event.content.parts:
-                    if(event.content.parts[0].text != "None"
-                       and event.content.parts[0].text
-                       ):
-                           print(f"{runner_instance.app_name}: ", event.content.parts[0].text)
+                printer(event)
     else:   
         print("No queries passed by the user")
     
@@ -131,13 +139,19 @@ def retrieve_user_info(
         }
     
     
+# Built on the first request, with the .env configuration: importing the module (adk web, workers) reads none
+def create_model():
+    load_dotenv()
+    return Gemini(
+        model="gemini-2.5-flash",
+        retry_options=retry_config
+    )
+
+
 # Defining agent
 root_agent = Agent(
     name="agent_with_memory",
-    model=Gemini(
-        model="gemini-2.5-flash",
-        retry_options=retry_config
-    ),
+    model=LazyModel(model="gemini-2.5-flash", factory=create_model),
     instruction="Helpful chatbot",
     description="""
     You are a helpful chatbot.
@@ -158,21 +172,20 @@ chatbot_app = App(
     )
 )
 
-chatbot_runner = Runner(
+chatbot_runner = Lazy(lambda: Runner(
     app=chatbot_app, # App or agent depending upon the use case or object used to build it
-    session_service= session_service
-)
+    session_service= session_service.get()
+), "chatbot_runner")
 
 # Defining async function to start the execution
 async def main():
-    while True:
-        user_input = input("You: ")
-        
-        if user_input.lower() in ["exit"]:
-            print("Ending conversation")
-            break
-        
-        await run_session_with_args(chatbot_runner, user_input, "state_management_using_tools-1")
+    try:
+        # stdin is read off the event loop, background tasks keep running between turns
+        await run_console(lambda user_input: run_session_with_args(chatbot_runner, user_input, "state_management_using_tools-1"))
+    finally:
+        # Write the buffered events before exiting, nothing to write if no turn ran
+        if session_service.constructed:
+            await session_service.close()
 
 if __name__ == "__main__":
     import asyncio
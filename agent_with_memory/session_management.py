@@ -1,4 +1,5 @@
 # This file includes creating and managing sessions using ADK
+# Run from the repository root (it imports adk_helpers): python -m agent_with_memory.session_management
 
 # Importing libraries
 from dotenv import load_dotenv
@@ -12,13 +13,13 @@ from google.adk.sessions import InMemorySessionService, DatabaseSessionService
 from typing import Dict, Any
 from google.adk.apps.app import App, EventsCompactionConfig
 from google.adk.tools.tool_context import ToolContext
-
-# Checking configuration
-load_dotenv()
-google_api_key = os.getenv("GOOGLE_API_KEY")
-if not google_api_key:
-    raise ValueError("Configuration Error")
-
+from datetime import timedelta
+from adk_helpers.archival import ArchivingSessionService, SessionArchive, SessionSweeper
+from adk_helpers.console import STREAMING_RUN_CONFIG, ResponsePrinter, run_console
+from adk_helpers.lazy import Lazy, LazyModel
+from adk_helpers.session_cache import CachedSessionService
+from adk_helpers.sessions import get_or_create_session
+from adk_helpers.tail_window import TailWindowSessionService
 
 # Create retry configuration
 def create_retry_config():
@@ -30,12 +31,18 @@ def create_retry_config():
         http_status_codes=[429, 500, 502, 503, 504]
     )
 
-retry_config = create_retry_config()
-
 
 # Create DB persistence
+# Only the latest compaction summary + the last events are loaded per turn
 db_url = "sqlite:///my_agent.db"
-session_service = DatabaseSessionService(db_url=db_url)
+# Hydrated sessions are cached between turns, validated against the DB on every lookup
+# Built on first use: importing the module (adk web, workers) does not open the database
+database_service = Lazy(lambda: TailWindowSessionService(db_url=db_url, tail_size=30), "database_service")
+# Sessions idle for 30 days are moved to my_agent.db.archive.jsonl.gz, and come back when used again
+session_archive = Lazy(lambda: SessionArchive(database_service.get()), "session_archive")
+session_service = Lazy(
+    lambda: ArchivingSessionService(CachedSessionService(database_service.get()), session_archive.get()), "session_service"
+)
 
 # Helper function that helps to manage the complete convesation between user and agent, it does creating/retrieving sessions
 # Also, query processing and response streaming
@@ -56,21 +63,15 @@ async def run_session(
 
     # Try to create a new session or retrieve the existing one
     try:
-        session = await session_service.get_session(
+        session = await get_or_create_session(
+            session_service,
             app_name = app_name,
             user_id = USER_ID,
-            session_id= session_name
+            session_id = session_name
         )
-        if session != None:
-            ()
-        else:
-            session = await session_service.create_session(
-            app_name = app_name,
-            user_id = USER_ID,
-            session_id= session_name
-        )
-    except:
-        print("Unable to create session")
+    except Exception as e:
+        print("Unable to create session: ", repr(e))
+        return
     print(session)
     print(type(session))
     # Process queries of user
@@ -89,33 +90,37 @@ async def run_session(
             # Convert query to the ADK content format
             query = types.Content(role="user", parts=[types.Part(text=query)])
 
-            # Stream the agent's response asynchronously
+            # Stream the response as it is generated
+            printer = ResponsePrinter(MODEL_NAME)
             async for event in runner_instance.run_async(
                 user_id = USER_ID,
                 session_id = session.id,
-                new_message = query
+                new_message = query,
+                run_config = STREAMING_RUN_CONFIG
             ):
-                # Check if content of event is valid
-                if event.content and event.content.parts:
-                    # Filter out empty or "None" response before printing
-                    if (event.content.parts[0].text != "None"
-                        and event.content.parts[0].text
-                    ): 
-                        print(f"{MODEL_NAME}: ", event.content.parts[0].text)
+                printer(event)
     
     else:
         print("No queries")
 
-print("Created helper function")
-
 MODEL_NAME = "gemini-2.5-flash-lite"
 
+
+# Checking configuration, on the first request: importing the module (adk web, workers) needs no API key
+def create_model():
+    """Return the Gemini model"""
+    load_dotenv()
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    if not google_api_key:
+        raise ValueError("Configuration Error")
+    return Gemini(
+        model = MODEL_NAME,
+        retry_options = create_retry_config()
+    )
+
 root_agent = Agent(
     name="agent_with_memory",
-    model = Gemini(
-        model = MODEL_NAME,
-        retry_options = retry_config
-    ),
+    model = LazyModel(model = MODEL_NAME, factory = create_model),
     description="A text chatbot"
 )
 
@@ -128,14 +133,12 @@ SESSION_NAME = "default"
 INITIAL_STATE = {"name": "bhoot",
                  "favourite_destination_to_visit": "guwahti"}
 # Create runner
-runner = Runner(
+runner = Lazy(lambda: Runner(
     agent=root_agent,
     app_name=APP_NAME,
-    session_service=session_service,
+    session_service=session_service.get(),
     
-)
-
-print("Agent Initialized")
+), "runner")
 
 # async def main():
 #     try: 
@@ -152,14 +155,13 @@ print("Agent Initialized")
 #             print("Warning: runner.close() raised: ", repr(e))
          
 async def main():
-    while True:
-        user_input = input("You: ")
-        
-        if user_input.lower() in ["exit"]:
-            print("Ending conversation")
-            break
-        
-        await run_session(runner, user_input, "tester_of_agentic_system")
+    sweeper = SessionSweeper(session_archive, ttl=timedelta(days=30))
+    sweeper.start()
+    try:
+        # stdin is read off the event loop, background tasks keep running between turns
+        await run_console(lambda user_input: run_session(runner, user_input, "tester_of_agentic_system"))
+    finally:
+        await sweeper.stop()
     
 if __name__ == "__main__":
     import asyncio
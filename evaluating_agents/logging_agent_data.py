@@ -1,5 +1,6 @@
 # Includes how to enable obeservability of agentic system using built in plugins
 # This is an reactive approach
+# Run from the repository root (it imports adk_helpers): python -m evaluating_agents.logging_agent_data
 
 # Importing libraries
 from google.adk.agents import Agent
@@ -7,15 +8,17 @@ from google.adk.models.google_llm import Gemini
 from google.genai import types
 from google.adk.tools import google_search, AgentTool
 from google.adk.apps.app import App, EventsCompactionConfig
-from google.adk.memory import InMemoryMemoryService
 from google.adk.runners import Runner
-from google.adk.sessions import DatabaseSessionService
 from google.adk.plugins.logging_plugin import (LoggingPlugin)
+from adk_helpers.console import STREAMING_RUN_CONFIG, ResponsePrinter, run_console
+from adk_helpers.delta_state import DeltaStateSessionService
+from adk_helpers.lazy import Lazy, LazyModel
+from adk_helpers.memory import IncrementalInMemoryMemoryService
+from adk_helpers.sessions import get_or_create_session
+from adk_helpers.sharded_sessions import ShardedSessionService
 from dotenv import load_dotenv
 from typing import Dict, Any
 
-load_dotenv()
-
 retry_config = types.HttpRetryOptions(
     attempts=7,
     initial_delay=2,
@@ -24,11 +27,19 @@ retry_config = types.HttpRetryOptions(
 )
 
 database_url = "sqlite:///chatbot.db"
-session_service = DatabaseSessionService(db_url = database_url)
+# Users are spread over chatbot-shard-{0..3}.db, each shard with its own writer
+# State changes are stored key by key, like the other scripts sharing the shards
+# Built on first use: importing the module (adk web, workers) does not create the shards
+session_service = Lazy(lambda: ShardedSessionService(
+    database_url,
+    num_shards = 4,
+    shard_factory = lambda shard_url: DeltaStateSessionService(db_url = shard_url)
+), "session_service")
 
 # Define memory service
 
-memory_service = InMemoryMemoryService() # Built-in memory service for development and testing
+# Only the events added since the last call are indexed, once per turn
+memory_service = IncrementalInMemoryMemoryService()
 
 # Initial state
 initial_state = {
@@ -47,21 +58,15 @@ async def run_session_with_args(
     app_name = runner_instance.app_name
     # Check if a session exists with session_id if not create one
     try:
-        session = await session_service.get_session(
-            app_name = app_name,
-            user_id = USER_ID,
-            session_id= session_name
-        )
-        if session != None:
-            return
-        else:
-            session = await session_service.create_session(
+        session = await get_or_create_session(
+            session_service,
             app_name = app_name,
             user_id = USER_ID,
-            session_id= session_name
+            session_id = session_name
         )
-    except:
-        print("Unable to create session")
+    except Exception as e:
+        print("Unable to create session: ", repr(e))
+        return
         
     print(type(session))
         
@@ -77,18 +82,23 @@ async def run_session_with_args(
             # Convert the query in ADK content format:
             query = types.Content(role="user", parts=[types.Part(text = query)])
             
-            # Stream the response of agent asynchronously
+            # Stream the response as it is generated
+            printer = ResponsePrinter(runner_instance.app_name)
             async for event in runner_instance.run_async(
                 user_id=USER_ID,
                 session_id=session.id,
-                new_message=query
+                new_message=query,
+                run_config=STREAMING_RUN_CONFIG
             ):
-                if event.content and event.content.parts:
-                    if(event.content.parts[0].text != "None"
-                       and event.content.parts[0].text
-                       ):
-                           print(f"{runner_instance.app_name}: ", event.content.parts[0].text)
-                           await memory_service.add_session_to_memory(session)
+                printer(event)
+
+            # The turn is stored, index its events
+            session = await session_service.get_session(
+                app_name = app_name,
+                user_id = USER_ID,
+                session_id = session.id
+            )
+            await memory_service.add_session_to_memory(session)
     else:   
         print("No queries passed by the user")
     
@@ -107,13 +117,27 @@ def count_papers(papers: list[str]):
     
     return len(papers)
 
-search_agent = Agent(
-    name="search_agent",
-    model=Gemini(
+# Models are built on the first request, with the .env configuration: importing the module (adk web, workers) reads none
+def create_search_model():
+    load_dotenv()
+    return Gemini(
         model = "gemini-2.5-flash-lite",
         retry_options=retry_config,
         temperature=0.2
-    ),
+    )
+
+
+def create_root_model():
+    load_dotenv()
+    return Gemini(
+        model="gemini-2.5-flash-lite",
+        retry_options=retry_config
+    )
+
+
+search_agent = Agent(
+    name="search_agent",
+    model=LazyModel(model="gemini-2.5-flash-lite", factory=create_search_model),
     description="Searches for research papers using google search",
     instruction="""Use google_search tool to find information on the given topic.
     Return raw search results
@@ -125,10 +149,7 @@ search_agent = Agent(
 # Defining agent
 root_agent = Agent(
     name="evaluating_agents",
-    model=Gemini(
-        model="gemini-2.5-flash-lite",
-        retry_options=retry_config
-    ),
+    model=LazyModel(model="gemini-2.5-flash-lite", factory=create_root_model),
     description="Research paper finder",
     instruction="""
     Your task is to find the research paper and find them.
@@ -155,22 +176,16 @@ chatbot_app = App(
         ] 
 )
 
-chatbot_runner = Runner(
+chatbot_runner = Lazy(lambda: Runner(
     app=chatbot_app, # App or agent depending upon the use case or object used to build it
-    session_service=session_service,
+    session_service=session_service.get(),
     memory_service=memory_service,
-)
+), "chatbot_runner")
 
 # Defining async function to start the execution
 async def main():
-    while True:
-        user_input = input("You: ")
-        
-        if user_input.lower() in ["exit"]:
-            print("Ending conversation")
-            break
-        
-        await run_session_with_args(chatbot_runner, user_input, "agent_with_memory_2")
+    # stdin is read off the event loop, piped lines are queued as turns
+    await run_console(lambda user_input: run_session_with_args(chatbot_runner, user_input, "agent_with_memory_2"))
         
 
 if __name__ == "__main__":